@@ -1,23 +1,49 @@
 # adapters.py
 from abc import ABC, abstractmethod
-from typing import Dict, Any
-import httpx
-import json
+from typing import Dict, Any, List
+import asyncio
+import os
+import time
+import uuid
+
+from money import Money
+
+# Через сколько секунд эмулированные службы считают отправление доставленным
+EMULATED_TRANSIT_SECONDS = float(os.getenv("EMULATED_TRANSIT_SECONDS", "300"))
+# Задержка ответа эмулированного API статусов
+EMULATED_TRACKING_LATENCY = 0.02
 
 
 class PaymentService(ABC):
     @abstractmethod
-    def process_payment(self, amount: float, order_data: Dict[str, Any]) -> Dict[str, Any]:
+    def process_payment(self, amount: Money, order_data: Dict[str, Any]) -> Dict[str, Any]:
         pass
 
 
 class DeliveryService(ABC):
+    # Сколько номеров служба принимает в одном запросе статусов
+    max_tracking_batch = 100
+
     @abstractmethod
     def schedule_delivery(self, order_data: Dict[str, Any]) -> Dict[str, Any]:
         pass
 
+    @abstractmethod
+    async def track_shipments(self, tracking_ids: List[str]) -> Dict[str, str]:
+        """Статусы отправлений одним запросом: номер -> registered, in_transit, delivered или returned.
+
+        Номеров, которых служба не знает, в ответе нет.
+        """
+        pass
+
 
 # Внешние сервисы с разными API
+def _emulated_stage(created: Dict[str, float], tracking_id: str) -> int:
+    """0 — принят, 1 — в пути, 2 — доставлен; неизвестный номер считается только что принятым"""
+    elapsed = time.time() - created.setdefault(tracking_id, time.time())
+    return min(2, int(2 * elapsed / EMULATED_TRANSIT_SECONDS)) if EMULATED_TRANSIT_SECONDS > 0 else 2
+
+
 class YooKassaAPI:
     def create_payment_intent(self, amount_cents: int, currency: str, metadata: dict) -> dict:
         # Эмуляция API ЮKassa
@@ -39,35 +65,62 @@ class SberAPI:
 
 
 class CDEKDeliveryAPI:
+    # Время создания отправлений, известное эмулированной службе
+    _created: Dict[str, float] = {}
+
     def create_shipment(self, recipient: dict, packages: list) -> dict:
         # Эмуляция API СДЭК
+        tracking_id = f"CDEK{uuid.uuid4().hex[:12].upper()}"
+        self._created[tracking_id] = time.time()
         return {
-            "cdek_tracking_id": f"CDEK{id(self)}",
+            "cdek_tracking_id": tracking_id,
             "status": "registered",
             "estimated_delivery": "2024-01-15",
             "delivery_price": 350.00
         }
 
+    async def get_statuses(self, cdek_numbers: list) -> dict:
+        # Эмуляция пакетного запроса статусов СДЭК
+        await asyncio.sleep(EMULATED_TRACKING_LATENCY)
+        codes = ("ACCEPTED", "IN_TRANSIT", "DELIVERED")
+        return {"orders": [
+            {"cdek_number": number, "status_code": codes[_emulated_stage(self._created, number)]}
+            for number in cdek_numbers
+        ]}
+
 
 class YandexMarketAPI:
+    _created: Dict[str, float] = {}
+
     def request_delivery(self, ship_details: dict, commodities: list) -> dict:
         # Эмуляция API Яндекс.Маркет
+        tracking_number = f"YM{uuid.uuid4().hex[:12].upper()}"
+        self._created[tracking_number] = time.time()
         return {
-            "yandex_tracking_number": f"YM{id(self)}",
+            "yandex_tracking_number": tracking_number,
             "service_type": "STANDARD",
             "commit_timestamp": "2024-01-16T12:00:00Z",
             "delivery_cost": 299.00
         }
 
+    async def track(self, tracking_numbers: list) -> list:
+        # Эмуляция пакетного трекинга Яндекс.Маркет
+        await asyncio.sleep(EMULATED_TRACKING_LATENCY)
+        states = ("CREATED", "DELIVERY_TRANSPORTATION", "DELIVERY_DELIVERED")
+        return [
+            {"trackingNumber": number, "state": states[_emulated_stage(self._created, number)]}
+            for number in tracking_numbers
+        ]
+
 
 # Адаптеры платежей
 class YooKassaPaymentAdapter(PaymentService):
     def __init__(self):
         self.yookassa = YooKassaAPI()
 
-    def process_payment(self, amount: float, order_data: Dict[str, Any]) -> Dict[str, Any]:
+    def process_payment(self, amount: Money, order_data: Dict[str, Any]) -> Dict[str, Any]:
         # Адаптация данных под API ЮKassa
-        amount_cents = int(amount * 100)
+        amount_cents = amount.kopecks
         metadata = {
             "order_id": order_data.get("order_id"),
             "user_id": order_data.get("user_id")
@@ -83,7 +136,7 @@ class YooKassaPaymentAdapter(PaymentService):
         return {
             "payment_id": result["yookassa_payment_id"],
             "status": result["status"],
-            "amount": amount,
+            "amount": float(amount),
             "provider": "ЮKassa"
         }
 
@@ -92,28 +145,43 @@ class SberPaymentAdapter(PaymentService):
     def __init__(self):
         self.sber = SberAPI()
 
-    def process_payment(self, amount: float, order_data: Dict[str, Any]) -> Dict[str, Any]:
+    def process_payment(self, amount: Money, order_data: Dict[str, Any]) -> Dict[str, Any]:
         # Адаптация данных под API Сбера
         item_list = [
             {
                 "name": f"Заказ №{order_data.get('order_id')}",
-                "price": amount,
+                "price": float(amount),
                 "quantity": 1
             }
         ]
 
-        result = self.sber.make_payment(amount, item_list)
+        result = self.sber.make_payment(float(amount), item_list)
 
         # Адаптация ответа под наш формат
         return {
             "payment_id": result["sber_transaction_id"],
             "status": "completed" if result["state"] == "completed" else "failed",
-            "amount": amount,
+            "amount": float(amount),
             "provider": "Сбер"
         }
 
 
 # Адаптеры доставки
+# Статусы служб в наши коды отправлений
+CDEK_TRACKING_STATES = {
+    "ACCEPTED": "registered",
+    "IN_TRANSIT": "in_transit",
+    "DELIVERED": "delivered",
+    "RETURNED": "returned",
+}
+YANDEX_TRACKING_STATES = {
+    "CREATED": "registered",
+    "DELIVERY_TRANSPORTATION": "in_transit",
+    "DELIVERY_DELIVERED": "delivered",
+    "RETURN_ARRIVED": "returned",
+}
+
+
 class CDEKDeliveryAdapter(DeliveryService):
     def __init__(self):
         self.cdek = CDEKDeliveryAPI()
@@ -139,8 +207,17 @@ class CDEKDeliveryAdapter(DeliveryService):
             "provider": "СДЭК"
         }
 
+    async def track_shipments(self, tracking_ids: List[str]) -> Dict[str, str]:
+        result = await self.cdek.get_statuses(tracking_ids)
+        return {
+            order["cdek_number"]: CDEK_TRACKING_STATES[order["status_code"]]
+            for order in result["orders"] if order["status_code"] in CDEK_TRACKING_STATES
+        }
+
 
 class YandexMarketDeliveryAdapter(DeliveryService):
+    max_tracking_batch = 50
+
     def __init__(self):
         self.yandex = YandexMarketAPI()
 
@@ -163,4 +240,18 @@ class YandexMarketDeliveryAdapter(DeliveryService):
             "estimated_delivery": result["commit_timestamp"],
             "delivery_price": result["delivery_cost"],
             "provider": "Яндекс.Маркет"
-        }
\ No newline at end of file
+        }
+
+    async def track_shipments(self, tracking_ids: List[str]) -> Dict[str, str]:
+        result = await self.yandex.track(tracking_ids)
+        return {
+            parcel["trackingNumber"]: YANDEX_TRACKING_STATES[parcel["state"]]
+            for parcel in result if parcel["state"] in YANDEX_TRACKING_STATES
+        }
+
+
+# Коды служб, как их передаёт клиент в delivery_provider
+DELIVERY_ADAPTERS = {
+    "cdek": CDEKDeliveryAdapter,
+    "yandex": YandexMarketDeliveryAdapter,
+}
@@ -0,0 +1,269 @@
+# analytics.py
+"""Аналитика продаж: агрегация в SQL и почасовые сводные таблицы.
+
+Сводные таблицы пополняются инкрементально: каждый проход обрабатывает
+только заказы с id больше водяного знака из rollup_state, поэтому
+отчёты по миллионам заказов читают несколько тысяч готовых строк.
+
+В продажи не входят отменённые заказы и заказы с ошибкой оплаты. Заказ,
+который уже попал в сводки и потом сменил статус (отмена по истёкшему
+резерву, оплата после ошибки), поправляет их в той же транзакции, что и
+смена статуса (watch_sales_status_changes).
+"""
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import List, Optional
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import (
+    Category, Decorator, Order, OrderDecorator, OrderItem, Product,
+    DecoratorHourly, OrdersHourly, RollupState, SalesHourly
+)
+from order_status import OrderStatus
+
+ROLLUP_NAME = "sales"
+ROLLUP_BATCH_SIZE = 50000
+# Заказы моложе этого окна ещё могут дописываться в параллельных транзакциях
+ROLLUP_SAFETY_SECONDS = 60
+UPSERT_CHUNK_SIZE = 1000
+# Заказы в этих статусах выручки не дают
+EXCLUDED_STATUSES = (OrderStatus.CANCELLED, OrderStatus.PAYMENT_FAILED)
+
+
+def counts_as_sale(status: Optional[str]) -> bool:
+    return status not in EXCLUDED_STATUSES
+
+
+def time_bucket(column, unit: str, dialect_name: str):
+    """Усечение времени до часа или дня средствами конкретной СУБД"""
+    if dialect_name == "postgresql":
+        return func.date_trunc(unit, column)
+    formats = {"hour": "%Y-%m-%d %H:00:00", "day": "%Y-%m-%d"}
+    return func.strftime(formats[unit], column)
+
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _as_day(value) -> str:
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%Y-%m-%d")
+    return str(value)[:10]
+
+
+def _money(value) -> float:
+    return float(round(Decimal(str(value or 0)), 2))
+
+
+def _upsert_add(db: Session, model, rows: List[dict], key_columns: List[str], sum_columns: List[str]):
+    """INSERT ... ON CONFLICT DO UPDATE с прибавлением счётчиков"""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        statement = insert(model).values(rows[start:start + UPSERT_CHUNK_SIZE])
+        statement = statement.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={column: getattr(model, column) + getattr(statement.excluded, column) for column in sum_columns}
+        )
+        db.execute(statement)
+
+
+def _rollup_range(db: Session, low_id: int, high_id: int):
+    _rollup_orders(db, (Order.id > low_id, Order.id <= high_id, Order.status.not_in(EXCLUDED_STATUSES)))
+
+
+def _rollup_orders(db: Session, in_range, sign: int = 1):
+    """Прибавляет к сводкам заказы, отобранные условиями in_range; sign=-1 вычитает их"""
+    dialect = db.get_bind().dialect.name
+    hour = time_bucket(Order.created_at, "hour", dialect).label("hour")
+
+    sales = db.execute(
+        select(
+            hour, OrderItem.product_id, Product.category_id,
+            func.sum(OrderItem.subtotal), func.sum(OrderItem.quantity), func.count(func.distinct(OrderItem.order_id))
+        )
+        .join(Order, Order.id == OrderItem.order_id)
+        .outerjoin(Product, Product.id == OrderItem.product_id)
+        .where(*in_range)
+        .group_by(hour, OrderItem.product_id, Product.category_id)
+    ).all()
+    _upsert_add(db, SalesHourly, [
+        {"hour": _as_datetime(row[0]), "product_id": row[1], "category_id": row[2],
+         "revenue": (row[3] or 0) * sign, "units": (row[4] or 0) * sign, "orders": row[5] * sign}
+        for row in sales
+    ], ["hour", "product_id"], ["revenue", "units", "orders"])
+
+    orders = db.execute(
+        select(hour, func.count(Order.id), func.sum(Order.total_amount)).where(*in_range).group_by(hour)
+    ).all()
+    _upsert_add(db, OrdersHourly, [
+        {"hour": _as_datetime(row[0]), "orders": row[1] * sign, "revenue": (row[2] or 0) * sign}
+        for row in orders
+    ], ["hour"], ["orders", "revenue"])
+
+    decorators = db.execute(
+        select(hour, OrderDecorator.decorator_id, func.count(func.distinct(OrderDecorator.order_id)))
+        .join(Order, Order.id == OrderDecorator.order_id)
+        .where(*in_range)
+        .group_by(hour, OrderDecorator.decorator_id)
+    ).all()
+    _upsert_add(db, DecoratorHourly, [
+        {"hour": _as_datetime(row[0]), "decorator_id": row[1], "orders": row[2] * sign}
+        for row in decorators
+    ], ["hour", "decorator_id"], ["orders"])
+
+
+def _lock_state(db: Session) -> RollupState:
+    """Строка водяного знака под блокировкой до конца текущей транзакции"""
+    state = db.query(RollupState).filter(RollupState.name == ROLLUP_NAME).with_for_update().first()
+    if state is None:
+        try:
+            with db.begin_nested():
+                db.add(RollupState(name=ROLLUP_NAME, last_order_id=0))
+        except IntegrityError:
+            # Строку одновременно создал другой воркер
+            pass
+        state = db.query(RollupState).filter(RollupState.name == ROLLUP_NAME).with_for_update().one()
+    return state
+
+
+def refresh_rollups(db: Session, batch_size: int = ROLLUP_BATCH_SIZE,
+                    safety_seconds: int = ROLLUP_SAFETY_SECONDS) -> int:
+    """Досчитывает почасовые агрегаты по новым заказам, возвращает число обработанных заказов.
+
+    Каждая пачка — своя транзакция: строка rollup_state блокируется и
+    водяной знак перечитывается заново, поэтому параллельный воркер,
+    продвинувший его между пачками, не заставит посчитать заказы дважды.
+    """
+    state = _lock_state(db)
+    cutoff = _as_datetime(db.scalar(select(func.now()))) - timedelta(seconds=safety_seconds)
+    high_limit = db.scalar(
+        select(func.max(Order.id)).where(Order.id > state.last_order_id, Order.created_at <= cutoff)
+    ) or state.last_order_id
+
+    processed = 0
+    while True:
+        low_id = state.last_order_id
+        if low_id >= high_limit:
+            db.commit()
+            return processed
+        high_id = min(low_id + batch_size, high_limit)
+        _rollup_range(db, low_id, high_id)
+        state.last_order_id = high_id
+        db.commit()
+        processed += high_id - low_id
+        # Блокировка снята фиксацией: берём её снова и перечитываем водяной знак
+        state = _lock_state(db)
+
+
+def watch_sales_status_changes():
+    """Поправляет сводки, когда уже посчитанный заказ входит в продажи или выходит из них.
+
+    Строка водяного знака блокируется до конца транзакции смены статуса:
+    пачка refresh_rollups, читающая этот заказ, либо уже зафиксирована
+    (и тогда заказ поправляется здесь), либо дождётся фиксации и прочитает
+    новый статус.
+    """
+
+    def after_flush(session, flush_context):
+        # После flush история атрибутов ещё содержит прежний статус
+        adjustments = {}
+        for target in session.dirty:
+            if not isinstance(target, Order):
+                continue
+            history = inspect(target).attrs["status"].history
+            if history.deleted and history.added and \
+                    counts_as_sale(history.deleted[0]) != counts_as_sale(history.added[0]):
+                adjustments[target.id] = 1 if counts_as_sale(history.added[0]) else -1
+        if not adjustments:
+            return
+
+        with session.no_autoflush:
+            last_order_id = session.scalar(
+                select(RollupState.last_order_id).where(RollupState.name == ROLLUP_NAME).with_for_update()
+            )
+            for order_id, sign in adjustments.items():
+                if last_order_id is not None and order_id <= last_order_id:
+                    _rollup_orders(session, (Order.id == order_id,), sign)
+
+    if not event.contains(Session, "after_flush", after_flush):
+        event.listen(Session, "after_flush", after_flush)
+
+
+def _period(date_from: Optional[date], date_to: Optional[date]):
+    """Полуинтервал [date_from, date_to + 1 день), по умолчанию последние 30 дней"""
+    date_to = date_to or date.today()
+    date_from = date_from or date_to - timedelta(days=29)
+    start = datetime.combine(date_from, datetime.min.time())
+    end = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+    return start, end
+
+
+def revenue_by_category(db: Session, date_from: Optional[date] = None, date_to: Optional[date] = None) -> List[dict]:
+    start, end = _period(date_from, date_to)
+    day = time_bucket(SalesHourly.hour, "day", db.get_bind().dialect.name).label("day")
+    rows = db.execute(
+        select(day, SalesHourly.category_id, Category.name,
+               func.sum(SalesHourly.revenue), func.sum(SalesHourly.units))
+        .outerjoin(Category, Category.id == SalesHourly.category_id)
+        .where(SalesHourly.hour >= start, SalesHourly.hour < end)
+        .group_by(day, SalesHourly.category_id, Category.name)
+        .order_by(day, SalesHourly.category_id)
+    ).all()
+    return [
+        {"date": _as_day(row[0]), "category_id": row[1], "category_name": row[2] or "Unknown",
+         "revenue": _money(row[3]), "units": int(row[4] or 0)}
+        for row in rows
+    ]
+
+
+def top_products(db: Session, date_from: Optional[date] = None, date_to: Optional[date] = None,
+                 limit: int = 10, by: str = "revenue") -> List[dict]:
+    start, end = _period(date_from, date_to)
+    revenue = func.sum(SalesHourly.revenue).label("revenue")
+    units = func.sum(SalesHourly.units).label("units")
+    rows = db.execute(
+        select(SalesHourly.product_id, Product.name, revenue, units)
+        .outerjoin(Product, Product.id == SalesHourly.product_id)
+        .where(SalesHourly.hour >= start, SalesHourly.hour < end)
+        .group_by(SalesHourly.product_id, Product.name)
+        .order_by((units if by == "units" else revenue).desc(), SalesHourly.product_id)
+        .limit(limit)
+    ).all()
+    return [
+        {"product_id": row[0], "name": row[1] or "Unknown Product",
+         "revenue": _money(row[2]), "units": int(row[3] or 0)}
+        for row in rows
+    ]
+
+
+def decorator_attach_rates(db: Session, date_from: Optional[date] = None,
+                           date_to: Optional[date] = None) -> dict:
+    start, end = _period(date_from, date_to)
+    total_orders = db.scalar(
+        select(func.sum(OrdersHourly.orders)).where(OrdersHourly.hour >= start, OrdersHourly.hour < end)
+    ) or 0
+    rows = db.execute(
+        select(DecoratorHourly.decorator_id, Decorator.name, func.sum(DecoratorHourly.orders))
+        .outerjoin(Decorator, Decorator.id == DecoratorHourly.decorator_id)
+        .where(DecoratorHourly.hour >= start, DecoratorHourly.hour < end)
+        .group_by(DecoratorHourly.decorator_id, Decorator.name)
+        .order_by(func.sum(DecoratorHourly.orders).desc())
+    ).all()
+    return {
+        "total_orders": int(total_orders),
+        "decorators": [
+            {"decorator_id": row[0], "name": row[1] or "Unknown", "orders": int(row[2]),
+             "attach_rate": round(int(row[2]) / total_orders, 4) if total_orders else 0}
+            for row in rows
+        ]
+    }
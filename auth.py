@@ -0,0 +1,208 @@
+# auth.py
+"""Учётные записи и JWT-аутентификация.
+
+bcrypt намеренно медленный (~0.2 с при 12 раундах), поэтому хэширование и
+проверка пароля выполняются в ограниченном пуле потоков и не блокируют
+event loop. Проверка токена на каждом запросе не ходит в БД: подпись
+проверяется один раз, а расшифрованный токен хранится в небольшом LRU-кэше
+до истечения срока действия.
+"""
+import asyncio
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import bcrypt
+from fastapi import HTTPException, Request
+from jose import JWTError, jwt
+
+JWT_SECRET = os.getenv("JWT_SECRET", "")
+JWT_ALGORITHM = "HS256"
+ACCESS_TOKEN_MINUTES = int(os.getenv("ACCESS_TOKEN_MINUTES", "60"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Не больше стольких одновременных вычислений bcrypt на воркер
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Без токена запросы выполняются от имени демо-пользователя (как раньше); 1 — токен обязателен
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "0") == "1"
+if not JWT_SECRET:
+    if AUTH_REQUIRED:
+        raise RuntimeError("AUTH_REQUIRED=1 требует JWT_SECRET: без него токены может подделать кто угодно")
+    # uvicorn и gunicorn берут число воркеров из WEB_CONCURRENCY
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        raise RuntimeError("Несколько воркеров требуют общий JWT_SECRET: "
+                           "со своим случайным ключом у каждого токен одного воркера не примут другие")
+    # Демо-режим: случайный ключ процесса. Токены не переживают перезапуск
+    JWT_SECRET = secrets.token_urlsafe(32)
+    print("JWT_SECRET не задан: токены подписываются случайным ключом этого процесса")
+DEMO_USER_ID = 1
+# Администраторы каталога: id пользователей через запятую и/или общий токен в заголовке X-Admin-Token
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Хэш, с которым вход по паролю невозможен
+UNUSABLE_PASSWORD = "!"
+# bcrypt учитывает только первые 72 байта пароля
+MAX_PASSWORD_BYTES = 72
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+def _hash_password_sync(password: str) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(BCRYPT_ROUNDS)).decode("ascii")
+
+
+def _verify_password_sync(password: str, password_hash: str) -> bool:
+    encoded = password.encode("utf-8")
+    if len(encoded) > MAX_PASSWORD_BYTES:
+        return False
+    try:
+        return bcrypt.checkpw(encoded, password_hash.encode("ascii"))
+    except ValueError:
+        # Учётная запись без пароля (например, демо-пользователь)
+        return False
+
+
+# Хэш для проверки пароля несуществующего пользователя: время ответа не выдаёт, есть ли такой email
+_DUMMY_HASH: Optional[str] = None
+
+
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, _hash_password_sync, password)
+
+
+async def verify_password(password: str, password_hash: Optional[str]) -> bool:
+    global _DUMMY_HASH
+    if password_hash is None:
+        if _DUMMY_HASH is None:
+            _DUMMY_HASH = await hash_password("dummy-password")
+        await asyncio.get_running_loop().run_in_executor(
+            _hash_executor, _verify_password_sync, password, _DUMMY_HASH
+        )
+        return False
+    return await asyncio.get_running_loop().run_in_executor(
+        _hash_executor, _verify_password_sync, password, password_hash
+    )
+
+
+def validate_password(password: str):
+    if len(password) < 8:
+        raise HTTPException(status_code=400, detail="Пароль должен быть не короче 8 символов")
+    if len(password.encode("utf-8")) > MAX_PASSWORD_BYTES:
+        raise HTTPException(status_code=400, detail="Пароль должен быть не длиннее 72 байт")
+
+
+def create_access_token(user_id: int, minutes: int = ACCESS_TOKEN_MINUTES) -> str:
+    now = int(time.time())
+    return jwt.encode({"sub": str(user_id), "iat": now, "exp": now + minutes * 60},
+                      JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+
+class TokenCache:
+    """LRU расшифрованных токенов: token -> (user_id, exp)"""
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str, now: float) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return entry[0]
+
+    def put(self, token: str, user_id: int, expires_at: float):
+        with self._lock:
+            self._entries[token] = (user_id, expires_at)
+            self._entries.move_to_end(token)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def unauthorized(detail: str) -> HTTPException:
+    return HTTPException(status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer"})
+
+
+def decode_access_token(token: str) -> int:
+    now = time.time()
+    user_id = token_cache.get(token, now)
+    if user_id is not None:
+        return user_id
+
+    try:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        user_id = int(claims["sub"])
+    except (JWTError, KeyError, ValueError):
+        raise unauthorized("Недействительный или просроченный токен")
+
+    token_cache.put(token, user_id, float(claims["exp"]))
+    return user_id
+
+
+def bearer_token(request: Request) -> Optional[str]:
+    authorization = request.headers.get("authorization")
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise unauthorized("Ожидается заголовок Authorization: Bearer <token>")
+    return token.strip()
+
+
+async def get_optional_user_id(request: Request) -> Optional[int]:
+    """Зависимость FastAPI: id пользователя из токена или None, если токена нет"""
+    token = bearer_token(request)
+    return decode_access_token(token) if token else None
+
+
+async def get_current_user_id(request: Request) -> int:
+    """Зависимость FastAPI: id пользователя; без токена — демо-пользователь, если это разрешено"""
+    user_id = await get_optional_user_id(request)
+    if user_id is not None:
+        return user_id
+    if AUTH_REQUIRED:
+        raise unauthorized("Требуется авторизация")
+    return DEMO_USER_ID
+
+
+async def get_stream_user_id(request: Request, access_token: Optional[str] = None) -> int:
+    """Как get_current_user_id, но токен можно передать в ?access_token=: EventSource не шлёт заголовки"""
+    if access_token:
+        return decode_access_token(access_token)
+    return await get_current_user_id(request)
+
+
+async def require_admin(request: Request) -> Optional[int]:
+    """Зависимость FastAPI для административных маршрутов: X-Admin-Token или токен администратора.
+
+    Без ADMIN_TOKEN и ADMIN_USER_IDS такие маршруты закрыты для всех.
+    """
+    supplied = request.headers.get("x-admin-token")
+    if supplied is not None:
+        if ADMIN_TOKEN and hmac.compare_digest(ADMIN_TOKEN.encode(), supplied.encode()):
+            return None
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+
+    user_id = await get_optional_user_id(request)
+    if user_id is None:
+        raise unauthorized("Требуется авторизация администратора")
+    if user_id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+    return user_id
@@ -0,0 +1,298 @@
+# catalog_import.py
+"""Импорт каталога поставщика (CSV или NDJSON) пакетными upsert'ами по артикулу.
+
+Поля строки: sku, name, price, description, category (название) или category_id.
+Для каждой строки считается хэш содержимого; строки с тем же хэшем, что уже
+лежит в БД, пропускаются, остальные пишутся одним INSERT ... ON CONFLICT (sku)
+на пачку. Об изменённых товарах сообщается через on_changed, чтобы сбросить
+кэш только для них.
+
+Пример: python catalog_import.py feed.ndjson --batch-size 2000
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import Category, Product
+from outbox import PRODUCT_CREATED, PRODUCT_UPDATED, emit
+
+IMPORT_BATCH_SIZE = 1000
+# Строк в одном INSERT: по 6 параметров на строку, у SQLite предел 32766 параметров на запрос
+UPSERT_CHUNK_SIZE = 1000
+# Сколько ошибок и артикулов попадает в отчёт (счётчики при этом полные)
+MAX_REPORTED = 100
+MAX_PRICE = Decimal("99999999.99")
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.price_changed = 0
+        self.inserted_skus: List[str] = []
+        self.updated_skus: List[str] = []
+        self.errors: List[dict] = []
+        self.error_count = 0
+
+    def add_error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED:
+            self.errors.append({"line": line, "error": message})
+
+    def as_dict(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "price_changed": self.price_changed,
+            "errors": self.error_count,
+            "inserted_skus": self.inserted_skus,
+            "updated_skus": self.updated_skus,
+            "error_details": self.errors,
+        }
+
+
+def content_hash(category_id: int, name: str, price: Decimal, description: str) -> str:
+    payload = "\x1f".join((str(category_id), name, str(price), description))
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def detect_format(filename: Optional[str]) -> str:
+    if filename and filename.lower().endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    return "csv"
+
+
+def read_rows(stream: Iterable[str], file_format: str) -> Iterator[Tuple[int, dict]]:
+    """Строки фида с номерами строк; поток читается лениво"""
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, {"__error__": f"Некорректный JSON: {e.msg}"}
+            continue
+        yield line_number, row if isinstance(row, dict) else {"__error__": "Ожидался JSON-объект"}
+
+
+def normalize_row(raw: dict) -> dict:
+    if "__error__" in raw:
+        raise ValueError(raw["__error__"])
+
+    sku = str(raw.get("sku") or "").strip()
+    if not sku or len(sku) > 64:
+        raise ValueError("Артикул (sku) обязателен и не длиннее 64 символов")
+
+    name = str(raw.get("name") or "").strip()
+    if not name or len(name) > 255:
+        raise ValueError("Название обязательно и не длиннее 255 символов")
+
+    try:
+        price = Decimal(str(raw.get("price")).strip()).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Некорректная цена: {raw.get('price')!r}")
+    if not Decimal("0") < price <= MAX_PRICE:
+        raise ValueError(f"Цена вне допустимого диапазона: {price}")
+
+    category_id = raw.get("category_id")
+    category = str(raw.get("category") or "").strip()
+    if category_id not in (None, ""):
+        try:
+            category_id = int(category_id)
+        except (TypeError, ValueError):
+            raise ValueError(f"Некорректный category_id: {category_id!r}")
+    elif not category:
+        raise ValueError("Нужна категория: category или category_id")
+    else:
+        category_id = None
+
+    return {
+        "sku": sku,
+        "name": name,
+        "price": price,
+        "description": str(raw.get("description") or "").strip(),
+        "category_id": category_id,
+        "category": category,
+    }
+
+
+class CatalogImporter:
+    """Пакетный upsert товаров с пропуском неизменившихся строк"""
+
+    def __init__(self, db: Session, batch_size: int = IMPORT_BATCH_SIZE,
+                 on_changed: Optional[Callable[[List[Tuple[int, int, Optional[int]]]], None]] = None):
+        self.db = db
+        self.batch_size = batch_size
+        self.on_changed = on_changed
+        self.report = ImportReport()
+        self._category_ids: Dict[str, int] = {}
+        self._known_category_ids = set()
+
+    def run(self, rows: Iterable[Tuple[int, dict]]) -> ImportReport:
+        batch = []
+        for line_number, raw in rows:
+            try:
+                row = normalize_row(raw)
+            except ValueError as e:
+                self.report.add_error(line_number, str(e))
+                continue
+            row["line"] = line_number
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch)
+                batch = []
+        if batch:
+            self._import_batch(batch)
+        return self.report
+
+    def _resolve_categories(self, batch: List[dict]):
+        if not self._category_ids:
+            for category in self.db.query(Category).all():
+                self._category_ids[category.name] = category.id
+                self._known_category_ids.add(category.id)
+
+        for row in batch:
+            if row["category_id"] is None:
+                name = row["category"]
+                if name not in self._category_ids:
+                    category = Category(name=name[:100])
+                    self.db.add(category)
+                    self.db.flush()
+                    self._category_ids[name] = category.id
+                    self._known_category_ids.add(category.id)
+                row["category_id"] = self._category_ids[name]
+
+    def _upsert(self, rows: List[dict]):
+        if self.db.get_bind().dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        written = []
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            statement = insert(Product).values(rows[start:start + UPSERT_CHUNK_SIZE])
+            statement = statement.on_conflict_do_update(
+                index_elements=["sku"],
+                set_={column: statement.excluded[column]
+                      for column in ("category_id", "name", "price", "description", "content_hash")},
+                # Защита от параллельного импорта: не трогаем строку, если содержимое уже то же
+                where=Product.content_hash.is_distinct_from(statement.excluded.content_hash)
+            ).returning(Product.id, Product.sku, Product.category_id)
+            written.extend(self.db.execute(statement).all())
+        return written
+
+    def _import_batch(self, batch: List[dict]):
+        self._resolve_categories(batch)
+
+        # В одном INSERT ... ON CONFLICT строка не может обновиться дважды: побеждает последняя
+        by_sku = {}
+        for row in batch:
+            if row["category_id"] not in self._known_category_ids:
+                self.report.add_error(row["line"], f"{row['sku']}: категория {row['category_id']} не найдена")
+                continue
+            row["content_hash"] = content_hash(row["category_id"], row["name"], row["price"], row["description"])
+            by_sku[row["sku"]] = row
+
+        skus = list(by_sku)
+        existing = {
+            row.sku: row
+            for start in range(0, len(skus), UPSERT_CHUNK_SIZE)
+            for row in self.db.execute(
+                select(Product.sku, Product.id, Product.content_hash, Product.category_id, Product.price)
+                .where(Product.sku.in_(skus[start:start + UPSERT_CHUNK_SIZE]))
+            )
+        }
+
+        changed_rows = []
+        for sku, row in by_sku.items():
+            current = existing.get(sku)
+            if current is not None and current.content_hash == row["content_hash"]:
+                self.report.unchanged += 1
+            else:
+                changed_rows.append(row)
+
+        if not changed_rows:
+            self.db.commit()
+            return
+
+        written = self._upsert([
+            {key: row[key] for key in ("sku", "category_id", "name", "price", "description", "content_hash")}
+            for row in changed_rows
+        ])
+
+        changes = []
+        for product_id, sku, category_id in written:
+            current = existing.get(sku)
+            if current is None:
+                self.report.inserted += 1
+                if len(self.report.inserted_skus) < MAX_REPORTED:
+                    self.report.inserted_skus.append(sku)
+                changes.append((product_id, category_id, None))
+                emit(self.db, PRODUCT_CREATED, {"product_id": product_id, "category_id": category_id,
+                                                "sku": sku, "price": by_sku[sku]["price"]},
+                     aggregate_id=product_id)
+            else:
+                self.report.updated += 1
+                if len(self.report.updated_skus) < MAX_REPORTED:
+                    self.report.updated_skus.append(sku)
+                changed_fields = {}
+                if Decimal(str(current.price)) != by_sku[sku]["price"]:
+                    self.report.price_changed += 1
+                    changed_fields["price"] = [str(current.price), str(by_sku[sku]["price"])]
+                if current.category_id != category_id:
+                    changed_fields["category_id"] = [current.category_id, category_id]
+                changes.append((product_id, category_id, current.category_id))
+                emit(self.db, PRODUCT_UPDATED,
+                     {"product_id": product_id, "category_id": category_id, "changes": changed_fields},
+                     aggregate_id=product_id)
+        # Строки, которые параллельный импорт уже привёл к тому же содержимому
+        self.report.unchanged += len(changed_rows) - len(written)
+        # События пишутся в той же транзакции, что и сами товары
+        self.db.commit()
+
+        if self.on_changed and changes:
+            self.on_changed(changes)
+
+
+def import_catalog(db: Session, stream: Iterable[str], file_format: str = "csv",
+                   batch_size: int = IMPORT_BATCH_SIZE, on_changed=None) -> dict:
+    importer = CatalogImporter(db, batch_size=batch_size, on_changed=on_changed)
+    return importer.run(read_rows(stream, file_format)).as_dict()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Импорт каталога поставщика")
+    parser.add_argument("path", help="файл CSV или NDJSON")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="по умолчанию по расширению файла")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        with io.open(args.path, encoding="utf-8-sig", newline="") as stream:
+            report = import_catalog(db, stream, args.format or detect_format(args.path), args.batch_size)
+    finally:
+        db.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+# catalog_snapshot.py
+"""Снимок каталога в бинарном файле, общий для всех воркеров.
+
+Товары и категории хранятся столбцами фиксированной ширины (id, категория,
+цена в копейках, место в сортировке по названию, смещения строк) и одной
+таблицей строк UTF-8. Файл пишет один процесс — во временный файл рядом и
+атомарным os.replace. Воркеры отображают его в память только для чтения:
+страницы общие через page cache ОС, поэтому память не растёт с числом
+воркеров, а столбцы читаются через memoryview без копирования. Новая версия
+файла подхватывается без перезапуска.
+"""
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from database import Category, Product
+from money import Money
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = b"ECSNAP01"
+# magic, версия, число товаров, число категорий
+HEADER = struct.Struct("<8sQII")
+NO_CATEGORY = -1
+# Как часто читатель проверяет, не появилась ли новая версия файла
+CHECK_INTERVAL_SECONDS = 1.0
+# Снимок пересобирается не реже, даже если событий об изменениях не было
+MAX_AGE_SECONDS = 300
+
+
+def _layout(product_count: int, category_count: int) -> List[Tuple[str, str, int, int]]:
+    """Секции файла: (имя, тип array, число элементов, смещение); каждая выровнена на 8 байт"""
+    sections = [
+        ("ids", "i", product_count),
+        ("category_ids", "i", product_count),
+        ("prices", "q", product_count),
+        ("name_ranks", "i", product_count),
+        ("search_offsets", "I", product_count + 1),
+        ("name_offsets", "I", product_count + 1),
+        ("description_offsets", "I", product_count + 1),
+        ("category_table_ids", "i", category_count),
+        ("category_name_offsets", "I", category_count + 1),
+    ]
+    layout, offset = [], HEADER.size
+    for name, typecode, count in sections:
+        offset = (offset + 7) & ~7
+        layout.append((name, typecode, count, offset))
+        offset += count * array(typecode).itemsize
+    layout.append(("strings", "B", 0, (offset + 7) & ~7))
+    return layout
+
+
+def build_snapshot(products: Iterable[Tuple[int, Optional[int], Decimal, str, Optional[str]]],
+                   categories: Iterable[Tuple[int, str]], version: int) -> bytes:
+    """products: (id, category_id, цена, название, описание) в порядке id"""
+    products = list(products)
+    categories = sorted(categories)
+    columns = {name: array(typecode) for name, typecode, _, _ in _layout(0, 0)[:-1]}
+    strings = bytearray()
+
+    def add_strings(offsets: array, values: Iterable[str], separator: bytes = b""):
+        offsets.append(len(strings))
+        for value in values:
+            strings.extend(value.encode("utf-8"))
+            strings.extend(separator)
+            offsets.append(len(strings))
+
+    for product_id, category_id, price, _, _ in products:
+        columns["ids"].append(product_id)
+        columns["category_ids"].append(NO_CATEGORY if category_id is None else category_id)
+        columns["prices"].append(Money.from_rubles(price).kopecks)
+
+    names = [product[3] for product in products]
+    order = sorted(range(len(products)), key=lambda index: (names[index], products[index][0]))
+    ranks = [0] * len(products)
+    for rank, index in enumerate(order):
+        ranks[index] = rank
+    columns["name_ranks"].extend(ranks)
+
+    # Названия для поиска идут подряд через \0: совпадение не может захватить два товара
+    add_strings(columns["search_offsets"], (name.casefold() for name in names), b"\0")
+    add_strings(columns["name_offsets"], names)
+    add_strings(columns["description_offsets"], (product[4] or "" for product in products))
+    columns["category_table_ids"].extend(category_id for category_id, _ in categories)
+    add_strings(columns["category_name_offsets"], (name for _, name in categories))
+
+    layout = _layout(len(products), len(categories))
+    data = bytearray(layout[-1][3] + len(strings))
+    HEADER.pack_into(data, 0, MAGIC, version, len(products), len(categories))
+    for name, typecode, count, offset in layout[:-1]:
+        chunk = columns[name].tobytes()
+        data[offset:offset + len(chunk)] = chunk
+    data[layout[-1][3]:] = strings
+    return bytes(data)
+
+
+def read_version(path: str) -> int:
+    try:
+        with open(path, "rb") as snapshot_file:
+            magic, version, _, _ = HEADER.unpack(snapshot_file.read(HEADER.size))
+    except (OSError, struct.error):
+        return 0
+    return version if magic == MAGIC else 0
+
+
+def write_snapshot(path: str, data: bytes):
+    """Атомарная запись: читатели видят либо старый файл целиком, либо новый"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary_path = tempfile.mkstemp(dir=directory, prefix=".catalog-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as snapshot_file:
+            snapshot_file.write(data)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.unlink(temporary_path)
+        raise
+
+
+def export_snapshot(db: Session, path: str) -> int:
+    """Снимает каталог из БД в файл; возвращает номер новой версии"""
+    products = db.execute(
+        select(Product.id, Product.category_id, Product.price, Product.name, Product.description)
+        .order_by(Product.id)
+    ).all()
+    categories = db.execute(select(Category.id, Category.name)).all()
+    # Версии растут монотонно, даже если часы на разных машинах расходятся
+    version = max(read_version(path) + 1, time.time_ns())
+    write_snapshot(path, build_snapshot(products, categories, version))
+    return version
+
+
+@contextmanager
+def writer_lock(path: str):
+    """Блокировка писателя между процессами; отдаёт False, если снимок уже пишет другой"""
+    if fcntl is None:
+        yield True
+        return
+    with open(path + ".lock", "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class CatalogSnapshot:
+    """Одна версия снимка, отображённая в память только для чтения"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as snapshot_file:
+            stat = os.fstat(snapshot_file.fileno())
+            self.identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, product_count, category_count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} не является снимком каталога")
+
+        view = memoryview(self._mmap)
+        layout = _layout(product_count, category_count)
+        for name, typecode, count, offset in layout[:-1]:
+            size = count * array(typecode).itemsize
+            setattr(self, f"_{name}", view[offset:offset + size].cast(typecode))
+        self._strings = layout[-1][3]
+        self._categories = {
+            category_id: self._string(self._category_name_offsets, index)
+            for index, category_id in enumerate(self._category_table_ids)
+        }
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _string(self, offsets, index: int) -> str:
+        return self._mmap[self._strings + offsets[index]:self._strings + offsets[index + 1]].decode("utf-8")
+
+    def _index(self, product_id: int) -> Optional[int]:
+        index = bisect.bisect_left(self._ids, product_id)
+        if index < len(self._ids) and self._ids[index] == product_id:
+            return index
+        return None
+
+    def price(self, product_id: int) -> Optional[Money]:
+        index = self._index(product_id)
+        return None if index is None else Money(self._prices[index])
+
+    def category_name(self, category_id: int) -> Optional[str]:
+        return self._categories.get(category_id)
+
+    def _product(self, index: int) -> dict:
+        category_id = self._category_ids[index]
+        return {
+            "id": self._ids[index],
+            "name": self._string(self._name_offsets, index),
+            "price": Money(self._prices[index]).to_decimal(),
+            "description": self._string(self._description_offsets, index),
+            "category_id": None if category_id == NO_CATEGORY else category_id,
+            "category_name": self._categories.get(category_id, "Unknown"),
+        }
+
+    def product(self, product_id: int) -> Optional[dict]:
+        index = self._index(product_id)
+        return None if index is None else self._product(index)
+
+    def _search(self, search: str) -> List[int]:
+        """Номера товаров, в названии которых есть search (без учёта регистра), поиском по mmap"""
+        needle = search.casefold().encode("utf-8")
+        start = self._strings + self._search_offsets[0]
+        end = self._strings + self._search_offsets[len(self._ids)]
+        found = []
+        while True:
+            position = self._mmap.find(needle, start, end)
+            if position < 0:
+                return found
+            index = bisect.bisect_right(self._search_offsets, position - self._strings) - 1
+            found.append(index)
+            start = self._strings + self._search_offsets[index + 1]
+
+    def select(self, category_ids: Optional[Sequence[int]] = None,
+               price_min: Optional[Decimal] = None, price_max: Optional[Decimal] = None,
+               search: Optional[str] = None, sort: str = "default",
+               offset: int = 0, limit: Optional[int] = None) -> List[dict]:
+        """Те же фильтры и сортировки, что у facets.apply_filters"""
+        indices = self._search(search) if search else range(len(self._ids))
+        if category_ids:
+            wanted = set(category_ids)
+            category_column = self._category_ids
+            indices = [index for index in indices if category_column[index] in wanted]
+        if price_min is not None or price_max is not None:
+            low = Money.from_rubles(price_min).kopecks if price_min is not None else None
+            high = Money.from_rubles(price_max).kopecks if price_max is not None else None
+            prices = self._prices
+            indices = [index for index in indices
+                       if (low is None or prices[index] >= low) and (high is None or prices[index] <= high)]
+
+        # Столбцы отсортированы по id, поэтому порядок по умолчанию уже верный
+        if sort == "price_asc":
+            indices = sorted(indices, key=lambda index: (self._prices[index], self._ids[index]))
+        elif sort == "price_desc":
+            indices = sorted(indices, key=lambda index: (-self._prices[index], self._ids[index]))
+        elif sort == "name":
+            indices = sorted(indices, key=self._name_ranks.__getitem__)
+
+        end = offset + limit if limit else None
+        return [self._product(index) for index in indices[offset:end]]
+
+
+class SnapshotReader:
+    """Текущая версия снимка; новый файл проверяется не чаще раза в check_interval секунд"""
+
+    def __init__(self, path: str, check_interval: float = CHECK_INTERVAL_SECONDS):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[CatalogSnapshot]:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._snapshot
+
+        with self._lock:
+            if now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                self._reload()
+        return self._snapshot
+
+    def _reload(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+        if self._snapshot is not None and self._snapshot.identity == identity:
+            return
+        try:
+            snapshot = CatalogSnapshot(self.path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Снимок каталога не загружен: {e}")
+            return
+        if self._snapshot is None or snapshot.version >= self._snapshot.version:
+            # Старое отображение освободится, когда закончатся запросы, которые его читают
+            self._snapshot = snapshot
+
+
+class SnapshotWriter:
+    """Пересобирает снимок по событиям об изменении каталога и по возрасту файла"""
+
+    def __init__(self, path: str, session_factory, max_age: float = MAX_AGE_SECONDS):
+        self.path = path
+        self.session_factory = session_factory
+        self.max_age = max_age
+        self._stale = threading.Event()
+
+    def mark_stale(self, event: Optional[dict] = None):
+        """Подписчик outbox на product.created / product.updated / catalog.changed"""
+        self._stale.set()
+
+    def needs_rebuild(self) -> bool:
+        if self._stale.is_set():
+            return True
+        try:
+            return time.time() - os.stat(self.path).st_mtime >= self.max_age
+        except FileNotFoundError:
+            return True
+
+    def publish_if_needed(self) -> Optional[int]:
+        if not self.needs_rebuild():
+            return None
+        with writer_lock(self.path) as acquired:
+            if not acquired:
+                return None
+            # Изменения, пришедшие во время сборки, вызовут ещё одну
+            self._stale.clear()
+            db = self.session_factory()
+            try:
+                return export_snapshot(db, self.path)
+            except Exception:
+                self._stale.set()
+                raise
+            finally:
+                db.close()
@@ -1,12 +1,13 @@
 # composite.py
 from abc import ABC, abstractmethod
-from decimal import Decimal
 from typing import List
 
+from money import Money
+
 
 class CatalogComponent(ABC):
     @abstractmethod
-    def get_price(self) -> Decimal:
+    def get_price(self) -> Money:
         pass
 
     @abstractmethod
@@ -19,13 +20,13 @@ class CatalogComponent(ABC):
 
 
 class ProductLeaf(CatalogComponent):
-    def __init__(self, product_id: int, name: str, price: Decimal, description: str):
+    def __init__(self, product_id: int, name: str, price: Money, description: str):
         self.product_id = product_id
         self.name = name
-        self.price = price
+        self.price = Money.of(price)
         self.description = description
 
-    def get_price(self) -> Decimal:
+    def get_price(self) -> Money:
         return self.price
 
     def get_description(self) -> str:
@@ -47,8 +48,8 @@ class ProductComposite(CatalogComponent):
     def remove(self, component: CatalogComponent):
         self.children.remove(component)
 
-    def get_price(self) -> Decimal:
-        total = Decimal('0.00')
+    def get_price(self) -> Money:
+        total = Money(0)
         for child in self.children:
             total += child.get_price()
         return total
@@ -79,12 +80,21 @@ class CatalogManager:
     def __init__(self):
         self.bundles = {}
 
+    def create_bundle(self, key: str, name: str, description: str, products: List[dict]) -> ProductComposite:
+        """Набор из произвольных товаров, например из рекомендаций"""
+        bundle = ProductComposite(name, description)
+        for product in products:
+            bundle.add(ProductLeaf(product["id"], product["name"], product["price"], product["description"]))
+
+        self.bundles[key] = bundle
+        return bundle
+
     def create_computer_bundle(self) -> ProductComposite:
         bundle = ProductComposite("Игровой компьютер", "Полный игровой комплект")
 
-        bundle.add(ProductLeaf(2, "Ноутбук ASUS ROG", Decimal('124999.99'), "Игровой ноутбук ASUS ROG Strix"))
-        bundle.add(ProductLeaf(3, "Наушники AirPods Pro", Decimal('18999.99'), "Беспроводные наушники с шумоподавлением"))
-        bundle.add(ProductLeaf(5, "Умные часы Galaxy Watch", Decimal('24999.99'), "Samsung Galaxy Watch 6"))
+        bundle.add(ProductLeaf(2, "Ноутбук ASUS ROG", Money(12499999), "Игровой ноутбук ASUS ROG Strix"))
+        bundle.add(ProductLeaf(3, "Наушники AirPods Pro", Money(1899999), "Беспроводные наушники с шумоподавлением"))
+        bundle.add(ProductLeaf(5, "Умные часы Galaxy Watch", Money(2499999), "Samsung Galaxy Watch 6"))
 
         self.bundles["gaming_computer"] = bundle
         return bundle
@@ -92,9 +102,9 @@ class CatalogManager:
     def create_office_bundle(self) -> ProductComposite:
         bundle = ProductComposite("Офисный набор", "Всё для работы в офисе")
 
-        bundle.add(ProductLeaf(8, "Пылесос Dyson", Decimal('29999.99'), "Беспроводной пылесос Dyson V15"))
-        bundle.add(ProductLeaf(9, "Кофемашина DeLonghi", Decimal('45999.99'), "Автоматическая кофемашина"))
-        bundle.add(ProductLeaf(11, "Коврик для йоги", Decimal('1299.99'), "Коврик для йоги, нескользящий"))
+        bundle.add(ProductLeaf(8, "Пылесос Dyson", Money(2999999), "Беспроводной пылесос Dyson V15"))
+        bundle.add(ProductLeaf(9, "Кофемашина DeLonghi", Money(4599999), "Автоматическая кофемашина"))
+        bundle.add(ProductLeaf(11, "Коврик для йоги", Money(129999), "Коврик для йоги, нескользящий"))
 
         self.bundles["office_workspace"] = bundle
         return bundle
@@ -102,9 +112,9 @@ class CatalogManager:
     def create_clothing_bundle(self) -> ProductComposite:
         bundle = ProductComposite("Спортивный набор", "Для активного отдыха")
 
-        bundle.add(ProductLeaf(21, "Велосипед горный", Decimal('29999.99'), "Горный велосипед, 26 дюймов"))
-        bundle.add(ProductLeaf(22, "Гантели 5кг", Decimal('1499.99'), "Пара гантелей по 5 кг"))
-        bundle.add(ProductLeaf(24, "Мяч футбольный", Decimal('1999.99'), "Футбольный мяч, размер 5"))
+        bundle.add(ProductLeaf(21, "Велосипед горный", Money(2999999), "Горный велосипед, 26 дюймов"))
+        bundle.add(ProductLeaf(22, "Гантели 5кг", Money(149999), "Пара гантелей по 5 кг"))
+        bundle.add(ProductLeaf(24, "Мяч футбольный", Money(199999), "Футбольный мяч, размер 5"))
 
         self.bundles["casual_outfit"] = bundle
         return bundle
\ No newline at end of file
@@ -0,0 +1,392 @@
+# datagen.py
+"""Генератор синтетических данных в объёме продакшена и потоковая загрузка в БД.
+
+Пример: python datagen.py --products 1000000 --orders 10000000 --workers 8
+
+Генерация идёт параллельно в нескольких процессах блоками (chunk), загрузка
+выполняется одним процессом: COPY на PostgreSQL и executemany на SQLite.
+Атрибуты товара (категория, цена) вычисляются детерминированно из seed и id,
+поэтому процессам-генераторам заказов не нужно держать в памяти весь каталог.
+"""
+import argparse
+import csv
+import io
+import math
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from statistics import NormalDist
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from database import engine as default_engine, Category, Product, Decorator, Order
+from init_data import DEFAULT_CATEGORIES, DEFAULT_DECORATORS
+from order_summaries import rebuild_order_summaries
+from partitions import create_month_partitions, is_partitioned
+
+MASK64 = (1 << 64) - 1
+MAX_PRICE = 999999.99
+
+# Типовые товары и медианные цены для базовых категорий
+PRODUCT_KINDS = {
+    "Электроника": (["Смартфон", "Ноутбук", "Наушники", "Планшет", "Умные часы"], 25000),
+    "Одежда": (["Футболка", "Джинсы", "Кроссовки", "Куртка", "Свитер"], 3000),
+    "Бытовая техника": (["Блендер", "Пылесос", "Кофемашина", "Утюг", "Микроволновка"], 8000),
+    "Книги": (["Роман", "Сборник рассказов", "Учебник", "Справочник", "Комикс"], 700),
+    "Спорт и отдых": (["Велосипед", "Гантели", "Мяч", "Палатка", "Коврик для йоги"], 4000),
+}
+BRANDS = ["Альфа", "Вектор", "Гранит", "Зенит", "Импульс", "Квант", "Орбита", "Полюс", "Сигма", "Элемент"]
+
+TABLE_COLUMNS = {
+    "category": ("id", "name"),
+    "product": ("id", "category_id", "name", "price", "description"),
+    "orders": ("id", "user_id", "total_amount", "created_at", "status"),
+    "order_items": ("order_id", "product_id", "quantity", "subtotal", "order_created_at"),
+    "order_decorators": ("order_id", "decorator_id", "order_created_at"),
+}
+# Таблицы, куда генератор пишет явные id: после загрузки их последовательности сдвигаются
+EXPLICIT_ID_TABLES = tuple(table for table, columns in TABLE_COLUMNS.items() if "id" in columns) + ("decorators",)
+
+
+@dataclass
+class GeneratorConfig:
+    categories: int = 5
+    products: int = 10000
+    orders: int = 100000
+    users: int = 10000
+    days: int = 365
+    # Показатель степенного закона популярности товаров (0 - равномерно)
+    popularity_skew: float = 1.1
+    # Среднее число позиций в заказе и максимальное количество одного товара
+    items_mean: float = 2.5
+    max_quantity: int = 3
+    # Доля заказов с дополнительными услугами
+    decorator_rate: float = 0.3
+    price_sigma: float = 0.6
+    chunk_size: int = 20000
+    workers: int = os.cpu_count() or 1
+    seed: int = 42
+
+
+def _mix64(value: int) -> int:
+    """splitmix64: быстрый детерминированный хэш целого числа"""
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+def _unit(seed: int, key: int, salt: int) -> float:
+    """Псевдослучайное число из (0, 1), зависящее только от seed, key и salt"""
+    return ((_mix64(seed * 0x100000001B3 ^ key * 0x9E3779B1 ^ salt) >> 11) + 0.5) / float(1 << 53)
+
+
+_normal = NormalDist()
+
+
+def category_name(index: int) -> str:
+    base = DEFAULT_CATEGORIES[index % len(DEFAULT_CATEGORIES)]
+    series = index // len(DEFAULT_CATEGORIES)
+    return base if series == 0 else f"{base} {series + 1}"
+
+
+def product_category(config: GeneratorConfig, product_id: int, first_category_id: int) -> int:
+    return first_category_id + int(_unit(config.seed, product_id, 1) * config.categories)
+
+
+def product_price(config: GeneratorConfig, product_id: int, first_category_id: int) -> float:
+    kind_index = (product_category(config, product_id, first_category_id) - first_category_id) % len(DEFAULT_CATEGORIES)
+    median = PRODUCT_KINDS[DEFAULT_CATEGORIES[kind_index]][1]
+    z = _normal.inv_cdf(_unit(config.seed, product_id, 2))
+    price = median * math.exp(config.price_sigma * z)
+    return min(math.floor(price) + 0.99, MAX_PRICE)
+
+
+def generate_products(config: GeneratorConfig, start_id: int, end_id: int, first_category_id: int) -> dict:
+    rows = []
+    for product_id in range(start_id, end_id):
+        category_id = product_category(config, product_id, first_category_id)
+        kind = DEFAULT_CATEGORIES[(category_id - first_category_id) % len(DEFAULT_CATEGORIES)]
+        names = PRODUCT_KINDS[kind][0]
+        name = names[int(_unit(config.seed, product_id, 3) * len(names))]
+        brand = BRANDS[int(_unit(config.seed, product_id, 4) * len(BRANDS))]
+        rows.append((
+            product_id,
+            category_id,
+            f"{name} {brand} {product_id}",
+            f"{product_price(config, product_id, first_category_id):.2f}",
+            f"{name} {brand}, модель {product_id}"
+        ))
+    return {"product": rows}
+
+
+def _popular_rank(rng: random.Random, count: int, skew: float) -> int:
+    """Ранг товара по степенному закону (обратная функция распределения)"""
+    u = rng.random()
+    if skew <= 0:
+        return int(u * count)
+    if abs(skew - 1.0) < 1e-9:
+        return min(int((count + 1) ** u) - 1, count - 1)
+    exponent = 1.0 - skew
+    value = (((count + 1) ** exponent - 1) * u + 1) ** (1 / exponent)
+    return min(int(value) - 1, count - 1)
+
+
+def generate_orders(config: GeneratorConfig, start_id: int, end_id: int, context: dict) -> dict:
+    rng = random.Random(config.seed * 1000003 + start_id)
+    first_product_id = context["first_product_id"]
+    product_count = context["product_count"]
+    first_category_id = context["first_category_id"]
+    decorators = context["decorators"]
+    period_start = context["period_start"]
+    period_seconds = config.days * 86400
+    generated_at = period_start + timedelta(days=config.days)
+    # Геометрическое распределение: 1 + число «успехов» с заданным средним
+    extra_items_p = 1.0 / config.items_mean if config.items_mean > 1 else 1.0
+
+    orders, items, order_decorators = [], [], []
+    for order_id in range(start_id, end_id):
+        order_items, decorator_ids = [], []
+        total = 0.0
+        items_count = 1
+        while items_count < 20 and rng.random() > extra_items_p:
+            items_count += 1
+
+        seen = set()
+        for _ in range(items_count):
+            product_id = first_product_id + _popular_rank(rng, product_count, config.popularity_skew)
+            if product_id in seen:
+                continue
+            seen.add(product_id)
+            quantity = rng.randint(1, config.max_quantity)
+            subtotal = round(product_price(config, product_id, first_category_id) * quantity, 2)
+            total += subtotal
+            order_items.append((order_id, product_id, quantity, f"{subtotal:.2f}"))
+
+        if decorators and rng.random() < config.decorator_rate:
+            for decorator_id, cost in rng.sample(decorators, k=min(len(decorators), rng.choice((1, 1, 2)))):
+                total += cost
+                decorator_ids.append(decorator_id)
+
+        created_at = period_start + timedelta(seconds=rng.randrange(period_seconds))
+        # С микросекундами, как пишет SQLAlchemy: на SQLite даты сравниваются как строки
+        # (история заказов соединяет сводку с заказом по created_at)
+        created_at_text = created_at.strftime("%Y-%m-%d %H:%M:%S.%f")
+        # Дата заказа копируется в позиции: по ней секционированы дочерние таблицы
+        items.extend(item + (created_at_text,) for item in order_items)
+        order_decorators.extend((order_id, decorator_id, created_at_text) for decorator_id in decorator_ids)
+        age = generated_at - created_at
+        if age > timedelta(days=7):
+            status = "delivered"
+        elif age > timedelta(days=2):
+            status = "shipping"
+        else:
+            status = "paid"
+        orders.append((
+            order_id,
+            rng.randint(1, config.users),
+            f"{total:.2f}",
+            created_at_text,
+            status
+        ))
+
+    return {"orders": orders, "order_items": items, "order_decorators": order_decorators}
+
+
+def _run_chunk(task):
+    generator, config, start_id, end_id, context = task
+    return generator(config, start_id, end_id, context)
+
+
+class BulkLoader:
+    """Потоковая загрузка строк: COPY на PostgreSQL, executemany на SQLite"""
+
+    def __init__(self, bind):
+        self.bind = bind
+        self.connection = bind.raw_connection()
+        self.is_postgres = bind.dialect.name == "postgresql"
+
+    def load(self, tables: dict):
+        cursor = self.connection.cursor()
+        try:
+            for table in TABLE_COLUMNS:
+                rows = tables.get(table)
+                if not rows:
+                    continue
+                columns = TABLE_COLUMNS[table]
+                if self.is_postgres:
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows(rows)
+                    buffer.seek(0)
+                    cursor.copy_expert(
+                        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+                    )
+                else:
+                    placeholders = ", ".join("?" for _ in columns)
+                    cursor.executemany(
+                        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows
+                    )
+            self.connection.commit()
+        finally:
+            cursor.close()
+
+    def reset_sequences(self):
+        """После вставки с явными id сдвигаем последовательности PostgreSQL"""
+        if not self.is_postgres:
+            return
+        cursor = self.connection.cursor()
+        try:
+            for table in EXPLICIT_ID_TABLES:
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"COALESCE((SELECT MAX(id) FROM {table}), 1))"
+                )
+            self.connection.commit()
+        finally:
+            cursor.close()
+
+    def close(self):
+        self.connection.close()
+
+
+def _chunks(start_id: int, count: int, chunk_size: int):
+    for chunk_start in range(start_id, start_id + count, chunk_size):
+        yield chunk_start, min(chunk_start + chunk_size, start_id + count)
+
+
+def _stream(loader: BulkLoader, tasks, workers: int, label: str):
+    """Генерирует блоки параллельно и загружает их по мере готовности.
+
+    В работе одновременно не больше 2 * workers блоков, поэтому память
+    ограничена, даже если загрузка отстаёт от генерации.
+    """
+    started = time.perf_counter()
+    loaded = 0
+    if workers <= 1:
+        for task in tasks:
+            result = _run_chunk(task)
+            loader.load(result)
+            loaded += len(result.get(label, ()))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for task in tasks:
+                pending.append(pool.submit(_run_chunk, task))
+                if len(pending) >= workers * 2:
+                    result = pending.popleft().result()
+                    loader.load(result)
+                    loaded += len(result.get(label, ()))
+            while pending:
+                result = pending.popleft().result()
+                loader.load(result)
+                loaded += len(result.get(label, ()))
+
+    elapsed = time.perf_counter() - started
+    rate = loaded / elapsed if elapsed else 0
+    print(f"{label}: загружено {loaded} строк за {elapsed:.1f} с ({rate:.0f} строк/с)")
+    return loaded
+
+
+def _next_id(connection, model) -> int:
+    return (connection.execute(func.max(model.id).select()).scalar() or 0) + 1
+
+
+def generate(config: GeneratorConfig, bind=default_engine) -> dict:
+    """Генерирует категории, товары, заказы и услуги и загружает их в БД"""
+    with bind.connect() as connection:
+        first_category_id = _next_id(connection, Category)
+        first_product_id = _next_id(connection, Product)
+        first_order_id = _next_id(connection, Order)
+        decorators = [
+            (row.id, float(row.cost))
+            for row in connection.execute(text("SELECT id, cost FROM decorators ORDER BY id"))
+        ]
+
+    loader = BulkLoader(bind)
+    try:
+        if not decorators:
+            with bind.begin() as connection:
+                next_decorator = _next_id(connection, Decorator)
+                connection.execute(
+                    Decorator.__table__.insert(),
+                    [{"id": next_decorator + i, "name": name, "cost": cost}
+                     for i, (name, cost) in enumerate(DEFAULT_DECORATORS)]
+                )
+            decorators = [(next_decorator + i, cost) for i, (_, cost) in enumerate(DEFAULT_DECORATORS)]
+
+        loader.load({"category": [
+            (first_category_id + i, category_name(i)) for i in range(config.categories)
+        ]})
+
+        product_tasks = (
+            (generate_products, config, start, end, first_category_id)
+            for start, end in _chunks(first_product_id, config.products, config.chunk_size)
+        )
+        _stream(loader, product_tasks, config.workers, "product")
+
+        context = {
+            "first_product_id": first_product_id,
+            "product_count": config.products,
+            "first_category_id": first_category_id,
+            "decorators": decorators,
+            "period_start": datetime.now().replace(microsecond=0) - timedelta(days=config.days),
+        }
+        with bind.begin() as connection:
+            # На секционированной БД секции под весь период создаются до загрузки
+            if is_partitioned(connection):
+                create_month_partitions(connection, context["period_start"], datetime.now())
+        order_tasks = (
+            (generate_orders, config, start, end, context)
+            for start, end in _chunks(first_order_id, config.orders, config.chunk_size)
+        )
+        _stream(loader, order_tasks, config.workers, "orders")
+
+        loader.reset_sequences()
+    finally:
+        loader.close()
+
+    # История заказов читает только сводки: без них загруженные заказы в ней не видны
+    started = time.perf_counter()
+    with Session(bind) as db:
+        summaries = rebuild_order_summaries(db, after_id=first_order_id - 1)
+    print(f"order_summaries: собрано {summaries} сводок за {time.perf_counter() - started:.1f} с")
+
+    return {
+        "first_category_id": first_category_id,
+        "first_product_id": first_product_id,
+        "first_order_id": first_order_id,
+    }
+
+
+def main(argv=None):
+    defaults = GeneratorConfig()
+    parser = argparse.ArgumentParser(description="Генератор синтетических данных магазина")
+    parser.add_argument("--categories", type=int, default=defaults.categories)
+    parser.add_argument("--products", type=int, default=defaults.products)
+    parser.add_argument("--orders", type=int, default=defaults.orders)
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--days", type=int, default=defaults.days, help="период истории заказов")
+    parser.add_argument("--popularity-skew", type=float, default=defaults.popularity_skew,
+                        help="показатель степенного закона популярности (0 - равномерно)")
+    parser.add_argument("--items-mean", type=float, default=defaults.items_mean,
+                        help="среднее число позиций в заказе")
+    parser.add_argument("--max-quantity", type=int, default=defaults.max_quantity)
+    parser.add_argument("--decorator-rate", type=float, default=defaults.decorator_rate,
+                        help="доля заказов с дополнительными услугами")
+    parser.add_argument("--price-sigma", type=float, default=defaults.price_sigma,
+                        help="разброс цен (логнормальное распределение)")
+    parser.add_argument("--chunk-size", type=int, default=defaults.chunk_size)
+    parser.add_argument("--workers", type=int, default=defaults.workers)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args(argv)
+
+    generate(GeneratorConfig(**vars(args)))
+
+
+if __name__ == "__main__":
+    main()
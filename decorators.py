@@ -1,12 +1,13 @@
 # decorators.py
 from abc import ABC, abstractmethod
-from decimal import Decimal
 from typing import List
 
+from money import Money
+
 
 class ProductComponent(ABC):
     @abstractmethod
-    def get_price(self) -> Decimal:
+    def get_price(self) -> Money:
         pass
 
     @abstractmethod
@@ -15,13 +16,13 @@ class ProductComponent(ABC):
 
 
 class BaseProduct(ProductComponent):
-    def __init__(self, product_id: int, name: str, base_price: Decimal, description: str):
+    def __init__(self, product_id: int, name: str, base_price: Money, description: str):
         self.product_id = product_id
         self.name = name
-        self.base_price = base_price
+        self.base_price = Money.of(base_price)
         self.base_description = description
 
-    def get_price(self) -> Decimal:
+    def get_price(self) -> Money:
         return self.base_price
 
     def get_description(self) -> str:
@@ -32,7 +33,7 @@ class ProductDecorator(ProductComponent):
     def __init__(self, product: ProductComponent):
         self._product = product
 
-    def get_price(self) -> Decimal:
+    def get_price(self) -> Money:
         return self._product.get_price()
 
     def get_description(self) -> str:
@@ -40,11 +41,11 @@ class ProductDecorator(ProductComponent):
 
 
 class GiftWrapDecorator(ProductDecorator):
-    def __init__(self, product: ProductComponent, wrap_cost: Decimal = Decimal('199.00')):
+    def __init__(self, product: ProductComponent, wrap_cost: Money = Money(19900)):
         super().__init__(product)
         self.wrap_cost = wrap_cost
 
-    def get_price(self) -> Decimal:
+    def get_price(self) -> Money:
         return self._product.get_price() + self.wrap_cost
 
     def get_description(self) -> str:
@@ -52,11 +53,11 @@ class GiftWrapDecorator(ProductDecorator):
 
 
 class ExpressShippingDecorator(ProductDecorator):
-    def __init__(self, product: ProductComponent, shipping_cost: Decimal = Decimal('499.00')):
+    def __init__(self, product: ProductComponent, shipping_cost: Money = Money(49900)):
         super().__init__(product)
         self.shipping_cost = shipping_cost
 
-    def get_price(self) -> Decimal:
+    def get_price(self) -> Money:
         return self._product.get_price() + self.shipping_cost
 
     def get_description(self) -> str:
@@ -65,12 +66,12 @@ class ExpressShippingDecorator(ProductDecorator):
 
 class PersonalizationDecorator(ProductDecorator):
     def __init__(self, product: ProductComponent, personalization_text: str,
-                 personalization_cost: Decimal = Decimal('299.00')):
+                 personalization_cost: Money = Money(29900)):
         super().__init__(product)
         self.personalization_text = personalization_text
         self.personalization_cost = personalization_cost
 
-    def get_price(self) -> Decimal:
+    def get_price(self) -> Money:
         return self._product.get_price() + self.personalization_cost
 
     def get_description(self) -> str:
@@ -78,11 +79,11 @@ class PersonalizationDecorator(ProductDecorator):
 
 
 class InsuranceDecorator(ProductDecorator):
-    def __init__(self, product: ProductComponent, insurance_cost: Decimal = Decimal('249.00')):
+    def __init__(self, product: ProductComponent, insurance_cost: Money = Money(24900)):
         super().__init__(product)
         self.insurance_cost = insurance_cost
 
-    def get_price(self) -> Decimal:
+    def get_price(self) -> Money:
         return self._product.get_price() + self.insurance_cost
 
     def get_description(self) -> str:
@@ -90,11 +91,11 @@ class InsuranceDecorator(ProductDecorator):
 
 
 class ExtendedWarrantyDecorator(ProductDecorator):
-    def __init__(self, product: ProductComponent, warranty_cost: Decimal = Decimal('999.00')):
+    def __init__(self, product: ProductComponent, warranty_cost: Money = Money(99900)):
         super().__init__(product)
         self.warranty_cost = warranty_cost
 
-    def get_price(self) -> Decimal:
+    def get_price(self) -> Money:
         return self._product.get_price() + self.warranty_cost
 
     def get_description(self) -> str:
@@ -102,11 +103,11 @@ class ExtendedWarrantyDecorator(ProductDecorator):
 
 
 class GreetingCardDecorator(ProductDecorator):
-    def __init__(self, product: ProductComponent, card_cost: Decimal = Decimal('99.00')):
+    def __init__(self, product: ProductComponent, card_cost: Money = Money(9900)):
         super().__init__(product)
         self.card_cost = card_cost
 
-    def get_price(self) -> Decimal:
+    def get_price(self) -> Money:
         return self._product.get_price() + self.card_cost
 
     def get_description(self) -> str:
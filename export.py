@@ -0,0 +1,224 @@
+# export.py
+"""Выгрузка заказов для финансов: CSV или Parquet/Arrow (если установлен pyarrow).
+
+Одна строка на позицию заказа: заказ, товар, количество, сумма и услуги заказа.
+Строки читаются курсором на стороне сервера блоками по chunk_size, поэтому
+память не зависит от объёма истории.
+
+Пример: python export.py --format parquet --output orders.parquet --date-from 2026-01-01
+"""
+import argparse
+import csv
+import io
+import sys
+from datetime import date, datetime, timedelta
+from typing import Iterator, List, Optional
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from database import Decorator, Order, OrderDecorator, OrderItem, Product
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+EXPORT_CHUNK_SIZE = 10000
+
+COLUMNS = [
+    "order_id", "user_id", "created_at", "status", "order_total",
+    "product_id", "product_name", "quantity", "subtotal", "decorators"
+]
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def available_formats() -> List[str]:
+    return ["csv", "parquet", "arrow"] if pa is not None else ["csv"]
+
+
+def _decorator_names(dialect_name: str):
+    """Названия услуг заказа одной строкой (string_agg / group_concat)"""
+    if dialect_name == "postgresql":
+        aggregated = func.string_agg(Decorator.name, ", ")
+    else:
+        aggregated = func.group_concat(Decorator.name, ", ")
+    return (
+        select(aggregated)
+        .select_from(OrderDecorator)
+        .join(Decorator, Decorator.id == OrderDecorator.decorator_id)
+        .where(OrderDecorator.order_id == Order.id, OrderDecorator.order_created_at == Order.created_at)
+        .scalar_subquery()
+    )
+
+
+def export_query(dialect_name: str, date_from: Optional[date] = None, date_to: Optional[date] = None,
+                 include_empty_orders: bool = False):
+    """Строка на позицию заказа; с include_empty_orders заказ без позиций даёт строку с пустыми полями позиции"""
+    order_conditions, item_conditions = [], [OrderItem.order_id == Order.id]
+    # Условие и на копию даты в позициях: на секционированной БД читаются только секции периода
+    if date_from:
+        start = datetime.combine(date_from, datetime.min.time())
+        order_conditions.append(Order.created_at >= start)
+        item_conditions.append(OrderItem.order_created_at >= start)
+    if date_to:
+        end = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+        order_conditions.append(Order.created_at < end)
+        item_conditions.append(OrderItem.order_created_at < end)
+
+    query = select(
+        Order.id, Order.user_id, Order.created_at, Order.status, Order.total_amount,
+        OrderItem.product_id, Product.name, OrderItem.quantity, OrderItem.subtotal,
+        _decorator_names(dialect_name)
+    )
+    if include_empty_orders:
+        query = query.outerjoin(OrderItem, and_(*item_conditions))
+    else:
+        query = query.join(OrderItem, and_(*item_conditions))
+    return (
+        query.outerjoin(Product, Product.id == OrderItem.product_id)
+        .where(*order_conditions)
+        .order_by(Order.id, OrderItem.id)
+    )
+
+
+def iter_order_chunks(db: Session, date_from: Optional[date] = None, date_to: Optional[date] = None,
+                      chunk_size: int = EXPORT_CHUNK_SIZE, include_empty_orders: bool = False) -> Iterator[list]:
+    """Блоки строк выгрузки; на PostgreSQL используется серверный курсор"""
+    connection = db.connection().execution_options(stream_results=True, yield_per=chunk_size)
+    result = connection.execute(export_query(connection.dialect.name, date_from, date_to, include_empty_orders))
+    for partition in result.partitions(chunk_size):
+        yield partition
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return "" if value is None else value
+
+
+def write_csv(chunks: Iterator[list]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows([_csv_value(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _arrow_schema():
+    return pa.schema([
+        ("order_id", pa.int64()),
+        ("user_id", pa.int64()),
+        ("created_at", pa.timestamp("s")),
+        ("status", pa.string()),
+        ("order_total", pa.decimal128(14, 2)),
+        ("product_id", pa.int64()),
+        ("product_name", pa.string()),
+        ("quantity", pa.int32()),
+        ("subtotal", pa.decimal128(14, 2)),
+        ("decorators", pa.string()),
+    ])
+
+
+def _arrow_batch(rows: list, schema):
+    columns = list(zip(*rows)) if rows else [[] for _ in COLUMNS]
+    return pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                           schema=schema)
+
+
+class _DrainableSink(io.RawIOBase):
+    """Файловый объект, из которого можно забирать уже записанные байты"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def write_arrow(chunks: Iterator[list], file_format: str) -> Iterator[bytes]:
+    """Parquet (группа строк на блок) или Arrow IPC stream"""
+    if pa is None:
+        raise RuntimeError("Для форматов parquet/arrow нужен пакет pyarrow")
+
+    schema = _arrow_schema()
+    sink = _DrainableSink()
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pa_ipc.new_stream(sink, schema)
+
+    try:
+        for rows in chunks:
+            batch = _arrow_batch(rows, schema)
+            if file_format == "parquet":
+                writer.write_table(pa.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream_export(db: Session, file_format: str = "csv", date_from: Optional[date] = None,
+                  date_to: Optional[date] = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    if file_format not in available_formats():
+        raise ValueError(f"Формат {file_format} недоступен, доступны: {', '.join(available_formats())}")
+
+    chunks = iter_order_chunks(db, date_from, date_to, chunk_size)
+    if file_format == "csv":
+        return write_csv(chunks)
+    return write_arrow(chunks, file_format)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка заказов и позиций заказов")
+    parser.add_argument("--format", choices=["csv", "parquet", "arrow"], default="csv")
+    parser.add_argument("--output", help="файл результата (по умолчанию stdout)")
+    parser.add_argument("--date-from", type=date.fromisoformat)
+    parser.add_argument("--date-to", type=date.fromisoformat)
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    from database import SessionLocal
+
+    db = SessionLocal()
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for data in stream_export(db, args.format, args.date_from, args.date_to, args.chunk_size):
+            output.write(data)
+    finally:
+        if args.output:
+            output.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# facets.py
+"""Фасетный фильтр каталога: несколько категорий, диапазон цен, сортировка.
+
+Счётчики всех фасетов считаются одним GROUP BY по (категория, ценовой
+диапазон, попадание в фильтр цены) — индекс product(category_id, price)
+покрывает этот запрос. Как принято в фасетном поиске, счётчики категорий
+учитывают фильтр цены, но не выбор категорий, а счётчики цен — наоборот.
+"""
+from decimal import Decimal
+from typing import Optional, Sequence
+
+from sqlalchemy import and_, case, func, literal, select, true
+from sqlalchemy.orm import Query, Session
+
+from database import Category, Product
+
+# (подпись, от, до) — нижняя граница включительно, верхняя нет
+PRICE_RANGES = [
+    ("до 1 000₽", None, Decimal("1000")),
+    ("1 000 – 5 000₽", Decimal("1000"), Decimal("5000")),
+    ("5 000 – 20 000₽", Decimal("5000"), Decimal("20000")),
+    ("20 000 – 50 000₽", Decimal("20000"), Decimal("50000")),
+    ("от 50 000₽", Decimal("50000"), None),
+]
+
+CENT = Decimal("0.01")
+
+SORT_ORDERS = {
+    "default": (Product.id,),
+    "price_asc": (Product.price, Product.id),
+    "price_desc": (Product.price.desc(), Product.id),
+    "name": (Product.name, Product.id),
+}
+
+
+def price_condition(price_min: Optional[Decimal], price_max: Optional[Decimal]):
+    conditions = []
+    if price_min is not None:
+        conditions.append(Product.price >= price_min)
+    if price_max is not None:
+        conditions.append(Product.price <= price_max)
+    return and_(true(), *conditions)
+
+
+def search_condition(search: Optional[str]):
+    return Product.name.ilike(f"%{search}%") if search else true()
+
+
+def apply_filters(query: Query, category_ids: Optional[Sequence[int]] = None,
+                  price_min: Optional[Decimal] = None, price_max: Optional[Decimal] = None,
+                  search: Optional[str] = None, sort: str = "default") -> Query:
+    if category_ids:
+        query = query.filter(Product.category_id.in_(category_ids))
+    if price_min is not None or price_max is not None:
+        query = query.filter(price_condition(price_min, price_max))
+    if search:
+        query = query.filter(search_condition(search))
+    return query.order_by(*SORT_ORDERS.get(sort, SORT_ORDERS["default"]))
+
+
+def _price_bucket():
+    whens = []
+    for number, (_, low, high) in enumerate(PRICE_RANGES):
+        if high is not None:
+            whens.append((Product.price < high, number))
+    return case(*whens, else_=len(PRICE_RANGES) - 1)
+
+
+def compute_facets(db: Session, category_ids: Optional[Sequence[int]] = None,
+                   price_min: Optional[Decimal] = None, price_max: Optional[Decimal] = None,
+                   search: Optional[str] = None) -> dict:
+    bucket = _price_bucket().label("bucket")
+    if price_min is not None or price_max is not None:
+        in_price = case((price_condition(price_min, price_max), 1), else_=0).label("in_price")
+    else:
+        in_price = literal(1).label("in_price")
+
+    rows = db.execute(
+        select(Product.category_id, bucket, in_price, func.count(), func.min(Product.price), func.max(Product.price))
+        .where(search_condition(search))
+        .group_by(Product.category_id, bucket, in_price)
+    ).all()
+
+    selected = set(category_ids or [])
+    category_counts, bucket_counts = {}, [0] * len(PRICE_RANGES)
+    total = 0
+    lowest = highest = None
+    for category_id, bucket_number, matches_price, count, row_min, row_max in rows:
+        in_categories = not selected or category_id in selected
+        if matches_price:
+            category_counts[category_id] = category_counts.get(category_id, 0) + count
+        if in_categories:
+            bucket_counts[bucket_number] += count
+            lowest = row_min if lowest is None else min(lowest, row_min)
+            highest = row_max if highest is None else max(highest, row_max)
+        if matches_price and in_categories:
+            total += count
+
+    names = dict(db.execute(select(Category.id, Category.name)).all())
+    categories = [
+        {"id": category_id, "name": name, "count": category_counts.get(category_id, 0),
+         "selected": category_id in selected}
+        for category_id, name in sorted(names.items())
+    ]
+    # Границы для фильтра price_min/price_max, который включает обе границы
+    price_ranges = [
+        {"label": label, "min": float(low) if low is not None else None,
+         "max": float(high - CENT) if high is not None else None, "count": count}
+        for (label, low, high), count in zip(PRICE_RANGES, bucket_counts)
+    ]
+    return {
+        "total": total,
+        "categories": categories,
+        "price_ranges": price_ranges,
+        "price": {"min": float(lowest) if lowest is not None else None,
+                  "max": float(highest) if highest is not None else None},
+    }
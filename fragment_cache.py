@@ -0,0 +1,131 @@
+# fragment_cache.py
+"""Кэш серверных фрагментов каталога.
+
+Изменения, сделанные этим процессом через ORM, сбрасывают фрагменты сразу
+(watch_catalog_changes). Изменения других воркеров и импорта из командной
+строки приходят событиями outbox (apply_catalog_event), а TTL ограничивает
+срок жизни фрагмента, если событие всё же не дошло. Число фрагментов
+ограничено max_entries: давно не запрошенные вытесняются (LRU), а пустой
+результат рендера (нет такого товара) не кэшируется вовсе.
+"""
+import os
+import time
+from collections import OrderedDict
+from threading import RLock
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from sqlalchemy import event, inspect
+
+from database import Category, Decorator, Product
+from outbox import CATALOG_CHANGED
+
+# Поля товара, которые попадают в отрендеренные фрагменты
+RENDERED_PRODUCT_FIELDS = ("price", "name", "description", "category_id")
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "300"))
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "10000"))
+
+
+class FragmentCache:
+    """Кэш отрендеренных фрагментов каталога: по категориям и по товарам"""
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL_SECONDS, max_entries: int = CATALOG_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._fragments: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._expires: Dict[Hashable, float] = {}
+        self._generation = 0
+        self._lock = RLock()
+        # Счётчики попаданий и промахов, в том числе для тестов и отладки
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key: Hashable, render: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._fragments and (not self.ttl or self._expires[key] > time.monotonic()):
+                self.hits += 1
+                self._fragments.move_to_end(key)
+                return self._fragments[key]
+            self.misses += 1
+            generation = self._generation
+
+        value = render()
+
+        with self._lock:
+            # Если во время рендера кэш был инвалидирован, фрагмент мог устареть.
+            # None (например, несуществующий id из адреса) не кэшируется, иначе обход
+            # /product?id=N заполнял бы память
+            if generation == self._generation and value is not None:
+                self._fragments[key] = value
+                self._fragments.move_to_end(key)
+                self._expires[key] = time.monotonic() + self.ttl
+                while len(self._fragments) > self.max_entries:
+                    oldest, _ = self._fragments.popitem(last=False)
+                    self._expires.pop(oldest, None)
+        return value
+
+    def invalidate(self, *keys: Hashable):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._fragments.pop(key, None)
+                self._expires.pop(key, None)
+
+    def invalidate_product(self, product_id: int, category_id: Optional[int] = None):
+        keys = [("product_card", product_id), ("product_details", product_id),
+                ("category", None), ("bundles",)]
+        if category_id is not None:
+            keys.append(("category", category_id))
+        self.invalidate(*keys)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._fragments.clear()
+            self._expires.clear()
+
+    def __len__(self):
+        return len(self._fragments)
+
+
+def watch_catalog_changes(cache: FragmentCache):
+    """Подписывает кэш на изменения товаров и категорий через события SQLAlchemy"""
+
+    def on_product_update(mapper, connection, target):
+        state = inspect(target)
+        if not any(state.attrs[field].history.has_changes() for field in RENDERED_PRODUCT_FIELDS):
+            return
+
+        cache.invalidate_product(target.id, target.category_id)
+        # При переносе товара в другую категорию устаревает и старый список
+        old_categories = state.attrs.category_id.history.deleted
+        for old_category_id in old_categories:
+            cache.invalidate(("category", old_category_id))
+
+    def on_product_insert_or_delete(mapper, connection, target):
+        cache.invalidate_product(target.id, target.category_id)
+
+    def on_category_change(mapper, connection, target):
+        cache.clear()
+
+    def on_decorator_change(mapper, connection, target):
+        # Услуги есть на страницах товаров и в наборах
+        cache.clear()
+
+    event.listen(Product, "after_update", on_product_update)
+    event.listen(Product, "after_insert", on_product_insert_or_delete)
+    event.listen(Product, "after_delete", on_product_insert_or_delete)
+    event.listen(Category, "after_update", on_category_change)
+    event.listen(Category, "after_delete", on_category_change)
+    for event_name in ("after_insert", "after_update", "after_delete"):
+        event.listen(Decorator, event_name, on_decorator_change)
+
+
+def apply_catalog_event(cache: FragmentCache, outbox_event: dict):
+    """Сбрасывает фрагменты по событию каталога из outbox (product.*, catalog.changed)"""
+    payload = outbox_event["payload"]
+    if outbox_event["topic"] == CATALOG_CHANGED and payload.get("model") != "product":
+        cache.clear()
+        return
+    cache.invalidate_product(payload.get("product_id"), payload.get("category_id"))
+    for old_category_id in payload.get("changes", {}).get("category_id", [])[:1]:
+        cache.invalidate(("category", old_category_id))
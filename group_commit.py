@@ -0,0 +1,102 @@
+# group_commit.py
+"""Групповая фиксация записей (group commit).
+
+Каждый заказ, зафиксированный своей транзакцией, ждёт сброса журнала на
+диск (fsync), и пропускная способность упирается в его задержку. Здесь
+записи одновременных запросов собираются в очередь и выполняются одной
+транзакцией: каждые max_delay секунд или как только набралось max_batch
+записей. Каждая запись идёт в своей точке сохранения (SAVEPOINT), поэтому
+ошибка одной откатывает только её, а вызывающий получает свой результат
+или своё исключение.
+
+Записи выполняются в пуле потоков одним пакетом за раз: пока пакет
+фиксируется, следующий набирается в очереди.
+"""
+import asyncio
+import contextvars
+import functools
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+
+class QueueFull(Exception):
+    """В очереди уже max_pending записей"""
+
+
+class GroupCommitter:
+    def __init__(self, session_factory: Callable[[], Session], max_batch: int = 64,
+                 max_delay: float = 0.005, max_pending: int = 1024):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self._pending: List[Tuple[Callable[[Session], Any], asyncio.Future]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._batch_ready: Optional[asyncio.Event] = None
+        self.batches = 0
+        self.committed = 0
+
+    async def submit(self, write: Callable[[Session], Any]) -> Any:
+        """Выполняет write(session) в ближайшем пакете и возвращает его результат.
+
+        write не должна вызывать commit или rollback. Отмена ожидания не
+        отменяет запись, если она уже попала в очередь.
+        """
+        if len(self._pending) >= self.max_pending:
+            raise QueueFull(f"В очереди записи {len(self._pending)} заказов")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Запись выполняется с контекстом вызывающего, как в asyncio.to_thread (профиль запроса)
+        self._pending.append((functools.partial(contextvars.copy_context().run, write), future))
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._batch_ready = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        elif len(self._pending) >= self.max_batch:
+            self._batch_ready.set()
+        return await future
+
+    async def _run(self):
+        while self._pending:
+            if len(self._pending) < self.max_batch:
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            try:
+                outcomes = await asyncio.to_thread(self._flush, [write for write, _ in batch])
+            except Exception as e:
+                outcomes = [(False, e)] * len(batch)
+            for (_, future), (succeeded, value) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if succeeded:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _flush(self, writes: List[Callable[[Session], Any]]) -> List[Tuple[bool, Any]]:
+        """Один пакет: (успех, результат или исключение) на каждую запись"""
+        outcomes = []
+        db = self.session_factory()
+        try:
+            for write in writes:
+                try:
+                    with db.begin_nested():
+                        outcomes.append((True, write(db)))
+                except Exception as e:
+                    outcomes.append((False, e))
+            db.commit()
+        except Exception as e:
+            # Не удалась сама фиксация: не записан ни один заказ пакета
+            db.rollback()
+            return [(False, e)] * len(writes)
+        finally:
+            db.close()
+
+        self.batches += 1
+        self.committed += sum(1 for succeeded, _ in outcomes if succeeded)
+        return outcomes
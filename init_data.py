@@ -1,5 +1,16 @@
 from database import SessionLocal, Category, Product, Decorator
 
+DEFAULT_CATEGORIES = ["Электроника", "Одежда", "Бытовая техника", "Книги", "Спорт и отдых"]
+
+DEFAULT_DECORATORS = [
+    ("Подарочная упаковка", 199.00),
+    ("Срочная доставка", 499.00),
+    ("Персонализация (гравировка)", 299.00),
+    ("Страхование товара", 249.00),
+    ("Расширенная гарантия", 999.00),
+    ("Поздравительная открытка", 99.00),
+]
+
 
 def init_database():
     db = SessionLocal()
@@ -8,13 +19,7 @@ def init_database():
         # Проверяем, есть ли уже категории
         existing_categories = db.query(Category).count()
         if existing_categories == 0:
-            categories = [
-                Category(name="Электроника"),
-                Category(name="Одежда"),
-                Category(name="Бытовая техника"),
-                Category(name="Книги"),
-                Category(name="Спорт и отдых")
-            ]
+            categories = [Category(name=name) for name in DEFAULT_CATEGORIES]
 
             for category in categories:
                 db.add(category)
@@ -68,14 +73,7 @@ def init_database():
         # Проверяем, есть ли уже декораторы
         existing_decorators = db.query(Decorator).count()
         if existing_decorators == 0:
-            decorators = [
-                Decorator(name="Подарочная упаковка", cost=199.00),
-                Decorator(name="Срочная доставка", cost=499.00),
-                Decorator(name="Персонализация (гравировка)", cost=299.00),
-                Decorator(name="Страхование товара", cost=249.00),
-                Decorator(name="Расширенная гарантия", cost=999.00),
-                Decorator(name="Поздравительная открытка", cost=99.00),
-            ]
+            decorators = [Decorator(name=name, cost=cost) for name, cost in DEFAULT_DECORATORS]
 
             for decorator in decorators:
                 db.add(decorator)
@@ -0,0 +1,127 @@
+# inventory.py
+"""Складские остатки и резервы под неоплаченные заказы.
+
+Остаток списывается одним условным UPDATE ... WHERE stock >= :qty RETURNING,
+без SELECT ... FOR UPDATE: строка товара блокируется только на время
+этого оператора и до фиксации транзакции, поэтому заказы популярного товара
+не выстраиваются в очередь на чтение. Списанное под заказ хранится в
+stock_reservations до оплаты; неоплаченные резервы по истечении TTL
+возвращаются на склад, а заказ отменяется.
+"""
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.orm import Session
+
+from database import Order, Product, StockReservation
+from order_status import OrderStatus, can_transition, transition
+
+RESERVATION_TTL_SECONDS = int(os.getenv("RESERVATION_TTL_SECONDS", "900"))
+EXPIRY_BATCH_SIZE = 500
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id: int, requested: int):
+        super().__init__(f"Недостаточно товара {product_id} на складе (запрошено {requested})")
+        self.product_id = product_id
+        self.requested = requested
+
+
+def take_stock(db: Session, product_id: int, quantity: int) -> Optional[int]:
+    """Атомарно списывает остаток; возвращает новый остаток или None, если он не отслеживается"""
+    if quantity < 1:
+        raise ValueError(f"Количество товара {product_id} должно быть положительным: {quantity}")
+    row = db.execute(
+        update(Product)
+        .where(Product.id == product_id, or_(Product.stock.is_(None), Product.stock >= quantity))
+        .values(stock=Product.stock - quantity)
+        .returning(Product.stock)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        raise OutOfStock(product_id, quantity)
+    return row[0]
+
+
+def return_stock(db: Session, product_id: int, quantity: int):
+    db.execute(
+        update(Product)
+        .where(Product.id == product_id, Product.stock.is_not(None))
+        .values(stock=Product.stock + quantity)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def reserve_items(db: Session, order_id: int, items: Iterable[Tuple[int, int]],
+                  ttl_seconds: int = RESERVATION_TTL_SECONDS):
+    """Списывает остатки под заказ; фиксация транзакции остаётся за вызывающим кодом.
+
+    Лучше вызывать последним шагом перед commit: блокировка строк товаров
+    держится до конца транзакции. Товары обходятся в порядке id, чтобы
+    параллельные заказы не взаимоблокировались.
+    """
+    quantities = Counter()
+    for product_id, quantity in items:
+        if quantity < 1:
+            raise ValueError(f"Количество товара {product_id} должно быть положительным: {quantity}")
+        quantities[product_id] += quantity
+
+    expires_at = datetime.now() + timedelta(seconds=ttl_seconds)
+    for product_id in sorted(quantities):
+        if take_stock(db, product_id, quantities[product_id]) is not None:
+            db.add(StockReservation(order_id=order_id, product_id=product_id,
+                                    quantity=quantities[product_id], expires_at=expires_at))
+
+
+def confirm_reservations(db: Session, order_id: int):
+    """Заказ оплачен: списание окончательное, резервы больше не нужны"""
+    db.execute(delete(StockReservation).where(StockReservation.order_id == order_id))
+
+
+def release_reservations(db: Session, order_id: int) -> int:
+    """Возвращает на склад всё, что зарезервировано под заказ"""
+    reservations = db.execute(
+        select(StockReservation.product_id, StockReservation.quantity)
+        .where(StockReservation.order_id == order_id)
+        .order_by(StockReservation.product_id)
+    ).all()
+    for product_id, quantity in reservations:
+        return_stock(db, product_id, quantity)
+    db.execute(delete(StockReservation).where(StockReservation.order_id == order_id))
+    return len(reservations)
+
+
+def expire_reservations(db: Session, now: Optional[datetime] = None,
+                        batch_size: int = EXPIRY_BATCH_SIZE) -> int:
+    """Отменяет неоплаченные заказы с истёкшим резервом, возвращает число таких заказов"""
+    now = now or datetime.now()
+    expired = 0
+    while True:
+        order_ids = db.scalars(
+            select(StockReservation.order_id)
+            .where(StockReservation.expires_at < now)
+            .group_by(StockReservation.order_id)
+            .order_by(StockReservation.order_id)
+            .limit(batch_size)
+        ).all()
+        if not order_ids:
+            return expired
+
+        orders = db.query(Order).filter(Order.id.in_(order_ids)).with_for_update().all()
+        for order in orders:
+            if can_transition(order.status, OrderStatus.CANCELLED) and order.status != OrderStatus.PAID:
+                release_reservations(db, order.id)
+                transition(order, OrderStatus.CANCELLED)
+                expired += 1
+            elif order.status == OrderStatus.CANCELLED:
+                release_reservations(db, order.id)
+            else:
+                # Заказ уже оплачен: резерв стал окончательным списанием
+                confirm_reservations(db, order.id)
+        # Резерв без заказа (заказ удалён) иначе попадал бы в каждую следующую пачку
+        for order_id in set(order_ids) - {order.id for order in orders}:
+            release_reservations(db, order_id)
+        db.commit()
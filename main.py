@@ -1,27 +1,270 @@
 # main.py
-from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, File, HTTPException, Query, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, StreamingResponse
+from sqlalchemy import event
 from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+import asyncio
+import io
 import os
-import uvicorn
+import time
 
-from database import SessionLocal, engine, Base, Product, Category, Order, OrderItem, Decorator, OrderDecorator
-from adapters import (
-    YooKassaPaymentAdapter, SberPaymentAdapter,
-    CDEKDeliveryAdapter, YandexMarketDeliveryAdapter
+from database import (
+    SessionLocal, engine, prefill_pool, replica_router,
+    Product, Category, Order, OrderItem, Decorator, OrderDecorator, OrderSummary, User
 )
+from adapters import YooKassaPaymentAdapter, SberPaymentAdapter, DELIVERY_ADAPTERS
 from decorators import BaseProduct, DecoratorManager
 from composite import CatalogManager
+from money import Money
+from order_summaries import build_order_summary, summary_item
+from order_status import (
+    OrderStatus, InvalidStatusTransition, can_transition, transition, status_label,
+    status_after_payment, status_after_delivery
+)
+from fragment_cache import FragmentCache, apply_catalog_event, watch_catalog_changes
+from inventory import OutOfStock, confirm_reservations, expire_reservations, reserve_items
+from outbox import (
+    CATALOG_CHANGED, ORDER_CREATED, ORDER_DELIVERY_SCHEDULED, PRODUCT_CREATED, PRODUCT_UPDATED,
+    EventBus, OutboxRelay, OutboxTail, emit, purge_published,
+    watch_catalog_structure_changes, watch_order_status_changes, watch_product_changes
+)
+from push import PUSH_POLL_SECONDS, OrderEventTail, PushHub, event_stream
+from catalog_snapshot import SnapshotReader, SnapshotWriter
+from partitions import ensure_partitions
+from tracking import TRACKING_INTERVAL_SECONDS, ShipmentTracker, record_shipment
+from singleflight import SingleFlight, normalize_key
+from recommendations import CoOccurrenceIndex, publish_index
+from ratelimit import SHED_RETRY_AFTER_SECONDS, ConcurrencyLimiter, RateLimiter, retry_after_header
+from group_commit import GroupCommitter, QueueFull
+from profiling import PROFILE_DIR, PROFILE_HEADER, PROFILING_TOKEN, ProfilingMiddleware, load_profile, token_matches
+from auth import (
+    create_access_token, get_current_user_id, get_stream_user_id, hash_password,
+    require_admin, validate_password, verify_password
+)
+import analytics
+import catalog_import
+import export
+import facets
+
+# Схема БД создаётся отдельным шагом: python manage.py migrate
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+# Процесс уже прогрет: с preload мастер gunicorn прогревается до fork, и воркеры получают его кэши
+warmed_up = False
+
+
+def warm_up():
+    """Прогрев воркера: заполнение пула соединений и предзагрузка кэша каталога"""
+    global warmed_up
+    started = time.perf_counter()
+    try:
+        prefill_pool(engine)
+        for reader in replica_router.readers:
+            prefill_pool(reader)
+        if catalog_snapshot_writer:
+            catalog_snapshot_writer.publish_if_needed()
+
+        db = SessionLocal()
+        try:
+            category_ids = [None] + [category.id for category in db.query(Category.id).all()]
+            for category_id in category_ids:
+                products = load_category_listing(db, category_id)
+                for product in products[:PRODUCTS_PER_PAGE]:
+                    render_product_card(product)
+            load_decorators_fragment(db)
+        finally:
+            db.close()
+    except Exception as e:
+        # Недоступная БД не должна мешать старту воркера
+        print(f"Прогрев пропущен: {e}")
+        return None
+
+    warmed_up = True
+    elapsed = time.perf_counter() - started
+    print(f"Прогрев завершён за {elapsed * 1000:.1f} мс")
+    return elapsed
+
+
+BACKGROUND_JOBS_ENABLED = os.getenv("BACKGROUND_JOBS", "1") == "1"
+ANALYTICS_REFRESH_SECONDS = float(os.getenv("ANALYTICS_REFRESH_SECONDS", "60"))
+RESERVATION_EXPIRY_SECONDS = float(os.getenv("RESERVATION_EXPIRY_SECONDS", "30"))
+OUTBOX_RELAY_SECONDS = float(os.getenv("OUTBOX_RELAY_SECONDS", "1"))
+OUTBOX_PURGE_SECONDS = 3600
+# Как часто каждый воркер читает из outbox события для своего состояния в памяти
+WORKER_EVENTS_SECONDS = float(os.getenv("WORKER_EVENTS_SECONDS", "1"))
+RECOMMENDATIONS_REBUILD_SECONDS = float(os.getenv("RECOMMENDATIONS_REBUILD_SECONDS", "3600"))
+# Как часто воркер проверяет, не пора ли пересобрать общий индекс и не появилась ли новая сборка
+RECOMMENDATIONS_CHECK_SECONDS = float(os.getenv("RECOMMENDATIONS_CHECK_SECONDS", "60"))
+# Секции заказов на следующие месяцы проверяются раз в сутки (partitions.py)
+ORDER_PARTITIONS_SECONDS = 86400
+# Сколько дней истории отладочный список заказов читает по умолчанию
+HOT_ORDER_DAYS = int(os.getenv("HOT_ORDER_DAYS", "30"))
+# Общий для всех воркеров снимок каталога в файле; без пути каталог читается из БД
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "")
+CATALOG_SNAPSHOT_SECONDS = float(os.getenv("CATALOG_SNAPSHOT_SECONDS", "2"))
+
+# События заказов и каталога: пишутся в outbox вместе с изменением и
+# доставляются подписчикам event_bus фоновой задачей, вне пути запроса
+event_bus = EventBus()
+outbox_relay = OutboxRelay(SessionLocal, event_bus)
+watch_product_changes()
+watch_catalog_structure_changes()
+watch_order_status_changes()
+# Отмена уже посчитанного заказа вычитается из сводок продаж в той же транзакции
+analytics.watch_sales_status_changes()
+
+# Релей отдаёт событие одному воркеру, а индексы и кэши в памяти есть у каждого:
+# для них каждый воркер читает outbox сам
+worker_events = EventBus()
+worker_event_tail = OutboxTail(
+    SessionLocal, (ORDER_CREATED, PRODUCT_CREATED, PRODUCT_UPDATED, CATALOG_CHANGED), worker_events
+)
+
+# Обновления заказов для открытых страниц «Мои заказы» (push.py)
+push_hub = PushHub()
+order_event_tail = OrderEventTail(SessionLocal, push_hub)
+
+# Статусы отправлений: пакетные запросы к службам доставки, доставленные заказы закрываются
+shipment_tracker = ShipmentTracker(SessionLocal)
+
+# «С этим товаром покупают»: полную сборку делает один воркер, остальные загружают её из БД;
+# новые заказы — из outbox
+recommendation_index = CoOccurrenceIndex()
+worker_events.subscribe(ORDER_CREATED, recommendation_index.on_order_created)
+
+# Снимок пересобирает тот воркер, которому outbox доставил изменение; остальные подхватывают файл
+catalog_snapshot_reader = SnapshotReader(CATALOG_SNAPSHOT_PATH) if CATALOG_SNAPSHOT_PATH else None
+catalog_snapshot_writer = SnapshotWriter(CATALOG_SNAPSHOT_PATH, SessionLocal) if CATALOG_SNAPSHOT_PATH else None
+# catalog.changed приходит и при удалении товара или переименовании категории
+CATALOG_SNAPSHOT_TOPICS = (PRODUCT_CREATED, PRODUCT_UPDATED, CATALOG_CHANGED)
+if catalog_snapshot_writer:
+    for topic in CATALOG_SNAPSHOT_TOPICS:
+        event_bus.subscribe(topic, catalog_snapshot_writer.mark_stale)
+
+
+def refresh_analytics():
+    db = SessionLocal()
+    try:
+        processed = analytics.refresh_rollups(db)
+        if processed:
+            print(f"Аналитика: обработано заказов {processed}")
+    finally:
+        db.close()
+
+
+async def run_periodically(job, interval: float):
+    """Фоновая задача воркера: выполняет job в отдельном потоке каждые interval секунд"""
+    while True:
+        try:
+            await asyncio.to_thread(job)
+        except Exception as e:
+            print(f"Ошибка фоновой задачи {job.__name__}: {e}")
+        await asyncio.sleep(interval)
+
+
+def release_expired_reservations():
+    db = SessionLocal()
+    try:
+        expired = expire_reservations(db)
+        if expired:
+            print(f"Отменено заказов с истёкшим резервом: {expired}")
+    finally:
+        db.close()
 
-# Создание таблиц
-Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="E-Commerce API", version="1.0.0")
+def relay_outbox():
+    outbox_relay.relay_pending()
+
+
+def purge_outbox():
+    db = SessionLocal()
+    try:
+        purge_published(db)
+    finally:
+        db.close()
+
+
+def rebuild_recommendations():
+    db = SessionLocal()
+    try:
+        built = publish_index(db, max_age=RECOMMENDATIONS_REBUILD_SECONDS)
+        if built is not None:
+            print(f"Рекомендации пересобраны: товаров {built}")
+        loaded = recommendation_index.load_shared(db)
+    finally:
+        db.close()
+    if loaded:
+        # Наборы на странице /bundles строятся по рекомендациям
+        catalog_cache.invalidate(("bundles",))
+
+
+def publish_catalog_snapshot():
+    version = catalog_snapshot_writer.publish_if_needed()
+    if version:
+        print(f"Снимок каталога обновлён: версия {version}")
+
+
+def tail_order_events():
+    order_event_tail.poll()
+
+
+def tail_worker_events():
+    worker_event_tail.poll()
+
+
+def track_shipments():
+    checked = shipment_tracker.track_due()
+    if checked:
+        print(f"Проверено отправлений: {checked}")
+
+
+def ensure_order_partitions():
+    with engine.begin() as connection:
+        created = ensure_partitions(connection)
+    if created:
+        print(f"Созданы секции заказов: {created}")
+
+
+def background_jobs():
+    jobs = [
+        (refresh_analytics, ANALYTICS_REFRESH_SECONDS),
+        (release_expired_reservations, RESERVATION_EXPIRY_SECONDS),
+        (relay_outbox, OUTBOX_RELAY_SECONDS),
+        (purge_outbox, OUTBOX_PURGE_SECONDS),
+        (rebuild_recommendations, RECOMMENDATIONS_CHECK_SECONDS),
+        (ensure_order_partitions, ORDER_PARTITIONS_SECONDS),
+        (tail_order_events, PUSH_POLL_SECONDS),
+        (tail_worker_events, WORKER_EVENTS_SECONDS),
+        (track_shipments, TRACKING_INTERVAL_SECONDS),
+    ]
+    if catalog_snapshot_writer:
+        jobs.append((publish_catalog_snapshot, CATALOG_SNAPSHOT_SECONDS))
+    return jobs
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP_ON_STARTUP and not warmed_up:
+        await asyncio.to_thread(warm_up)
+
+    tasks = []
+    if BACKGROUND_JOBS_ENABLED:
+        tasks = [asyncio.create_task(run_periodically(job, interval)) for job, interval in background_jobs()]
+    yield
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+app = FastAPI(title="E-Commerce API", version="1.0.0", lifespan=lifespan)
 
 # Настройка статических файлов и шаблонов
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -36,6 +279,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Профилирование запроса по X-Profile: <PROFILING_TOKEN> (profiling.py); без токена не подключается
+if PROFILING_TOKEN:
+    app.add_middleware(ProfilingMiddleware, token=PROFILING_TOKEN, directory=PROFILE_DIR)
+
 
 # Зависимость БД
 def get_db():
@@ -46,12 +293,121 @@ def get_db():
         db.close()
 
 
+# После записи клиент какое-то время читает из основной БД (read-your-writes)
+READ_YOUR_WRITES_COOKIE = "read_writer_until"
+READ_YOUR_WRITES_SECONDS = int(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+
+
+def stick_to_writer(response: Response):
+    until = int(time.time()) + READ_YOUR_WRITES_SECONDS
+    response.set_cookie(READ_YOUR_WRITES_COOKIE, str(until), max_age=READ_YOUR_WRITES_SECONDS, httponly=True)
+
+
+def is_sticky_to_writer(request: Request) -> bool:
+    try:
+        return int(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def get_read_db(request: Request, writer_db: Session = Depends(get_db)):
+    """Сессия для чтения: реплика, если она не отстаёт, иначе основная БД.
+
+    Сессия основной БД создаётся лениво и не открывает соединение,
+    пока чтение обслуживает реплика.
+    """
+    db = None
+    if replica_router.has_readers and not is_sticky_to_writer(request):
+        db = replica_router.reader_session()
+
+    if db is None:
+        yield writer_db
+        return
+
+    try:
+        yield db
+    finally:
+        db.close()
+
+
 # Инициализация менеджеров
 decorator_manager = DecoratorManager()
 catalog_manager = CatalogManager()
 
+# Кэш серверных фрагментов каталога, сбрасывается при изменении цен
+catalog_cache = FragmentCache()
+watch_catalog_changes(catalog_cache)
+
+# Одинаковые одновременные запросы каталога выполняются один раз;
+# с CATALOG_FRESH_SECONDS/CATALOG_STALE_SECONDS результат ещё и переиспользуется
+catalog_flight = SingleFlight(
+    fresh_seconds=float(os.getenv("CATALOG_FRESH_SECONDS", "0")),
+    stale_seconds=float(os.getenv("CATALOG_STALE_SECONDS", "0"))
+)
+
+
+def forget_catalog_results(*args):
+    catalog_flight.invalidate()
+
+
+def on_catalog_event(outbox_event: dict):
+    """Изменение каталога другим воркером или импортом из командной строки"""
+    catalog_flight.invalidate()
+    apply_catalog_event(catalog_cache, outbox_event)
+
+
+for catalog_topic in (PRODUCT_CREATED, PRODUCT_UPDATED, CATALOG_CHANGED):
+    worker_events.subscribe(catalog_topic, on_catalog_event)
+
+
+for catalog_model in (Product, Category, Decorator):
+    for event_name in ("after_insert", "after_update", "after_delete"):
+        event.listen(catalog_model, event_name, forget_catalog_results)
+
+
+def coalesce(route: str, db: Session, params: dict, load):
+    """load(session) один раз на одинаковые параметры.
+
+    У вычисления своя сессия на том же движке, что и у запроса (реплика или
+    основная БД), поэтому оно переживает запрос-инициатор и не смешивает
+    клиентов, которым нужна основная БД, с читающими реплику.
+    """
+    bind = db.get_bind()
+
+    def compute():
+        with Session(bind=bind) as session:
+            return load(session)
+
+    return catalog_flight.do(normalize_key(route, dict(params, bind=id(bind))), compute)
+
+# Защита от всплесков: лимит на клиента и маршрут, плюс сброс нагрузки при заполненном пуле БД
+rate_limiter = RateLimiter()
+db_admission = ConcurrencyLimiter()
+limit_orders = rate_limiter.limit("orders", rate=2, burst=10)
+
+# Групповая фиксация заказов (group_commit.py): ORDER_GROUP_COMMIT=1
+ORDER_GROUP_COMMIT = os.getenv("ORDER_GROUP_COMMIT", "0") == "1"
+ORDER_GROUP_COMMIT_MS = float(os.getenv("ORDER_GROUP_COMMIT_MS", "5"))
+ORDER_GROUP_COMMIT_BATCH = int(os.getenv("ORDER_GROUP_COMMIT_BATCH", "64"))
+order_committer = GroupCommitter(
+    SessionLocal, max_batch=ORDER_GROUP_COMMIT_BATCH, max_delay=ORDER_GROUP_COMMIT_MS / 1000
+) if ORDER_GROUP_COMMIT else None
+limit_payments = rate_limiter.limit("payments", rate=2, burst=10)
+limit_price_calculation = rate_limiter.limit("calculate_price", rate=20, burst=50)
+limit_logins = rate_limiter.limit("login", rate=0.2, burst=5)
+
+PRODUCTS_PER_PAGE = 9
+CATEGORY_ICONS = {
+    "Электроника": "📱",
+    "Одежда": "👕",
+    "Бытовая техника": "🖥",
+    "Книги": "📔",
+    "Спорт и отдых": "🎾"
+}
+
 # Pydantic модели
-from pydantic import BaseModel
+from pydantic import BaseModel, EmailStr
+from sqlalchemy.exc import IntegrityError
 
 
 class ProductResponse(BaseModel):
@@ -69,12 +425,24 @@ class DecoratorResponse(BaseModel):
 
 
 class OrderCreate(BaseModel):
-    user_id: int
+    # Не используется: заказ оформляется на владельца токена (без токена — демо-пользователь)
+    user_id: Optional[int] = None
     items: List[dict]
     decorators: List[str] = []
     personalization_text: Optional[str] = None
 
 
+class RegisterRequest(BaseModel):
+    email: EmailStr
+    password: str
+    name: Optional[str] = None
+
+
+class LoginRequest(BaseModel):
+    email: EmailStr
+    password: str
+
+
 class PaymentRequest(BaseModel):
     order_id: int
     payment_provider: str
@@ -93,19 +461,111 @@ async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 
+def serialize_product(product: Product) -> dict:
+    """Товар в том же виде, что отдаёт /api/products/"""
+    return {
+        "id": product.id,
+        "name": product.name,
+        "price": str(product.price),
+        "description": product.description or "",
+        "category_name": product.category.name if product.category else "Unknown"
+    }
+
+
+def render_fragment(template_name: str, **context) -> str:
+    return templates.get_template(template_name).render(**context)
+
+
+def load_category_listing(db: Session, category_id: Optional[int]) -> List[dict]:
+    """Список товаров категории (или всего каталога), кэшируется по категории"""
+    def load():
+        query = db.query(Product).options(joinedload(Product.category)).order_by(Product.id)
+        if category_id:
+            query = query.filter(Product.category_id == category_id)
+        return [serialize_product(product) for product in query.all()]
+
+    return catalog_cache.get_or_render(("category", category_id), load)
+
+
+def render_product_card(product: dict) -> str:
+    return catalog_cache.get_or_render(
+        ("product_card", product["id"]),
+        lambda: render_fragment(
+            "partials/product_card.html",
+            product=product,
+            icon=CATEGORY_ICONS.get(product["category_name"], "📦")
+        )
+    )
+
+
+def load_decorators_fragment(db: Session) -> dict:
+    def load():
+        decorators = [
+            {"id": decorator.id, "name": decorator.name, "cost": str(decorator.cost)}
+            for decorator in db.query(Decorator).order_by(Decorator.id).all()
+        ]
+        return {
+            "data": decorators,
+            "html": render_fragment("partials/decorators.html", decorators=decorators)
+        }
+
+    return catalog_cache.get_or_render(("decorators",), load)
+
+
 @app.get("/products", response_class=HTMLResponse)
-async def read_products(request: Request):
-    return templates.TemplateResponse("products.html", {"request": request})
+async def read_products(
+        request: Request,
+        db: Session = Depends(get_read_db),
+        category_id: Optional[int] = Query(None)
+):
+    products = load_category_listing(db, category_id)
+    first_page = products[:PRODUCTS_PER_PAGE]
+    # В страницу встраивается только первая страница каталога, а не весь список
+    return templates.TemplateResponse("products.html", {
+        "request": request,
+        "products": first_page,
+        "total_products": len(products),
+        "cards_html": "".join(render_product_card(product) for product in first_page)
+    })
 
 
 @app.get("/product", response_class=HTMLResponse)
-async def read_product(request: Request):
-    return templates.TemplateResponse("product.html", {"request": request})
+async def read_product(
+        request: Request,
+        db: Session = Depends(get_read_db),
+        id: Optional[int] = Query(None)
+):
+    if id is None:
+        return RedirectResponse("/products")
+
+    def load():
+        product = db.query(Product).options(joinedload(Product.category)).filter(Product.id == id).first()
+        if not product:
+            return None
+        data = serialize_product(product)
+        return {"data": data, "html": render_fragment("partials/product_details.html", product=data)}
+
+    product = catalog_cache.get_or_render(("product_details", id), load)
+    decorators = load_decorators_fragment(db)
+    return templates.TemplateResponse("product.html", {
+        "request": request,
+        "product": product,
+        "decorators": decorators
+    }, status_code=200 if product else 404)
 
 
 @app.get("/bundles", response_class=HTMLResponse)
-async def read_bundles(request: Request):
-    return templates.TemplateResponse("bundles.html", {"request": request})
+async def read_bundles(request: Request, db: Session = Depends(get_read_db)):
+    def load():
+        bundles = build_bundles(db)
+        cards = [
+            render_fragment("partials/bundle_card.html", key=key, bundle=bundle)
+            for key, bundle in bundles.items()
+        ]
+        return {"data": bundles, "html": "".join(cards)}
+
+    bundles = catalog_cache.get_or_render(("bundles",), load)
+    return templates.TemplateResponse("bundles.html", {"request": request, "bundles": bundles})
 
 
 @app.get("/cart", response_class=HTMLResponse)
@@ -130,10 +590,12 @@ async def test_api():
 
 # API endpoints
 @app.get("/api/categories/", response_model=List[dict])
-async def get_categories(db: Session = Depends(get_db)):
+async def get_categories(db: Session = Depends(get_read_db)):
+    def load(session: Session):
+        return [{"id": cat.id, "name": cat.name} for cat in session.query(Category).all()]
+
     try:
-        categories = db.query(Category).all()
-        return [{"id": cat.id, "name": cat.name} for cat in categories]
+        return await coalesce("categories", db, {}, load)
     except Exception as e:
         print(f"Ошибка в get_categories: {e}")
         return []
@@ -141,60 +603,93 @@ async def get_categories(db: Session = Depends(get_db)):
 
 @app.get("/api/products/", response_model=List[ProductResponse])
 async def get_products(
-        db: Session = Depends(get_db),
-        category_id: Optional[int] = Query(None),
+        db: Session = Depends(get_read_db),
+        category_id: Optional[List[int]] = Query(None, description="можно указать несколько раз"),
         search: Optional[str] = Query(None),
-        limit: Optional[int] = Query(None)
+        price_min: Optional[Decimal] = Query(None, ge=0),
+        price_max: Optional[Decimal] = Query(None, ge=0),
+        sort: str = Query("default", pattern="^(default|price_asc|price_desc|name)$"),
+        limit: Optional[int] = Query(None),
+        offset: int = Query(0, ge=0)
 ):
     try:
-        query = db.query(Product).options(joinedload(Product.category))
-
-        if category_id:
-            query = query.filter(Product.category_id == category_id)
-
-        if search:
-            query = query.filter(Product.name.ilike(f"%{search}%"))
-
-        if limit:
-            query = query.limit(limit)
-
-        products = query.all()
-
-        result = []
-        for product in products:
-            category_name = product.category.name if product.category else "Unknown"
-            result.append(ProductResponse(
-                id=product.id,
-                name=product.name,
-                price=product.price,
-                description=product.description or "",
-                category_name=category_name
-            ))
-
-        return result
+        snapshot = catalog_snapshot_reader.current() if catalog_snapshot_reader else None
+        if snapshot is not None:
+            return [
+                ProductResponse(id=product["id"], name=product["name"], price=product["price"],
+                                description=product["description"], category_name=product["category_name"])
+                for product in snapshot.select(category_id, price_min, price_max, search, sort, offset, limit)
+            ]
+
+        def load(session: Session):
+            query = session.query(Product).options(joinedload(Product.category))
+            query = facets.apply_filters(query, category_id, price_min, price_max, search, sort)
+
+            if offset:
+                query = query.offset(offset)
+
+            if limit:
+                query = query.limit(limit)
+
+            products = query.all()
+
+            result = []
+            for product in products:
+                category_name = product.category.name if product.category else "Unknown"
+                result.append(ProductResponse(
+                    id=product.id,
+                    name=product.name,
+                    price=product.price,
+                    description=product.description or "",
+                    category_name=category_name
+                ))
+
+            return result
+
+        params = {"category_id": category_id, "search": search, "price_min": price_min, "price_max": price_max,
+                  "sort": sort, "limit": limit, "offset": offset}
+        return await coalesce("products", db, params, load)
 
     except Exception as e:
         print(f"Ошибка в get_products: {e}")
         return []
 
 
+@app.get("/api/products/facets")
+async def get_product_facets(
+        db: Session = Depends(get_read_db),
+        category_id: Optional[List[int]] = Query(None),
+        search: Optional[str] = Query(None),
+        price_min: Optional[Decimal] = Query(None, ge=0),
+        price_max: Optional[Decimal] = Query(None, ge=0)
+):
+    """Счётчики по категориям и ценовым диапазонам для текущего фильтра, одним запросом"""
+    return facets.compute_facets(db, category_id, price_min, price_max, search)
+
+
 @app.get("/api/decorators/", response_model=List[DecoratorResponse])
-async def get_decorators(db: Session = Depends(get_db)):
-    decorators = db.query(Decorator).all()
-    return [
-        DecoratorResponse(
-            id=decorator.id,
-            name=decorator.name,
-            cost=decorator.cost
-        )
-        for decorator in decorators
-    ]
+async def get_decorators(db: Session = Depends(get_read_db)):
+    def load(session: Session):
+        return [
+            DecoratorResponse(
+                id=decorator.id,
+                name=decorator.name,
+                cost=decorator.cost
+            )
+            for decorator in session.query(Decorator).all()
+        ]
 
+    return await coalesce("decorators", db, {}, load)
 
-@app.post("/api/calculate-price/")
+
+@app.post("/api/calculate-price/", dependencies=[Depends(limit_price_calculation)])
 async def calculate_price(product_data: dict):
     try:
-        base_price = Decimal(str(product_data["base_price"]))
+        # Цена берётся из снимка каталога, если товар в нём есть, а не со слов клиента
+        snapshot = catalog_snapshot_reader.current() if catalog_snapshot_reader else None
+        base_price = snapshot.price(product_data["product_id"]) if snapshot is not None else None
+        if base_price is None:
+            base_price = Money.from_rubles(product_data["base_price"])
         quantity = product_data.get("quantity", 1)
         decorators = product_data.get("decorators", [])
 
@@ -229,90 +724,261 @@ async def calculate_price(product_data: dict):
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.get("/api/bundles/")
-async def get_bundles():
-    gaming_bundle = catalog_manager.create_computer_bundle()
-    office_bundle = catalog_manager.create_office_bundle()
-    clothing_bundle = catalog_manager.create_clothing_bundle()
+def build_recommended_bundles(db: Session) -> dict:
+    """Наборы из товаров, которые чаще всего покупают вместе"""
+    frequent = recommendation_index.frequent_bundles()
+    product_ids = {product_id for members, _ in frequent for product_id in members}
+    if not product_ids:
+        return {}
+
+    products = {product.id: product for product in db.query(Product).filter(Product.id.in_(product_ids)).all()}
+    bundles = {}
+    for number, (members, support) in enumerate(frequent, 1):
+        if not all(product_id in products for product_id in members):
+            continue
+        key = f"frequently_bought_{number}"
+        bundles[key] = catalog_manager.create_bundle(
+            key,
+            "Часто покупают вместе",
+            f"Эти товары вместе купили в {support} заказах",
+            [
+                {"id": product.id, "name": product.name, "price": product.price,
+                 "description": product.description or ""}
+                for product in (products[product_id] for product_id in members)
+            ]
+        )
+    return bundles
+
+
+def build_bundles(db: Session) -> dict:
+    bundles = {
+        "gaming_computer": catalog_manager.create_computer_bundle(),
+        "office_workspace": catalog_manager.create_office_bundle(),
+        "casual_outfit": catalog_manager.create_clothing_bundle()
+    }
+    bundles.update(build_recommended_bundles(db))
 
     return {
-        "bundles": {
-            "gaming_computer": {
-                "name": gaming_bundle.name,
-                "description": gaming_bundle.description,
-                "total_price": float(gaming_bundle.get_price()),
-                "display": gaming_bundle.display()
-            },
-            "office_workspace": {
-                "name": office_bundle.name,
-                "description": office_bundle.description,
-                "total_price": float(office_bundle.get_price()),
-                "display": office_bundle.display()
-            },
-            "casual_outfit": {
-                "name": clothing_bundle.name,
-                "description": clothing_bundle.description,
-                "total_price": float(clothing_bundle.get_price()),
-                "display": clothing_bundle.display()
-            }
+        key: {
+            "name": bundle.name,
+            "description": bundle.description,
+            "total_price": float(bundle.get_price()),
+            "display": bundle.display()
         }
+        for key, bundle in bundles.items()
     }
 
 
-@app.post("/api/orders/")
-async def create_order(order_data: OrderCreate, db: Session = Depends(get_db)):
+@app.get("/api/bundles/")
+async def get_bundles(db: Session = Depends(get_read_db)):
+    return {"bundles": await coalesce("bundles", db, {}, build_bundles)}
+
+
+@app.get("/api/recommendations/")
+async def get_recommendations(
+        product_id: int = Query(...),
+        limit: int = Query(4, ge=1, le=20),
+        db: Session = Depends(get_read_db)
+):
+    """С этим товаром покупают: товары и доля совместных покупок"""
+    recommended = recommendation_index.recommend(product_id, limit)
+    if not recommended:
+        return []
+
+    products = {
+        product.id: product
+        for product in db.query(Product).options(joinedload(Product.category))
+        .filter(Product.id.in_([partner for partner, _ in recommended])).all()
+    }
+    return [
+        dict(serialize_product(products[partner]), score=score)
+        for partner, score in recommended
+        if partner in products
+    ]
+
+
+# Учётные записи
+def token_response(user: User) -> dict:
+    return {"access_token": create_access_token(user.id), "token_type": "bearer", "user_id": user.id}
+
+
+@app.post("/api/auth/register", status_code=201)
+async def register(data: RegisterRequest, db: Session = Depends(get_db)):
+    validate_password(data.password)
+    email = data.email.lower()
+    if db.query(User.id).filter(User.email == email).first():
+        raise HTTPException(status_code=409, detail="Пользователь с таким email уже существует")
+
+    user = User(email=email, name=data.name, password_hash=await hash_password(data.password))
+    db.add(user)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Пользователь с таким email уже существует")
+    return token_response(user)
+
+
+@app.post("/api/auth/login", dependencies=[Depends(limit_logins)])
+async def login(data: LoginRequest, db: Session = Depends(get_db)):
+    user = db.query(User).filter(User.email == data.email.lower()).first()
+    if not await verify_password(data.password, user.password_hash if user else None):
+        raise HTTPException(status_code=401, detail="Неверный email или пароль")
+    return token_response(user)
+
+
+@app.get("/api/auth/me")
+async def read_current_user(user_id: int = Depends(get_current_user_id), db: Session = Depends(get_read_db)):
+    user = db.get(User, user_id)
+    if not user:
+        # Демо-пользователь без учётной записи
+        return {"id": user_id, "email": None, "name": None}
+    return {"id": user.id, "email": user.email, "name": user.name}
+
+
+def place_order(db: Session, user_id: int, order_data: OrderCreate) -> dict:
+    """Записывает заказ в текущую транзакцию сессии; commit и rollback — за вызывающим кодом"""
+    for item in order_data.items:
+        quantity = item.get("quantity")
+        # Нулевое или отрицательное количество вернуло бы товар на склад и уменьшило сумму
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+            raise HTTPException(status_code=400, detail=f"Некорректное количество товара {item.get('product_id')}")
+
     order = Order(
-        user_id=order_data.user_id,
-        total_amount=Decimal('0.00')
+        user_id=user_id,
+        total_amount=Decimal('0.00'),
+        # Дата задаётся явно: она же ключ секции для позиций заказа
+        created_at=datetime.now()
     )
     db.add(order)
-    db.commit()
-    db.refresh(order)
+    db.flush()
 
-    total_amount = Decimal('0.00')
+    total_amount = Money.ZERO
+    summary_items = []
     for item in order_data.items:
         product = db.query(Product).filter(Product.id == item["product_id"]).first()
         if not product:
             raise HTTPException(status_code=404, detail=f"Product {item['product_id']} not found")
 
-        subtotal = product.price * item["quantity"]
+        subtotal = Money.of(product.price) * item["quantity"]
         total_amount += subtotal
 
         order_item = OrderItem(
             order_id=order.id,
             product_id=item["product_id"],
             quantity=item["quantity"],
-            subtotal=subtotal
+            subtotal=subtotal.to_decimal(),
+            order_created_at=order.created_at
         )
         db.add(order_item)
+        summary_items.append(summary_item(product.name, item["quantity"], subtotal.to_decimal()))
 
     # Добавляем стоимость декораторов
-    decorators_total = Decimal('0.00')
+    decorators_total = Money.ZERO
+    decorator_names = []
     if order_data.decorators:
         decorators = db.query(Decorator).filter(Decorator.name.in_(order_data.decorators)).all()
         for decorator in decorators:
-            decorators_total += decorator.cost
+            decorators_total += Money.of(decorator.cost)
+            decorator_names.append(decorator.name)
             order_decorator = OrderDecorator(
                 order_id=order.id,
-                decorator_id=decorator.id
+                decorator_id=decorator.id,
+                order_created_at=order.created_at
             )
             db.add(order_decorator)
 
     # Итоговая сумма
-    order.total_amount = total_amount + decorators_total
-    db.commit()
+    order.total_amount = (total_amount + decorators_total).to_decimal()
+    # Сводка для истории заказов пишется в той же транзакции, что и позиции
+    db.add(build_order_summary(order, summary_items, decorator_names))
+    emit(db, ORDER_CREATED, {
+        "order_id": order.id,
+        "user_id": order.user_id,
+        "total_amount": order.total_amount,
+        "items": [{"product_id": item["product_id"], "quantity": item["quantity"]} for item in order_data.items],
+        "decorators": decorator_names
+    }, aggregate_id=order.id)
+
+    # Остатки списываются последним шагом, чтобы строки товаров были заблокированы как можно меньше
+    try:
+        reserve_items(db, order.id, [(item["product_id"], item["quantity"]) for item in order_data.items])
+    except OutOfStock as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
     return {
         "order_id": order.id,
         "items_amount": float(total_amount),
         "decorators_amount": float(decorators_total),
-        "final_amount": float(order.total_amount),
+        "final_amount": float(total_amount + decorators_total),
         "description": f"Товары: {total_amount}₽, Услуги: {decorators_total}₽"
     }
 
 
-@app.post("/api/payment/process/")
-async def process_payment(payment_data: PaymentRequest):
+# В режиме групповой фиксации запросы не держат соединение: вместо слота пула их ограничивает очередь
+ORDER_DEPENDENCIES = [Depends(limit_orders)] + ([] if order_committer else [Depends(db_admission.admit)])
+
+
+@app.post("/api/orders/", dependencies=ORDER_DEPENDENCIES)
+async def create_order(
+        order_data: OrderCreate,
+        response: Response,
+        db: Session = Depends(get_db),
+        user_id: int = Depends(get_current_user_id)
+):
+    if order_committer:
+        try:
+            result = await order_committer.submit(lambda session: place_order(session, user_id, order_data))
+        except QueueFull:
+            raise HTTPException(status_code=503, detail="Сервис перегружен, повторите позже",
+                                headers=retry_after_header(SHED_RETRY_AFTER_SECONDS))
+    else:
+        def write():
+            try:
+                placed = place_order(db, user_id, order_data)
+            except HTTPException:
+                db.rollback()
+                raise
+            db.commit()
+            return placed
+
+        # Синхронная работа с БД — вне цикла событий: пока заказ пишется, остальные
+        # запросы принимаются, и лишние получают 503 от db_admission, а не ждут пула
+        result = await asyncio.to_thread(write)
+    stick_to_writer(response)
+    return result
+
+
+def load_order_for_update(db: Session, order_id: int, user_id: Optional[int] = None) -> Order:
+    """Заказ с блокировкой строки до конца транзакции.
+
+    Параллельная оплата того же заказа или отмена по истёкшему резерву
+    (inventory.expire_reservations) ждут, пока транзакция не завершится,
+    и затем видят уже новый статус.
+    """
+    order = db.query(Order).filter(Order.id == order_id).with_for_update().first()
+    # Чужой заказ неотличим от несуществующего
+    if not order or (user_id is not None and order.user_id != user_id):
+        raise HTTPException(status_code=404, detail=f"Заказ {order_id} не найден")
+    return order
+
+
+def apply_order_status(order: Order, new_status: str):
+    try:
+        transition(order, new_status)
+    except InvalidStatusTransition as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+# Обычная функция: FastAPI выполняет её в пуле потоков, поэтому работа с БД не занимает
+# цикл событий, а db_admission видит, сколько запросов к БД идёт одновременно
+@app.post("/api/payment/process/", dependencies=[Depends(limit_payments), Depends(db_admission.admit)])
+def process_payment(
+        payment_data: PaymentRequest,
+        response: Response,
+        db: Session = Depends(get_db),
+        user_id: int = Depends(get_current_user_id)
+):
     if payment_data.payment_provider == "yookassa":
         adapter = YooKassaPaymentAdapter()
     elif payment_data.payment_provider == "sber":
@@ -320,24 +986,49 @@ async def process_payment(payment_data: PaymentRequest):
     else:
         raise HTTPException(status_code=400, detail="Неподдерживаемый способ оплаты")
 
+    order = load_order_for_update(db, payment_data.order_id, user_id)
+    # Проверяем переход под блокировкой и до списания денег, чтобы не провести оплату дважды
+    if not can_transition(order.status, OrderStatus.PAID):
+        raise HTTPException(status_code=409, detail=str(InvalidStatusTransition(order.status, OrderStatus.PAID)))
+
+    # Списываем сумму заказа из БД, а не ту, что прислал клиент
+    amount = Money.of(order.total_amount)
+    if Money.from_rubles(payment_data.amount) != amount:
+        raise HTTPException(status_code=400, detail=f"Сумма оплаты не совпадает с суммой заказа ({amount})")
+
     order_data = {
         "order_id": payment_data.order_id,
-        "user_id": 1,
-        "amount": payment_data.amount
+        "user_id": user_id,
+        "amount": float(amount)
     }
 
-    result = adapter.process_payment(float(payment_data.amount), order_data)
+    result = adapter.process_payment(amount, order_data)
+
+    apply_order_status(order, status_after_payment(result))
+    if order.status == OrderStatus.PAID:
+        confirm_reservations(db, order.id)
+    db.commit()
+    stick_to_writer(response)
+
+    result["order_status"] = status_label(order.status)
     return result
 
 
 @app.post("/api/delivery/schedule/")
-async def schedule_delivery(delivery_data: DeliveryRequest):
-    if delivery_data.delivery_provider == "cdek":
-        adapter = CDEKDeliveryAdapter()
-    elif delivery_data.delivery_provider == "yandex":
-        adapter = YandexMarketDeliveryAdapter()
-    else:
+async def schedule_delivery(
+        delivery_data: DeliveryRequest,
+        response: Response,
+        db: Session = Depends(get_db),
+        user_id: int = Depends(get_current_user_id)
+):
+    adapter_class = DELIVERY_ADAPTERS.get(delivery_data.delivery_provider)
+    if adapter_class is None:
         raise HTTPException(status_code=400, detail="Неподдерживаемая служба доставки")
+    adapter = adapter_class()
+
+    order = load_order_for_update(db, delivery_data.order_id, user_id)
+    if not can_transition(order.status, OrderStatus.SHIPPING):
+        raise HTTPException(status_code=409, detail=str(InvalidStatusTransition(order.status, OrderStatus.SHIPPING)))
 
     order_data = {
         "order_id": delivery_data.order_id,
@@ -345,83 +1036,180 @@ async def schedule_delivery(delivery_data: DeliveryRequest):
     }
 
     result = adapter.schedule_delivery(order_data)
+
+    new_status = status_after_delivery(result)
+    if new_status:
+        apply_order_status(order, new_status)
+        # Дальше статус отправления опрашивает фоновая задача (tracking.py)
+        record_shipment(db, order, delivery_data.delivery_provider, result["tracking_id"])
+        emit(db, ORDER_DELIVERY_SCHEDULED, {
+            "order_id": order.id,
+            "user_id": order.user_id,
+            "tracking_id": result.get("tracking_id"),
+            "provider": result.get("provider"),
+            "estimated_delivery": result.get("estimated_delivery"),
+        }, aggregate_id=order.id)
+        db.commit()
+        stick_to_writer(response)
+
+    result["order_status"] = status_label(order.status)
     return result
 
 
+@app.get("/api/orders/events")
+async def order_events(request: Request, user_id: int = Depends(get_stream_user_id)):
+    """Поток обновлений заказов пользователя (text/event-stream)"""
+    last_event_id = request.headers.get("last-event-id")
+    subscription = push_hub.subscribe(user_id, int(last_event_id) if last_event_id and last_event_id.isdigit()
+                                      else None)
+    if subscription is None:
+        raise HTTPException(status_code=503, detail="Слишком много подключений, повторите позже",
+                            headers=retry_after_header(SHED_RETRY_AFTER_SECONDS))
+    return StreamingResponse(
+        event_stream(push_hub, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/api/user-orders/")
-async def get_user_orders(db: Session = Depends(get_db)):
-    """Получение заказов пользователя"""
+async def get_user_orders(
+        db: Session = Depends(get_read_db),
+        user_id: int = Depends(get_current_user_id),
+        status: Optional[str] = Query(None, description="код статуса, например shipping"),
+        days: Optional[int] = Query(None, ge=1, description="только заказы за последние дни")
+):
+    """Получение заказов пользователя из сводок (один диапазон по индексу)"""
     try:
-        user_id = 1  # Для демо
-        orders = db.query(Order).filter(Order.user_id == user_id).order_by(Order.created_at.desc()).all()
+        # Дата в условии соединения: на секционированной БД заказ ищется в секции своего месяца
+        query = db.query(OrderSummary, Order.status).join(
+            Order, (Order.id == OrderSummary.order_id) & (Order.created_at == OrderSummary.created_at)
+        ).filter(OrderSummary.user_id == user_id)
+        if days:
+            since = datetime.now() - timedelta(days=days)
+            query = query.filter(OrderSummary.created_at >= since, Order.created_at >= since)
+        if status:
+            # Фильтр идёт по индексу orders (user_id, status)
+            query = query.filter(Order.user_id == user_id, Order.status == status)
+        rows = query.order_by(OrderSummary.created_at.desc(), OrderSummary.order_id.desc()).all()
+
+        return [
+            {
+                "id": summary.order_id,
+                "order_date": summary.created_at.strftime("%Y-%m-%d") if summary.created_at else "Unknown",
+                "total_amount": float(summary.total_amount),
+                "status": status_label(order_status),
+                "status_code": order_status,
+                "items": summary.items,
+                "decorators": summary.decorators
+            }
+            for summary, order_status in rows
+        ]
 
-        orders_data = []
-        for order in orders:
-            order_items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
-            items_data = []
-            for item in order_items:
-                product = db.query(Product).filter(Product.id == item.product_id).first()
-                items_data.append({
-                    "name": product.name if product else "Unknown Product",
-                    "quantity": item.quantity,
-                    "price": float(item.subtotal / item.quantity) if item.quantity > 0 else 0
-                })
+    except Exception as e:
+        print(f"Error getting user orders: {e}")
+        return []
 
-            order_decorators = db.query(OrderDecorator).filter(OrderDecorator.order_id == order.id).all()
-            decorators_data = []
-            for decorator_rel in order_decorators:
-                decorator = db.query(Decorator).filter(Decorator.id == decorator_rel.decorator_id).first()
-                if decorator:
-                    decorators_data.append(decorator.name)
 
-            orders_data.append({
-                "id": order.id,
-                "order_date": order.created_at.strftime("%Y-%m-%d") if order.created_at else "Unknown",
-                "total_amount": float(order.total_amount),
-                "status": get_order_status(order),
-                "items": items_data,
-                "decorators": decorators_data
-            })
+# Аналитика (читает почасовые сводные таблицы)
+@app.get("/api/analytics/revenue-by-category")
+async def get_revenue_by_category(
+        db: Session = Depends(get_read_db),
+        date_from: Optional[date] = Query(None),
+        date_to: Optional[date] = Query(None)
+):
+    return analytics.revenue_by_category(db, date_from, date_to)
 
-        return orders_data
 
-    except Exception as e:
-        print(f"Error getting user orders: {e}")
-        return []
+@app.get("/api/analytics/top-products")
+async def get_top_products(
+        db: Session = Depends(get_read_db),
+        date_from: Optional[date] = Query(None),
+        date_to: Optional[date] = Query(None),
+        limit: int = Query(10, ge=1, le=1000),
+        by: str = Query("revenue", pattern="^(revenue|units)$")
+):
+    return analytics.top_products(db, date_from, date_to, limit, by)
 
 
-def get_order_status(order):
-    """Определяет статус заказа на основе даты создания"""
-    from datetime import datetime, timedelta
+@app.get("/api/analytics/decorator-attach-rates")
+async def get_decorator_attach_rates(
+        db: Session = Depends(get_read_db),
+        date_from: Optional[date] = Query(None),
+        date_to: Optional[date] = Query(None)
+):
+    return analytics.decorator_attach_rates(db, date_from, date_to)
+
+
+# Выгрузка заказов для финансов
+@app.get("/api/export/orders")
+async def export_orders(
+        db: Session = Depends(get_read_db),
+        format: str = Query("csv", description="csv, parquet или arrow (нужен pyarrow)"),
+        date_from: Optional[date] = Query(None),
+        date_to: Optional[date] = Query(None)
+):
+    if format not in export.available_formats():
+        raise HTTPException(status_code=400, detail=f"Формат {format} недоступен")
+
+    return StreamingResponse(
+        export.stream_export(db, format, date_from, date_to),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="orders.{format}"'}
+    )
 
-    if not order.created_at:
-        return "Неизвестно"
 
+# Импорт каталога поставщика
+def invalidate_imported_products(changes):
+    """Сбрасывает фрагменты только изменённых импортом товаров"""
+    # Импорт пишет в обход ORM, события SQLAlchemy не срабатывают
+    catalog_flight.invalidate()
+    for product_id, category_id, old_category_id in changes:
+        catalog_cache.invalidate_product(product_id, category_id)
+        if old_category_id is not None and old_category_id != category_id:
+            catalog_cache.invalidate(("category", old_category_id))
+
+
+@app.post("/api/catalog/import", dependencies=[Depends(require_admin)])
+async def import_catalog(
+        file: UploadFile = File(...),
+        format: Optional[str] = Query(None, pattern="^(csv|ndjson)$",
+                                      description="по умолчанию по расширению файла"),
+        batch_size: int = Query(catalog_import.IMPORT_BATCH_SIZE, ge=1, le=10000),
+        db: Session = Depends(get_db)
+):
+    file_format = format or catalog_import.detect_format(file.filename)
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
     try:
-        now = datetime.now()
-        order_date = order.created_at
-
-        if order_date.tzinfo is not None:
-            order_date = order_date.replace(tzinfo=None)
-        if now.tzinfo is not None:
-            now = now.replace(tzinfo=None)
-
-        order_age = now - order_date
-
-        if order_age > timedelta(days=7):
-            return "Доставлен"
-        elif order_age > timedelta(days=2):
-            return "Доставляется"
-        else:
-            return "В обработке"
-    except Exception as e:
-        print(f"Error calculating order status: {e}")
-        return "Неизвестно"
+        # Разбор и запись в БД синхронные, поэтому выполняются вне event loop
+        return await asyncio.to_thread(
+            catalog_import.import_catalog, db, stream, file_format, batch_size,
+            invalidate_imported_products
+        )
+    except UnicodeDecodeError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Файл должен быть в кодировке UTF-8")
+    finally:
+        stream.detach()
 
 
 # Отладочные endpoints
+@app.get("/api/debug/profiles/{profile_id}")
+async def get_profile(
+        profile_id: str,
+        request: Request,
+        format: str = Query("json", pattern="^(json|collapsed)$", description="collapsed — для flamegraph")
+):
+    if not token_matches(PROFILING_TOKEN, request.headers.get(PROFILE_HEADER)):
+        raise HTTPException(status_code=404, detail="Not Found")
+    content = load_profile(PROFILE_DIR, profile_id, format)
+    if content is None:
+        raise HTTPException(status_code=404, detail=f"Профиль {profile_id} не найден")
+    return Response(content, media_type="application/json" if format == "json" else "text/plain; charset=utf-8")
+
+
 @app.get("/api/debug/products")
-async def debug_products(db: Session = Depends(get_db)):
+async def debug_products(db: Session = Depends(get_read_db)):
     products = db.query(Product).all()
     return {
         "total_products": len(products),
@@ -438,7 +1226,7 @@ async def debug_products(db: Session = Depends(get_db)):
 
 
 @app.get("/api/debug/categories")
-async def debug_categories(db: Session = Depends(get_db)):
+async def debug_categories(db: Session = Depends(get_read_db)):
     categories = db.query(Category).all()
     return {
         "total_categories": len(categories),
@@ -447,14 +1235,19 @@ async def debug_categories(db: Session = Depends(get_db)):
 
 
 @app.get("/api/debug/orders")
-async def debug_orders(db: Session = Depends(get_db)):
-    """Отладка заказов"""
+async def debug_orders(
+        db: Session = Depends(get_read_db),
+        days: int = Query(HOT_ORDER_DAYS, ge=1, description="за сколько последних дней")
+):
+    """Отладка заказов (только свежие: старые секции не читаются)"""
     try:
-        orders = db.query(Order).all()
+        orders = db.query(Order).filter(Order.created_at >= datetime.now() - timedelta(days=days)).all()
         orders_data = []
 
         for order in orders:
-            order_items = db.query(OrderItem).filter(OrderItem.order_id == order.id).all()
+            order_items = db.query(OrderItem).filter(
+                OrderItem.order_id == order.id, OrderItem.order_created_at == order.created_at
+            ).all()
             items_data = []
 
             for item in order_items:
@@ -484,4 +1277,7 @@ async def debug_orders(db: Session = Depends(get_db)):
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1")
\ No newline at end of file
+    # Воркеры, цикл событий и таймауты настраиваются в serve.py (python serve.py --help)
+    import serve
+
+    serve.main()
\ No newline at end of file
@@ -0,0 +1,426 @@
+# manage.py
+"""Служебные команды: управление схемой БД, начальные данные, замеры производительности"""
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect, text
+
+from database import Base, engine
+
+IMPORT_PROBE = (
+    "import time; started = time.perf_counter(); import main; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def backfill_order_status(connection):
+    """Статусы старых заказов по прежнему правилу: возраст заказа"""
+    now = datetime.now()
+    connection.execute(text(
+        "UPDATE orders SET status = CASE "
+        "WHEN created_at < :week_ago THEN 'delivered' "
+        "WHEN created_at < :two_days_ago THEN 'shipping' "
+        "ELSE 'processing' END"
+    ), {"week_ago": now - timedelta(days=7), "two_days_ago": now - timedelta(days=2)})
+
+
+def backfill_order_created_at(table: str):
+    """Копия даты заказа в его позициях и услугах"""
+
+    def backfill(connection):
+        connection.execute(text(
+            f"UPDATE {table} SET order_created_at = "
+            f"(SELECT created_at FROM orders WHERE orders.id = {table}.order_id)"
+        ))
+
+    return backfill
+
+
+# Заполнение данных для колонок, добавленных в уже существующие таблицы
+COLUMN_BACKFILLS = {
+    ("orders", "status"): backfill_order_status,
+    ("order_items", "order_created_at"): backfill_order_created_at("order_items"),
+    ("order_decorators", "order_created_at"): backfill_order_created_at("order_decorators"),
+}
+
+
+def add_missing_columns(connection):
+    """Добавляет в существующие таблицы колонки и индексы, появившиеся в моделях"""
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            if column.server_default is not None:
+                default = column.server_default.arg
+                if isinstance(default, str):
+                    default = "'" + default.replace("'", "''") + "'"
+                else:
+                    default = str(default.compile(dialect=connection.dialect))
+                ddl += f" DEFAULT {default}"
+            if not column.nullable:
+                ddl += " NOT NULL"
+            connection.execute(text(ddl))
+            print(f"Добавлена колонка {table.name}.{column.name}")
+
+            backfill = COLUMN_BACKFILLS.get((table.name, column.name))
+            if backfill:
+                backfill(connection)
+
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def ensure_demo_user(connection):
+    """Учётная запись демо-пользователя 1: без неё первый зарегистрированный получил бы его заказы"""
+    from auth import DEMO_USER_ID, UNUSABLE_PASSWORD
+
+    exists = connection.execute(text("SELECT 1 FROM users WHERE id = :id"), {"id": DEMO_USER_ID}).first()
+    if exists:
+        return
+    connection.execute(
+        text("INSERT INTO users (id, email, name, password_hash) VALUES (:id, :email, :name, :password_hash)"),
+        {"id": DEMO_USER_ID, "email": "demo@example.com", "name": "Демо-пользователь",
+         "password_hash": UNUSABLE_PASSWORD}
+    )
+    if connection.dialect.name == "postgresql":
+        connection.execute(text(
+            "SELECT setval(pg_get_serial_sequence('users', 'id'), (SELECT MAX(id) FROM users))"
+        ))
+
+
+def migrate(bind=engine):
+    """Создаёт недостающие таблицы, колонки и индексы"""
+    with bind.begin() as connection:
+        Base.metadata.create_all(bind=connection)
+        add_missing_columns(connection)
+        ensure_demo_user(connection)
+    print("Схема БД актуальна")
+
+
+def drop():
+    Base.metadata.drop_all(bind=engine)
+    print("Таблицы удалены")
+
+
+def init_data():
+    from init_data import init_database
+
+    init_database()
+
+
+def partition_orders(months_ahead: int):
+    from partitions import convert_to_partitioned
+
+    migrate()
+    with engine.begin() as connection:
+        created = convert_to_partitioned(connection, months_ahead)
+    print(f"Заказы секционированы по месяцам, создано секций: {created}")
+
+
+def ensure_partitions(months_ahead: int):
+    from partitions import ensure_partitions as create_partitions
+
+    with engine.begin() as connection:
+        created = create_partitions(connection, months_ahead)
+    print(f"Создано секций: {created}")
+
+
+def archive_orders(keep_months: int, directory: str, file_format: str):
+    from database import SessionLocal
+    from partitions import archive_partitions
+
+    db = SessionLocal()
+    try:
+        archived = archive_partitions(db, keep_months, directory, file_format)
+    finally:
+        db.close()
+    print(f"Архивировано месяцев: {len(archived)}, заказов: {sum(orders for _, _, orders, _ in archived)}, "
+          f"позиций: {sum(rows for _, _, _, rows in archived)}")
+
+
+def rebuild_order_summaries(batch_size: int, only_missing: bool):
+    from database import SessionLocal
+    from order_summaries import rebuild_order_summaries as rebuild
+
+    db = SessionLocal()
+    try:
+        rebuilt = rebuild(db, batch_size=batch_size, only_missing=only_missing)
+    finally:
+        db.close()
+    print(f"Пересобрано сводок заказов: {rebuilt}")
+
+
+def refresh_analytics(safety_seconds: int):
+    from analytics import refresh_rollups
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        processed = refresh_rollups(db, safety_seconds=safety_seconds)
+    finally:
+        db.close()
+    print(f"Аналитика: обработано заказов {processed}")
+
+
+def startup_time(runs: int):
+    """Замер холодного старта: импорт приложения в чистом процессе и прогрев воркера"""
+    env = dict(os.environ, WARMUP_ON_STARTUP="0")
+    import_times = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE],
+            capture_output=True, text=True, check=True, env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout
+        import_times.append(float(output.strip().splitlines()[-1]))
+
+    print(f"Импорт main: медиана {statistics.median(import_times) * 1000:.1f} мс, "
+          f"мин {min(import_times) * 1000:.1f} мс ({runs} запусков)")
+
+    from main import warm_up
+
+    warm_up()
+
+
+def _price_lines(count: int, seed: int = 42):
+    """Позиции как из БД: (цена Decimal, количество, стоимость услуг)"""
+    from decimal import Decimal
+
+    rng = random.Random(seed)
+    services = [Decimal("199.00"), Decimal("499.00"), Decimal("299.00"), Decimal("249.00"), Decimal("999.00")]
+    return [
+        (Decimal(rng.randrange(100, 20000000)) / 100, rng.randint(1, 5), rng.sample(services, rng.randint(0, 3)))
+        for _ in range(count)
+    ]
+
+
+def _price_batch_decimal(lines):
+    """Прежний путь: Decimal в расчётах, float в ответе, int(amount * 100) в ЮKassa"""
+    kopecks, responses = [], []
+    for price, quantity, services in lines:
+        total = price * quantity
+        for cost in services:
+            total += cost
+        amount = float(total)
+        responses.append(amount)
+        kopecks.append(int(amount * 100))
+    return kopecks, responses
+
+
+def _price_batch_money(lines):
+    """Новый путь: Money в расчётах, float только в ответе, копейки в ЮKassa как есть"""
+    from money import Money
+
+    service_prices = {}
+    kopecks, responses = [], []
+    for price, quantity, services in lines:
+        total = Money.of(price) * quantity
+        for cost in services:
+            money = service_prices.get(cost)
+            if money is None:
+                money = service_prices[cost] = Money.of(cost)
+            total += money
+        responses.append(float(total))
+        kopecks.append(total.kopecks)
+    return kopecks, responses
+
+
+def money_benchmark(lines_count: int, runs: int):
+    """Сравнение расчёта пачки позиций: смесь Decimal/float против Money в копейках"""
+    from money import Money
+
+    lines = _price_lines(lines_count)
+    # Цены, уже хранящиеся в копейках: без перевода из Decimal на входе
+    money_lines = [(Money.from_rubles(price), quantity, [Money.from_rubles(cost) for cost in services])
+                   for price, quantity, services in lines]
+    variants = (
+        ("Decimal/float", _price_batch_decimal, lines),
+        ("Money", _price_batch_money, lines),
+        ("Money без перевода из Decimal", _price_batch_money, money_lines),
+    )
+    results = {}
+    for name, price_batch, batch in variants:
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            kopecks, _ = price_batch(batch)
+            timings.append(time.perf_counter() - started)
+        results[name] = kopecks
+        print(f"{name}: медиана {statistics.median(timings) * 1000:.1f} мс на {lines_count} позиций "
+              f"({statistics.median(timings) / lines_count * 1e6:.2f} мкс на позицию)")
+
+    # Копейки, которые прежний путь терял при int(amount * 100)
+    lost = sum(1 for old, new in zip(results["Decimal/float"], results["Money"]) if old != new)
+    print(f"Сумм с ошибкой округления в прежнем пути: {lost} из {lines_count}")
+
+
+def _benchmark_engine(database_url: str, directory: str, commit_delay_ms: float):
+    """Движок для замера записи: по умолчанию файл SQLite с fsync на каждый commit"""
+    from sqlalchemy import event
+
+    from database import make_engine
+
+    if database_url:
+        bind = make_engine(database_url, pool_size=20, max_overflow=0)
+    else:
+        bind = make_engine(f"sqlite:///{os.path.join(directory, 'orders.db')}")
+
+        @event.listens_for(bind, "connect")
+        def synchronous_full(dbapi_connection, connection_record):
+            # Как PostgreSQL с synchronous_commit=on: фиксация ждёт сброса журнала на диск
+            dbapi_connection.execute("PRAGMA synchronous=FULL")
+
+    if commit_delay_ms:
+        # Задержка фиксации медленного диска или сетевой БД, если локальный fsync почти бесплатен
+        @event.listens_for(bind, "commit")
+        def slow_commit(connection):
+            time.sleep(commit_delay_ms / 1000)
+
+    return bind
+
+
+def order_commit_benchmark(orders: int, concurrency: int, batch_size: int, delay_ms: float,
+                           database_url: str, commit_delay_ms: float):
+    """Заказов в секунду: своя транзакция на каждый заказ против групповой фиксации"""
+    import asyncio
+    import tempfile
+
+    from sqlalchemy.orm import sessionmaker
+
+    from database import Category, Product
+    from group_commit import GroupCommitter
+    from main import OrderCreate, place_order
+
+    with tempfile.TemporaryDirectory() as directory:
+        bind = _benchmark_engine(database_url, directory, commit_delay_ms)
+        migrate(bind)
+        SessionFactory = sessionmaker(autocommit=False, autoflush=False, bind=bind)
+        with SessionFactory() as db:
+            product_ids = [row[0] for row in db.query(Product.id).filter(Product.stock.is_(None)).limit(100)]
+            if not product_ids:
+                category = Category(name="Бенчмарк")
+                db.add(category)
+                db.flush()
+                products = [Product(category_id=category.id, name=f"Товар {i}", price=100 + i) for i in range(100)]
+                db.add_all(products)
+                db.commit()
+                product_ids = [product.id for product in products]
+
+        rng = random.Random(42)
+        payloads = [
+            OrderCreate(user_id=1, items=[
+                {"product_id": product_id, "quantity": rng.randint(1, 3)}
+                for product_id in rng.sample(product_ids, rng.randint(1, 3))
+            ])
+            for _ in range(orders)
+        ]
+
+        def write_alone(payload):
+            with SessionFactory() as db:
+                place_order(db, payload.user_id, payload)
+                db.commit()
+
+        async def run(submit):
+            # Не больше concurrency заказов одновременно, как у concurrency клиентов
+            slots = asyncio.Semaphore(concurrency)
+
+            async def one(payload):
+                async with slots:
+                    await submit(payload)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one(payload) for payload in payloads))
+            return time.perf_counter() - started
+
+        # Прежний путь щедрее, чем в приложении: заказы пишутся параллельно в потоках, а не по одному в цикле событий
+        elapsed = asyncio.run(run(lambda payload: asyncio.to_thread(write_alone, payload)))
+        print(f"Транзакция на заказ: {orders / elapsed:.0f} заказов/с ({orders} заказов, {concurrency} клиентов)")
+
+        committer = GroupCommitter(SessionFactory, max_batch=batch_size, max_delay=delay_ms / 1000)
+        elapsed = asyncio.run(run(
+            lambda payload: committer.submit(lambda db: place_order(db, payload.user_id, payload))
+        ))
+        print(f"Групповая фиксация: {orders / elapsed:.0f} заказов/с, пакетов {committer.batches}, "
+              f"в среднем {committer.committed / max(committer.batches, 1):.1f} заказов в пакете")
+        bind.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Управление E-Commerce приложением")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("migrate", help="создать схему БД")
+    commands.add_parser("drop", help="удалить все таблицы")
+    commands.add_parser("init-data", help="заполнить БД тестовыми данными")
+    summaries = commands.add_parser("rebuild-order-summaries", help="заполнить сводки для истории заказов")
+    summaries.add_argument("--batch-size", type=int, default=5000)
+    summaries.add_argument("--only-missing", action="store_true", help="только заказы без сводки")
+    rollups = commands.add_parser("refresh-analytics", help="досчитать почасовые агрегаты продаж")
+    rollups.add_argument("--safety-seconds", type=int, default=60,
+                         help="не трогать заказы моложе этого окна")
+    startup = commands.add_parser("startup-time", help="замерить время холодного старта")
+    startup.add_argument("--runs", type=int, default=5)
+    group = commands.add_parser("order-commit-benchmark",
+                                help="сравнить запись заказов по одному и групповой фиксацией")
+    group.add_argument("--orders", type=int, default=2000)
+    group.add_argument("--concurrency", type=int, default=200)
+    group.add_argument("--batch-size", type=int, default=64)
+    group.add_argument("--delay-ms", type=float, default=5)
+    group.add_argument("--database-url", default="",
+                       help="БД для замера (по умолчанию временный файл SQLite); заказы остаются в ней")
+    group.add_argument("--commit-delay-ms", type=float, default=0,
+                       help="добавить задержку к каждой фиксации (медленный fsync)")
+    partition = commands.add_parser("partition-orders", help="секционировать заказы по месяцам (PostgreSQL)")
+    partition.add_argument("--months-ahead", type=int, default=2)
+    ensure = commands.add_parser("ensure-partitions", help="создать секции заказов на следующие месяцы")
+    ensure.add_argument("--months-ahead", type=int, default=2)
+    archive = commands.add_parser("archive-orders", help="выгрузить старые месяцы заказов в файлы и удалить их")
+    archive.add_argument("--keep-months", type=int, default=12, help="сколько последних месяцев оставить в БД")
+    archive.add_argument("--directory", default="archive")
+    archive.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    money = commands.add_parser("money-benchmark", help="сравнить расчёт цен в Money и Decimal/float")
+    money.add_argument("--lines", type=int, default=100000)
+    money.add_argument("--runs", type=int, default=5)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        migrate()
+    elif args.command == "drop":
+        drop()
+    elif args.command == "init-data":
+        init_data()
+    elif args.command == "rebuild-order-summaries":
+        rebuild_order_summaries(args.batch_size, args.only_missing)
+    elif args.command == "refresh-analytics":
+        refresh_analytics(args.safety_seconds)
+    elif args.command == "startup-time":
+        startup_time(args.runs)
+    elif args.command == "order-commit-benchmark":
+        order_commit_benchmark(args.orders, args.concurrency, args.batch_size, args.delay_ms, args.database_url,
+                               args.commit_delay_ms)
+    elif args.command == "partition-orders":
+        partition_orders(args.months_ahead)
+    elif args.command == "ensure-partitions":
+        ensure_partitions(args.months_ahead)
+    elif args.command == "archive-orders":
+        archive_orders(args.keep_months, args.directory, args.format)
+    elif args.command == "money-benchmark":
+        money_benchmark(args.lines, args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# money.py
+"""Денежная сумма в копейках: целое число вместо смеси Decimal и float.
+
+Сложение и умножение на количество — операции над int, без контекста
+Decimal и без ошибок округления float (int(19.99 * 100) == 1998).
+В Decimal (для БД) и float (для JSON) сумма переводится только на границах.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Union
+
+_CENT = Decimal("0.01")
+
+
+class Money:
+    __slots__ = ("kopecks",)
+
+    def __init__(self, kopecks: int):
+        object.__setattr__(self, "kopecks", int(kopecks))
+
+    @classmethod
+    def from_rubles(cls, value: Union[Decimal, str, int, float]) -> "Money":
+        """Из рублей; float переводится через str, чтобы 19.99 стало 1999 копейками"""
+        if value.__class__ is not Decimal:
+            value = Decimal(str(value) if isinstance(value, float) else value)
+        return _make(int((value * 100).to_integral_value(ROUND_HALF_UP)))
+
+    @classmethod
+    def of(cls, value) -> "Money":
+        """Money как есть, остальное — как сумма в рублях"""
+        return value if value.__class__ is Money else cls.from_rubles(value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Money неизменяем")
+
+    def __delattr__(self, name):
+        raise AttributeError("Money неизменяем")
+
+    # Арифметика
+
+    def __add__(self, other):
+        if other.__class__ is Money:
+            return _make(self.kopecks + other.kopecks)
+        if other == 0:
+            return self
+        return NotImplemented
+
+    # sum() начинает с 0
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if other.__class__ is Money:
+            return _make(self.kopecks - other.kopecks)
+        return NotImplemented
+
+    def __mul__(self, quantity):
+        # Только на целое количество: bool и float не подходят
+        if quantity.__class__ is int:
+            return _make(self.kopecks * quantity)
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return _make(-self.kopecks)
+
+    # Сравнение
+
+    def __eq__(self, other):
+        return other.__class__ is Money and self.kopecks == other.kopecks
+
+    def __lt__(self, other):
+        return self.kopecks < other.kopecks
+
+    def __le__(self, other):
+        return self.kopecks <= other.kopecks
+
+    def __gt__(self, other):
+        return self.kopecks > other.kopecks
+
+    def __ge__(self, other):
+        return self.kopecks >= other.kopecks
+
+    def __hash__(self):
+        return hash(self.kopecks)
+
+    def __bool__(self):
+        return self.kopecks != 0
+
+    # Преобразования на границах
+
+    def to_decimal(self) -> Decimal:
+        return (Decimal(self.kopecks) / 100).quantize(_CENT)
+
+    def __float__(self):
+        return self.kopecks / 100
+
+    def __str__(self):
+        sign = "-" if self.kopecks < 0 else ""
+        rubles, kopecks = divmod(abs(self.kopecks), 100)
+        return f"{sign}{rubles}.{kopecks:02d}"
+
+    def __repr__(self):
+        return f"Money('{self}')"
+
+    def __reduce__(self):
+        return Money, (self.kopecks,)
+
+
+_new = object.__new__
+_set_kopecks = Money.kopecks.__set__
+
+
+def _make(kopecks: int) -> Money:
+    """Конструктор для результатов арифметики: без проверок и __init__"""
+    money = _new(Money)
+    _set_kopecks(money, kopecks)
+    return money
+
+
+Money.ZERO = Money(0)
@@ -0,0 +1,85 @@
+# order_status.py
+"""Жизненный цикл заказа: статус хранится в БД и меняется только по допустимым переходам"""
+from typing import Any, Dict, Optional
+
+from database import Order
+
+
+class OrderStatus:
+    PROCESSING = "processing"
+    PAYMENT_FAILED = "payment_failed"
+    PAID = "paid"
+    SHIPPING = "shipping"
+    DELIVERED = "delivered"
+    CANCELLED = "cancelled"
+
+
+STATUS_LABELS = {
+    OrderStatus.PROCESSING: "В обработке",
+    OrderStatus.PAYMENT_FAILED: "Ошибка оплаты",
+    OrderStatus.PAID: "Оплачен",
+    OrderStatus.SHIPPING: "Доставляется",
+    OrderStatus.DELIVERED: "Доставлен",
+    OrderStatus.CANCELLED: "Отменён",
+}
+
+TRANSITIONS = {
+    OrderStatus.PROCESSING: {OrderStatus.PAID, OrderStatus.PAYMENT_FAILED, OrderStatus.CANCELLED},
+    OrderStatus.PAYMENT_FAILED: {OrderStatus.PAID, OrderStatus.PAYMENT_FAILED, OrderStatus.CANCELLED},
+    OrderStatus.PAID: {OrderStatus.SHIPPING, OrderStatus.CANCELLED},
+    OrderStatus.SHIPPING: {OrderStatus.DELIVERED},
+    OrderStatus.DELIVERED: set(),
+    OrderStatus.CANCELLED: set(),
+}
+
+# Ответы адаптеров, означающие успешную операцию
+PAYMENT_SUCCESS_STATES = {"succeeded", "completed"}
+DELIVERY_SCHEDULED_STATES = {"registered", "scheduled"}
+# Статусы отправления, после которых служба его больше не меняет
+TRACKING_FINAL_STATES = {"delivered", "returned"}
+
+
+class InvalidStatusTransition(ValueError):
+    def __init__(self, current: str, requested: str):
+        super().__init__(
+            f"Недопустимый переход статуса: {STATUS_LABELS.get(current, current)} → "
+            f"{STATUS_LABELS.get(requested, requested)}"
+        )
+        self.current = current
+        self.requested = requested
+
+
+def status_label(status: str) -> str:
+    return STATUS_LABELS.get(status, "Неизвестно")
+
+
+def can_transition(current: str, requested: str) -> bool:
+    return requested in TRANSITIONS.get(current, set())
+
+
+def transition(order: Order, requested: str) -> Order:
+    """Меняет статус заказа; фиксация транзакции остаётся за вызывающим кодом"""
+    if not can_transition(order.status, requested):
+        raise InvalidStatusTransition(order.status, requested)
+    order.status = requested
+    return order
+
+
+def status_after_payment(result: Dict[str, Any]) -> str:
+    if result.get("status") in PAYMENT_SUCCESS_STATES:
+        return OrderStatus.PAID
+    return OrderStatus.PAYMENT_FAILED
+
+
+def status_after_delivery(result: Dict[str, Any]) -> Optional[str]:
+    """Статус после оформления доставки или None, если служба её не приняла"""
+    if result.get("status") in DELIVERY_SCHEDULED_STATES:
+        return OrderStatus.SHIPPING
+    return None
+
+
+def status_after_tracking(carrier_status: Optional[str]) -> Optional[str]:
+    """Статус заказа по статусу отправления или None, если заказ не меняется"""
+    if carrier_status == "delivered":
+        return OrderStatus.DELIVERED
+    return None
@@ -0,0 +1,87 @@
+# order_summaries.py
+"""Проекция заказов для истории: пишется при оформлении, пересобирается командой manage.py"""
+from collections import defaultdict
+from typing import Dict, List
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from database import Order, OrderItem, OrderDecorator, OrderSummary, Product, Decorator
+
+
+def summary_item(name: str, quantity: int, subtotal) -> dict:
+    return {
+        "name": name,
+        "quantity": quantity,
+        "price": float(subtotal / quantity) if quantity > 0 else 0
+    }
+
+
+def build_order_summary(order: Order, items: List[dict], decorator_names: List[str]) -> OrderSummary:
+    return OrderSummary(
+        order_id=order.id,
+        user_id=order.user_id,
+        created_at=order.created_at,
+        total_amount=order.total_amount,
+        items=items,
+        decorators=decorator_names
+    )
+
+
+def rebuild_order_summaries(db: Session, batch_size: int = 5000, only_missing: bool = False,
+                            after_id: int = 0) -> int:
+    """Заполняет сводки для существующих заказов с id больше after_id пачками по диапазону id.
+
+    На каждую пачку приходится три запроса на чтение и одна массовая вставка.
+    """
+    rebuilt = 0
+    last_id = after_id
+    while True:
+        query = select(Order.id, Order.user_id, Order.created_at, Order.total_amount).where(
+            Order.id > last_id
+        ).order_by(Order.id).limit(batch_size)
+        if only_missing:
+            query = query.where(~select(OrderSummary.order_id).where(
+                OrderSummary.order_id == Order.id
+            ).exists())
+        orders = db.execute(query).all()
+        if not orders:
+            break
+
+        order_ids = [order.id for order in orders]
+        last_id = order_ids[-1]
+
+        items: Dict[int, List[dict]] = defaultdict(list)
+        for row in db.execute(
+            select(OrderItem.order_id, Product.name, OrderItem.quantity, OrderItem.subtotal)
+            .outerjoin(Product, Product.id == OrderItem.product_id)
+            .where(OrderItem.order_id.in_(order_ids))
+            .order_by(OrderItem.id)
+        ):
+            items[row.order_id].append(summary_item(row.name or "Unknown Product", row.quantity, row.subtotal))
+
+        decorators: Dict[int, List[str]] = defaultdict(list)
+        for row in db.execute(
+            select(OrderDecorator.order_id, Decorator.name)
+            .join(Decorator, Decorator.id == OrderDecorator.decorator_id)
+            .where(OrderDecorator.order_id.in_(order_ids))
+            .order_by(OrderDecorator.id)
+        ):
+            decorators[row.order_id].append(row.name)
+
+        db.execute(delete(OrderSummary).where(OrderSummary.order_id.in_(order_ids)))
+        db.execute(insert(OrderSummary), [
+            {
+                "order_id": order.id,
+                "user_id": order.user_id,
+                "created_at": order.created_at,
+                "total_amount": order.total_amount,
+                "items": items.get(order.id, []),
+                "decorators": decorators.get(order.id, [])
+            }
+            for order in orders
+        ])
+        db.commit()
+        rebuilt += len(orders)
+
+    return rebuilt
@@ -0,0 +1,270 @@
+# outbox.py
+"""Транзакционный outbox: события о заказах и каталоге.
+
+Событие записывается в outbox_events той же транзакцией, что и само
+изменение, поэтому оно не теряется при сбое и не появляется для
+откатившейся записи. Фоновый OutboxRelay пачками забирает
+неопубликованные события и передаёт их брокеру: по умолчанию это
+EventBus внутри процесса, но подойдёт любой объект с методом publish(events).
+Доставка «как минимум один раз»: подписчики должны быть идемпотентны.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Set
+
+from sqlalchemy import delete, event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from database import Category, Decorator, Order, OutboxEvent, Product
+from order_status import status_label
+
+ORDER_CREATED = "order.created"
+PRODUCT_CREATED = "product.created"
+PRODUCT_UPDATED = "product.updated"
+ORDER_STATUS_CHANGED = "order.status_changed"
+ORDER_DELIVERY_SCHEDULED = "order.delivery_scheduled"
+# Категории, услуги, новые и удалённые через ORM товары: для сброса кэшей каталога
+CATALOG_CHANGED = "catalog.changed"
+
+# Поля товара, изменение которых публикуется
+PRODUCT_EVENT_FIELDS = ("price", "name", "description", "category_id")
+RELAY_BATCH_SIZE = 500
+RETENTION_HOURS = 24
+
+
+def _json_value(value):
+    return str(value) if isinstance(value, Decimal) else value
+
+
+def emit(db: Session, topic: str, payload: dict, aggregate_id: Optional[int] = None) -> OutboxEvent:
+    """Добавляет событие в текущую транзакцию; фиксирует его вызывающий код"""
+    outbox_event = OutboxEvent(
+        topic=topic,
+        aggregate_id=aggregate_id,
+        payload={key: _json_value(value) for key, value in payload.items()}
+    )
+    db.add(outbox_event)
+    return outbox_event
+
+
+def watch_product_changes():
+    """Пишет product.updated для товаров, изменённых через ORM, в ту же транзакцию"""
+
+    def before_flush(session, flush_context, instances):
+        for target in list(session.dirty):
+            if not isinstance(target, Product):
+                continue
+            state = inspect(target)
+            changes = {}
+            for field in PRODUCT_EVENT_FIELDS:
+                history = state.attrs[field].history
+                if history.has_changes():
+                    old = history.deleted[0] if history.deleted else None
+                    changes[field] = [_json_value(old), _json_value(getattr(target, field))]
+            if changes:
+                emit(session, PRODUCT_UPDATED,
+                     {"product_id": target.id, "category_id": target.category_id, "changes": changes},
+                     aggregate_id=target.id)
+
+    if not event.contains(Session, "before_flush", before_flush):
+        event.listen(Session, "before_flush", before_flush)
+
+
+def watch_catalog_structure_changes():
+    """Пишет catalog.changed для категорий, услуг и добавленных или удалённых товаров.
+
+    У новых объектов id появляется только при flush, поэтому их события
+    пишутся в after_flush; строка outbox попадает в следующий flush той же
+    транзакции (commit сбрасывает сессию, пока в ней есть изменения).
+    """
+    models = {Category: "category", Decorator: "decorator", Product: "product"}
+
+    def emit_change(session, target):
+        model = models[type(target)]
+        emit(session, CATALOG_CHANGED, {
+            "model": model,
+            "id": target.id,
+            "product_id": target.id if model == "product" else None,
+            "category_id": target.category_id if model == "product" else None,
+        }, aggregate_id=target.id)
+
+    def before_flush(session, flush_context, instances):
+        session.info["catalog_created"] = [target for target in session.new if type(target) in models]
+        # Изменения полей товара уже описывает product.updated
+        changed = list(session.deleted) + [target for target in session.dirty if not isinstance(target, Product)]
+        for target in changed:
+            if type(target) in models and (target in session.deleted or session.is_modified(target)):
+                emit_change(session, target)
+
+    def after_flush(session, flush_context):
+        for target in session.info.pop("catalog_created", []):
+            emit_change(session, target)
+
+    if not event.contains(Session, "before_flush", before_flush):
+        event.listen(Session, "before_flush", before_flush)
+        event.listen(Session, "after_flush", after_flush)
+
+
+def watch_order_status_changes():
+    """Пишет order.status_changed для заказов, сменивших статус через ORM, в ту же транзакцию"""
+
+    def before_flush(session, flush_context, instances):
+        for target in list(session.dirty):
+            if not isinstance(target, Order):
+                continue
+            history = inspect(target).attrs["status"].history
+            if not history.has_changes() or not history.deleted:
+                continue
+            emit(session, ORDER_STATUS_CHANGED, {
+                "order_id": target.id,
+                "user_id": target.user_id,
+                "status": target.status,
+                "status_label": status_label(target.status),
+                "previous_status": history.deleted[0],
+            }, aggregate_id=target.id)
+
+    if not event.contains(Session, "before_flush", before_flush):
+        event.listen(Session, "before_flush", before_flush)
+
+
+class EventBus:
+    """Подписчики внутри процесса; '*' получает все события"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable[[dict], None]]] = defaultdict(list)
+        self._lock = Lock()
+
+    def subscribe(self, topic: str, handler: Callable[[dict], None]):
+        with self._lock:
+            self._handlers[topic].append(handler)
+
+    def publish(self, events: List[dict]):
+        for outbox_event in events:
+            handlers = self._handlers.get(outbox_event["topic"], []) + self._handlers.get("*", [])
+            for handler in handlers:
+                try:
+                    handler(outbox_event)
+                except Exception as e:
+                    # Ошибка одного подписчика не должна останавливать доставку остальным
+                    print(f"Ошибка подписчика {getattr(handler, '__name__', handler)} "
+                          f"на {outbox_event['topic']}: {e}")
+
+
+def as_message(outbox_event: OutboxEvent) -> dict:
+    return {
+        "id": outbox_event.id,
+        "topic": outbox_event.topic,
+        "aggregate_id": outbox_event.aggregate_id,
+        "payload": outbox_event.payload,
+        "created_at": outbox_event.created_at.isoformat() if outbox_event.created_at else None,
+    }
+
+
+class OutboxRelay:
+    """Публикует неопубликованные события пачками в порядке id"""
+
+    def __init__(self, session_factory, broker, batch_size: int = RELAY_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.broker = broker
+        self.batch_size = batch_size
+
+    def relay_once(self) -> int:
+        db = self.session_factory()
+        try:
+            # Несколько воркеров делят очередь: занятые строки пропускаются (PostgreSQL)
+            events = db.scalars(
+                select(OutboxEvent)
+                .where(OutboxEvent.published_at.is_(None))
+                .order_by(OutboxEvent.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if not events:
+                db.commit()
+                return 0
+
+            # Если брокер упадёт, транзакция откатится и пачка уйдёт повторно
+            self.broker.publish([as_message(outbox_event) for outbox_event in events])
+            db.execute(
+                update(OutboxEvent)
+                .where(OutboxEvent.id.in_([outbox_event.id for outbox_event in events]))
+                .values(published_at=datetime.now())
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            return len(events)
+        finally:
+            db.close()
+
+    def relay_pending(self) -> int:
+        """Публикует всё накопившееся"""
+        published = 0
+        while True:
+            count = self.relay_once()
+            published += count
+            if count < self.batch_size:
+                return published
+
+
+class OutboxTail:
+    """Читает новые события заданных тем из outbox_events и передаёт их broker.publish.
+
+    В отличие от OutboxRelay, события получает каждый воркер: так
+    обновляется состояние в памяти процесса (кэши, индексы), которое
+    релей, раздающий событие одному воркеру, обновил бы только у одного.
+    Номера событий выдаются до фиксации, поэтому последние lookback номеров
+    перечитываются: событие, зафиксированное позже следующего по номеру,
+    не теряется, а уже переданные отсеиваются по множеству номеров.
+    """
+
+    def __init__(self, session_factory, topics, broker, batch_size: int = 1000, lookback: int = 200):
+        self.session_factory = session_factory
+        self.topics = tuple(topics)
+        self.broker = broker
+        self.batch_size = batch_size
+        self.lookback = lookback
+        self.last_id: Optional[int] = None
+        self._seen: Set[int] = set()
+
+    def poll(self) -> int:
+        db = self.session_factory()
+        try:
+            if self.last_id is None:
+                # Историю до старта воркера не передаём
+                self.last_id = db.scalar(select(func.max(OutboxEvent.id))) or 0
+                self._seen = set(db.scalars(
+                    select(OutboxEvent.id).where(OutboxEvent.id > self.last_id - self.lookback)
+                ))
+                return 0
+            events = db.scalars(
+                select(OutboxEvent)
+                .where(OutboxEvent.id > self.last_id - self.lookback, OutboxEvent.topic.in_(self.topics))
+                .order_by(OutboxEvent.id)
+                .limit(self.batch_size)
+            ).all()
+            fresh = [outbox_event for outbox_event in events if outbox_event.id not in self._seen]
+            messages = self.messages(fresh)
+        finally:
+            db.close()
+
+        if events:
+            self.last_id = max(self.last_id, events[-1].id)
+        self._seen.update(outbox_event.id for outbox_event in fresh)
+        self._seen = {event_id for event_id in self._seen if event_id > self.last_id - self.lookback}
+        if messages:
+            self.broker.publish(messages)
+        return len(messages)
+
+    def messages(self, events: List[OutboxEvent]) -> List[dict]:
+        return [as_message(outbox_event) for outbox_event in events]
+
+
+def purge_published(db: Session, retention_hours: int = RETENTION_HOURS) -> int:
+    result = db.execute(
+        delete(OutboxEvent)
+        .where(OutboxEvent.published_at < datetime.now() - timedelta(hours=retention_hours))
+    )
+    db.commit()
+    return result.rowcount
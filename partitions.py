@@ -0,0 +1,266 @@
+# partitions.py
+"""Секционирование заказов по месяцам (PostgreSQL) и архивирование старой истории.
+
+orders секционируется по created_at, order_items и order_decorators — по
+order_created_at (копии даты заказа), поэтому заказ и его позиции лежат в
+секциях одного месяца. Запрос с условием на дату читает только секции
+периода, а старый месяц выгружается в сжатый файл и удаляется целиком —
+без долгого DELETE и раздувания таблиц.
+
+Перевод существующей БД: python manage.py partition-orders
+Секции на будущие месяцы создаёт фоновая задача (ensure_partitions),
+архивирование: python manage.py archive-orders --keep-months 12
+"""
+import gzip
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Iterator, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import export
+from database import Order, OrderDecorator, OrderItem
+
+# Таблица -> колонка, по которой она секционирована; порядок — от родителя к дочерним
+PARTITIONED_TABLES = {
+    "orders": "created_at",
+    "order_items": "order_created_at",
+    "order_decorators": "order_created_at",
+}
+# На сколько месяцев вперёд держать готовые секции
+PARTITION_MONTHS_AHEAD = 2
+ARCHIVE_FORMATS = {"parquet": "parquet", "csv": "csv.gz"}
+# Ключ advisory-блокировки: секции создаёт один воркер за раз
+PARTITION_LOCK_KEY = 4607
+
+_PARTITION_SUFFIX = re.compile(r"_(\d{4})_(\d{2})$")
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months_between(first, last) -> Iterator[date]:
+    """Первые числа месяцев от first до last включительно"""
+    month, last = month_start(first), month_start(last)
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+
+def partition_ddl(table: str, month: date) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def is_partitioned(connection, table: str = "orders") -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :table AND pg_table_is_visible(c.oid)"
+    ), {"table": table}).first() is not None
+
+
+def list_partitions(connection, table: str = "orders") -> List[date]:
+    """Месяцы, для которых у таблицы есть секции"""
+    names = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :table AND pg_table_is_visible(p.oid)"
+    ), {"table": table}).scalars()
+    months = []
+    for name in names:
+        match = _PARTITION_SUFFIX.search(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def create_month_partitions(connection, first, last) -> int:
+    """Создаёт недостающие секции всех таблиц заказов с месяца first по месяц last"""
+    created = 0
+    for table in PARTITIONED_TABLES:
+        existing = set(list_partitions(connection, table))
+        for month in months_between(first, last):
+            if month not in existing:
+                connection.execute(text(partition_ddl(table, month)))
+                created += 1
+    return created
+
+
+def ensure_partitions(connection, months_ahead: int = PARTITION_MONTHS_AHEAD) -> int:
+    """Секции на текущий и следующие месяцы; без секции вставка заказа упала бы"""
+    if not is_partitioned(connection):
+        return 0
+    connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+    today = date.today()
+    return create_month_partitions(connection, today, add_months(month_start(today), months_ahead))
+
+
+def convert_to_partitioned(connection, months_ahead: int = PARTITION_MONTHS_AHEAD) -> int:
+    """Переводит orders, order_items и order_decorators на секции по месяцам.
+
+    Данные копируются в новые таблицы в одной транзакции, поэтому на время
+    перевода приложение нужно остановить. Внешние ключи order_summaries и
+    stock_reservations на orders удаляются: у секционированной таблицы
+    уникален только ключ (id, created_at).
+    """
+    if connection.dialect.name != "postgresql":
+        raise RuntimeError("Секционирование поддерживается только на PostgreSQL")
+    if is_partitioned(connection):
+        print("Таблицы заказов уже секционированы")
+        return 0
+
+    connection.execute(text("UPDATE orders SET created_at = now() WHERE created_at IS NULL"))
+    for table in ("order_items", "order_decorators"):
+        connection.execute(text(
+            f"UPDATE {table} SET order_created_at = o.created_at FROM orders o "
+            f"WHERE o.id = {table}.order_id AND {table}.order_created_at IS NULL"
+        ))
+        orphans = connection.execute(text(f"SELECT COUNT(*) FROM {table} WHERE order_created_at IS NULL")).scalar()
+        if orphans:
+            raise RuntimeError(f"В {table} {orphans} строк без заказа: их некуда поместить")
+
+    first_month = connection.execute(text("SELECT MIN(created_at) FROM orders")).scalar() or date.today()
+    last_month = add_months(month_start(date.today()), months_ahead)
+
+    for table, key in PARTITIONED_TABLES.items():
+        legacy = f"{table}_unpartitioned"
+        connection.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+        connection.execute(text(
+            f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE ({key})"
+        ))
+        connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN {key} SET NOT NULL"))
+        # Последовательность id переходит к новой таблице и переживёт удаление старой
+        sequence = connection.execute(text(f"SELECT pg_get_serial_sequence('{legacy}', 'id')")).scalar()
+        if sequence:
+            connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+
+    created = create_month_partitions(connection, first_month, last_month)
+
+    for table in PARTITIONED_TABLES:
+        connection.execute(text(f"INSERT INTO {table} SELECT * FROM {table}_unpartitioned"))
+    for table in reversed(list(PARTITIONED_TABLES)):
+        connection.execute(text(f"DROP TABLE {table}_unpartitioned CASCADE"))
+
+    for table, key in PARTITIONED_TABLES.items():
+        connection.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, {key})"))
+    for table in ("order_items", "order_decorators"):
+        connection.execute(text(
+            f"ALTER TABLE {table} ADD FOREIGN KEY (order_id, order_created_at) "
+            f"REFERENCES orders (id, created_at)"
+        ))
+        connection.execute(text(f"CREATE INDEX ix_{table}_order ON {table} (order_id)"))
+    connection.execute(text("ALTER TABLE order_items ADD FOREIGN KEY (product_id) REFERENCES product (id)"))
+    connection.execute(text("ALTER TABLE order_decorators ADD FOREIGN KEY (decorator_id) REFERENCES decorators (id)"))
+    for model in (Order, OrderItem, OrderDecorator):
+        for index in model.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+    for table in PARTITIONED_TABLES:
+        connection.execute(text(f"ANALYZE {table}"))
+    return created
+
+
+def archive_path(directory: str, month: date, file_format: str) -> str:
+    return os.path.join(directory, f"orders_{month:%Y_%m}.{ARCHIVE_FORMATS[file_format]}")
+
+
+def write_archive(chunks: Iterator[list], path: str, file_format: str) -> Tuple[int, int]:
+    """Пишет строки выгрузки в файл; возвращает (число заказов, число позиций).
+
+    Файл появляется под своим именем только целиком (запись во временный и rename).
+    """
+    orders = items = 0
+    last_order_id = None
+
+    def counted():
+        nonlocal orders, items, last_order_id
+        for chunk in chunks:
+            for row in chunk:
+                # Строки идут по порядку заказов; у заказа без позиций поля позиции пустые
+                if row.id != last_order_id:
+                    orders += 1
+                    last_order_id = row.id
+                if row.quantity is not None:
+                    items += 1
+            yield chunk
+
+    temporary = path + ".tmp"
+    opener = gzip.open if file_format == "csv" else open
+    with opener(temporary, "wb") as output:
+        parts = export.write_csv(counted()) if file_format == "csv" else export.write_arrow(counted(), file_format)
+        for data in parts:
+            output.write(data)
+    with open(temporary, "rb") as written:
+        os.fsync(written.fileno())
+    os.replace(temporary, path)
+    return orders, items
+
+
+def archive_partitions(db: Session, keep_months: int, directory: str,
+                       file_format: str = "parquet") -> List[Tuple[date, str, int, int]]:
+    """Выгружает месяцы старше keep_months в файлы и удаляет их секции.
+
+    Возвращает [(месяц, файл, число заказов, число позиций)].
+
+    Каждый месяц — отдельная транзакция: секции удаляются, только если в
+    файл попали все заказы месяца (и без позиций тоже) и все их позиции.
+    """
+    if file_format not in export.available_formats() or file_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Формат архива {file_format} недоступен")
+    if not is_partitioned(db.connection()):
+        raise RuntimeError("Архивирование работает с секционированными таблицами (manage.py partition-orders)")
+
+    os.makedirs(directory, exist_ok=True)
+    cutoff = add_months(month_start(date.today()), -keep_months)
+    archived = []
+    for month in list_partitions(db.connection()):
+        if month >= cutoff:
+            break
+        next_month = add_months(month, 1)
+        path = archive_path(directory, month, file_format)
+        order_count, rows = write_archive(
+            export.iter_order_chunks(db, month, next_month - timedelta(days=1), include_empty_orders=True),
+            path, file_format
+        )
+        expected_orders, expected = (
+            db.execute(text(f"SELECT COUNT(*) FROM {partition_name(table, month)}")).scalar()
+            for table in ("orders", "order_items")
+        )
+        if (order_count, rows) != (expected_orders, expected):
+            db.rollback()
+            raise RuntimeError(f"В архив {path} попало {order_count} заказов из {expected_orders} "
+                               f"и {rows} позиций из {expected}, секции не удалены")
+
+        # Сводки, резервы и отправления ссылаются на заказы месяца без внешних ключей: удаляются вместе с ними
+        orders = partition_name("orders", month)
+        db.execute(text(f"DELETE FROM stock_reservations WHERE order_id IN (SELECT id FROM {orders})"))
+        db.execute(text(f"DELETE FROM shipments WHERE order_id IN (SELECT id FROM {orders})"))
+        db.execute(text("DELETE FROM order_summaries WHERE created_at >= :start AND created_at < :end"), {
+            "start": datetime.combine(month, datetime.min.time()),
+            "end": datetime.combine(next_month, datetime.min.time()),
+        })
+        # Сначала дочерние секции: на секцию orders ссылаются их внешние ключи
+        for table in reversed(list(PARTITIONED_TABLES)):
+            name = partition_name(table, month)
+            db.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            db.execute(text(f"DROP TABLE {name}"))
+        db.commit()
+        print(f"{month:%Y-%m}: {order_count} заказов и {rows} позиций выгружено в {path}")
+        archived.append((month, path, order_count, rows))
+    return archived
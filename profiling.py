@@ -0,0 +1,229 @@
+# profiling.py
+"""Профилирование отдельного запроса по требованию.
+
+Запрос с заголовком X-Profile: <PROFILING_TOKEN> (или ?profile=<токен>)
+выполняется под сэмплирующим профилировщиком: отдельный поток каждые
+PROFILE_INTERVAL_MS миллисекунд снимает стеки потока цикла событий и всех
+потоков, выполняющих работу запроса. Такие потоки (asyncio.to_thread,
+пул потоков Starlette для def-обработчиков, GroupCommitter) получают копию
+контекста и отмечаются при первом SQL-запросе с профилем в contextvar.
+Заодно записываются все SQL-запросы с длительностями.
+
+Результат сохраняется в PROFILE_DIR: <id>.collapsed — стеки в формате
+flamegraph.pl / speedscope, <id>.json — время запроса и SQL. Ответ
+получает заголовки X-Profile-Id и Server-Timing. Посмотреть профиль:
+GET /api/debug/profiles/<id> с тем же заголовком X-Profile.
+
+Без PROFILING_TOKEN middleware и обработчики событий SQLAlchemy не
+подключаются вовсе. С токеном обычный запрос платит за проверку заголовка,
+а каждый SQL-запрос — за чтение contextvar.
+"""
+import asyncio
+import contextvars
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import List, Optional
+from urllib.parse import parse_qs
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+PROFILE_HEADER = "X-Profile"
+# Длинные запросы (массовые вставки) обрезаются
+MAX_STATEMENT_LENGTH = 2000
+
+_PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+_current_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+def token_matches(token: str, supplied: Optional[str]) -> bool:
+    return bool(token) and supplied is not None and hmac.compare_digest(token.encode(), supplied.encode())
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.status: Optional[int] = None
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.statements: List[dict] = []
+        self.stacks: Counter = Counter()
+        # Потоки, в которых выполняется работа запроса
+        self.threads = {threading.get_ident()}
+        self._lock = threading.Lock()
+
+    def add_thread(self, thread_id: int):
+        if thread_id not in self.threads:
+            with self._lock:
+                self.threads = self.threads | {thread_id}
+
+    def record_statement(self, statement: str, duration: float):
+        with self._lock:
+            self.statements.append({
+                "statement": statement[:MAX_STATEMENT_LENGTH],
+                "duration_ms": round(duration * 1000, 3),
+            })
+
+    @property
+    def sql_seconds(self) -> float:
+        return sum(item["duration_ms"] for item in self.statements) / 1000
+
+    def server_timing(self) -> str:
+        elapsed = (time.perf_counter() - self.started) * 1000
+        return (f"total;dur={elapsed:.1f}, "
+                f"sql;dur={self.sql_seconds * 1000:.1f};desc=\"{len(self.statements)} queries\"")
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "duration_ms": round(self.duration * 1000, 3),
+            "samples": sum(self.stacks.values()),
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "sql_count": len(self.statements),
+            "sql_ms": round(self.sql_seconds * 1000, 3),
+            "sql": self.statements,
+        }
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{self.id}.collapsed"), "w", encoding="utf-8") as output:
+            output.write(self.collapsed())
+        with open(os.path.join(directory, f"{self.id}.json"), "w", encoding="utf-8") as output:
+            json.dump(self.summary(), output, ensure_ascii=False, indent=2)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler(threading.Thread):
+    """Каждые interval секунд снимает стеки всех потоков профиля"""
+
+    def __init__(self, profile: RequestProfile, interval: float):
+        super().__init__(name="request-profiler", daemon=True)
+        self.profile = profile
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in self.profile.threads:
+                frame = frames.get(thread_id)
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                if labels:
+                    self.profile.stacks[";".join(reversed(labels))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add_thread(threading.get_ident())
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    if profile is not None and conn.info.get("profile_started"):
+        profile.record_statement(statement, time.perf_counter() - conn.info["profile_started"].pop())
+
+
+def watch_sql():
+    """Время SQL-запросов профилируемого запроса; для остальных — одна проверка contextvar"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware: профилирует запросы с верным токеном, остальные пропускает как есть"""
+
+    def __init__(self, app, token: str = PROFILING_TOKEN, directory: str = PROFILE_DIR,
+                 interval_ms: float = PROFILE_INTERVAL_MS):
+        self.app = app
+        self.token = token
+        self.directory = directory
+        self.interval = interval_ms / 1000
+        # Один профилируемый запрос на воркер: сэмплер видит весь поток цикла событий
+        self._busy = threading.Lock()
+        watch_sql()
+
+    def _requested(self, scope) -> bool:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-profile":  # имена заголовков в ASGI — в нижнем регистре
+                return token_matches(self.token, value.decode("latin-1"))
+        query = scope.get("query_string", b"")
+        if b"profile=" in query:
+            return token_matches(self.token, parse_qs(query.decode("latin-1")).get("profile", [None])[0])
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope) or not self._busy.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        context_token = _current_profile.set(profile)
+        sampler = StackSampler(profile, self.interval)
+
+        async def send_with_profile_headers(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile.id.encode()),
+                    (b"server-timing", profile.server_timing().encode()),
+                ]
+            await send(message)
+
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_headers)
+        finally:
+            sampler.stop()
+            profile.duration = time.perf_counter() - profile.started
+            _current_profile.reset(context_token)
+            self._busy.release()
+            try:
+                await asyncio.to_thread(profile.save, self.directory)
+            except OSError as e:
+                print(f"Профиль {profile.id} не сохранён: {e}")
+
+
+def load_profile(directory: str, profile_id: str, file_format: str = "json") -> Optional[str]:
+    """Содержимое сохранённого профиля или None"""
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    extension = "collapsed" if file_format == "collapsed" else "json"
+    try:
+        with open(os.path.join(directory, f"{profile_id}.{extension}"), encoding="utf-8") as stored:
+            return stored.read()
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,167 @@
+# push.py
+"""Обновления заказов для клиентов по Server-Sent Events.
+
+Каждый воркер держит PushHub, в котором пользователи подписаны на события
+своих заказов. У подписки есть короткая очередь и asyncio.Event, но нет
+своей задачи, таймера или соединения с БД, поэтому простаивающее
+соединение стоит только памяти сервера под сокет. Обновления берутся из outbox_events:
+OrderEventTail раз в PUSH_POLL_SECONDS читает новые строки по первичному
+ключу и раздаёт их подписчикам своего воркера. Поэтому клиент получает
+событие, даже если изменение сделал другой воркер.
+"""
+import asyncio
+import json
+import os
+from collections import defaultdict, deque
+from typing import Dict, Iterable, List, Optional, Set
+
+from database import OutboxEvent
+from outbox import ORDER_DELIVERY_SCHEDULED, ORDER_STATUS_CHANGED, OutboxTail
+
+PUSH_POLL_SECONDS = float(os.getenv("PUSH_POLL_SECONDS", "1"))
+# Комментарий-пинг не даёт прокси закрыть простаивающее соединение
+PUSH_HEARTBEAT_SECONDS = float(os.getenv("PUSH_HEARTBEAT_SECONDS", "15"))
+PUSH_MAX_CONNECTIONS = int(os.getenv("PUSH_MAX_CONNECTIONS", "10000"))
+PUSH_TOPICS = (ORDER_STATUS_CHANGED, ORDER_DELIVERY_SCHEDULED)
+# Клиент, пропустивший события, перечитывает список заказов целиком
+RESYNC = {"type": "resync", "data": {}}
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def format_event(message: dict) -> bytes:
+    """Сообщение в формате text/event-stream"""
+    lines = []
+    if message.get("id") is not None:
+        lines.append(f"id: {message['id']}")
+    lines.append(f"event: {message['type']}")
+    lines.append("data: " + json.dumps(message["data"], ensure_ascii=False))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+class Subscription:
+    __slots__ = ("user_id", "messages", "ready", "overflowed")
+
+    def __init__(self, user_id: int, max_pending: int):
+        self.user_id = user_id
+        self.messages = deque(maxlen=max_pending)
+        self.ready = asyncio.Event()
+        self.overflowed = False
+
+    def push(self, message: dict):
+        if len(self.messages) == self.messages.maxlen:
+            # Медленный клиент: старые события вытесняются, при отправке он получит resync
+            self.overflowed = True
+        self.messages.append(message)
+        self.ready.set()
+
+    async def next_batch(self, timeout: float) -> List[dict]:
+        """Накопившиеся сообщения; пустой список, если за timeout ничего не пришло"""
+        if not self.messages:
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        if self.overflowed:
+            self.overflowed = False
+            self.messages.clear()
+            return [RESYNC]
+        batch = list(self.messages)
+        self.messages.clear()
+        return batch
+
+
+class PushHub:
+    """Подписки пользователей внутри воркера; publish можно вызывать из любого потока"""
+
+    def __init__(self, max_pending: int = 100, history: int = 1000,
+                 max_connections: int = PUSH_MAX_CONNECTIONS):
+        self.max_pending = max_pending
+        self.max_connections = max_connections
+        self._subscriptions: Dict[int, Set[Subscription]] = defaultdict(set)
+        # Последние сообщения для повтора после переподключения (Last-Event-ID)
+        self._history = deque(maxlen=history)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.connections = 0
+
+    def subscribe(self, user_id: int, last_event_id: Optional[int] = None) -> Optional[Subscription]:
+        """Новая подписка или None, если воркер уже держит max_connections соединений"""
+        if self.connections >= self.max_connections:
+            return None
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(user_id, self.max_pending)
+        self._subscriptions[user_id].add(subscription)
+        self.connections += 1
+
+        if last_event_id is not None:
+            if not self._history or last_event_id < self._history[0]["id"]:
+                # Пропущенных событий уже нет в памяти
+                subscription.push(RESYNC)
+            else:
+                for message in self._history:
+                    if message["id"] > last_event_id and message["user_id"] == user_id:
+                        subscription.push(message)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.user_id)
+        if subscriptions and subscription in subscriptions:
+            subscriptions.discard(subscription)
+            self.connections -= 1
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+
+    def publish(self, messages: Iterable[dict]):
+        messages = list(messages)
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self._history.extend(messages)
+        elif _running_loop() is loop:
+            self._deliver(messages)
+        else:
+            loop.call_soon_threadsafe(self._deliver, messages)
+
+    def _deliver(self, messages: List[dict]):
+        for message in messages:
+            self._history.append(message)
+            for subscription in self._subscriptions.get(message["user_id"], ()):
+                subscription.push(message)
+
+
+async def event_stream(hub: PushHub, subscription: Subscription,
+                       heartbeat: float = PUSH_HEARTBEAT_SECONDS):
+    """Тело ответа text/event-stream; подписка снимается, когда клиент отключился"""
+    try:
+        yield b"retry: 3000\n\n"
+        while True:
+            messages = await subscription.next_batch(heartbeat)
+            if not messages:
+                yield b": ping\n\n"
+                continue
+            yield b"".join(format_event(message) for message in messages)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+class OrderEventTail(OutboxTail):
+    """Передаёт хабу события заказов из outbox_events.
+
+    Каждый воркер читает сам, независимо от OutboxRelay: релей раздаёт
+    событие одному воркеру, а подписчик может быть подключён к любому.
+    """
+
+    def __init__(self, session_factory, hub: PushHub, batch_size: int = 1000, lookback: int = 200):
+        super().__init__(session_factory, PUSH_TOPICS, hub, batch_size, lookback)
+
+    def messages(self, events: List[OutboxEvent]) -> List[dict]:
+        return [
+            {"id": outbox_event.id, "user_id": outbox_event.payload.get("user_id"),
+             "type": outbox_event.topic, "data": outbox_event.payload}
+            for outbox_event in events
+        ]
@@ -0,0 +1,202 @@
+# ratelimit.py
+"""Ограничение частоты запросов и контроль допуска для нагруженных endpoints.
+
+- RateLimiter: token bucket на пару (клиент, маршрут), ответ 429 с Retry-After.
+  Состояние хранится в памяти воркера (MemoryBucketBackend) или в Redis
+  (RedisBucketBackend), чтобы лимит был общим для всех воркеров и серверов.
+- ConcurrencyLimiter: не больше max_in_flight одновременных запросов к БД
+  на воркер; лишние сразу получают 503 с Retry-After, а не ждут в очереди пула.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Ошибки общего хранилища, при которых лимит временно считается в памяти воркера
+BACKEND_ERRORS = (redis.RedisError,) if redis is not None else ()
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# redis://host:6379/0 — общий лимит для всех воркеров; пусто — лимит на воркер
+RATE_LIMIT_STORAGE_URL = os.getenv("RATE_LIMIT_STORAGE_URL", "")
+# Учитывать X-Forwarded-For (только за доверенным балансировщиком)
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") == "1"
+# По умолчанию равно размеру пула SQLAlchemy: 5 соединений + 10 сверх пула
+MAX_IN_FLIGHT_DB_REQUESTS = int(os.getenv("MAX_IN_FLIGHT_DB_REQUESTS", "15"))
+SHED_RETRY_AFTER_SECONDS = 1
+
+
+class MemoryBucketBackend:
+    """Token bucket в памяти процесса; старые ключи вытесняются по LRU"""
+
+    # take не ходит в сеть и вызывается прямо в цикле событий
+    blocking = False
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: int, now: Optional[float] = None) -> Tuple[bool, float]:
+        """Забирает токен; возвращает (разрешено, через сколько секунд появится токен)"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (float(burst), now))
+            tokens = min(float(burst), tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# Пополнение и списание одной атомарной операцией на стороне Redis
+REDIS_TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBucketBackend:
+    """Token bucket в Redis: лимит общий для всех процессов"""
+
+    # Запрос к Redis выполняется в пуле потоков, а не в цикле событий
+    blocking = True
+
+    def __init__(self, url: str, prefix: str = "ratelimit:", timeout: float = 0.5):
+        if redis is None:
+            raise RuntimeError("Для общего хранилища лимитов нужен пакет redis")
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        # Недоступный Redis обнаруживается при старте, а не на первом запросе
+        self.client.ping()
+        self.prefix = prefix
+        self._script = self.client.register_script(REDIS_TOKEN_BUCKET)
+
+    def take(self, key: str, rate: float, burst: int, now: Optional[float] = None) -> Tuple[bool, float]:
+        allowed, tokens = self._script(keys=[self.prefix + key], args=[rate, burst])
+        allowed = bool(int(allowed))
+        return allowed, 0.0 if allowed else (1 - float(tokens)) / rate
+
+    def reset(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+def create_backend(url: str = RATE_LIMIT_STORAGE_URL):
+    if not url:
+        return MemoryBucketBackend()
+    try:
+        return RedisBucketBackend(url)
+    except Exception as e:
+        # Без общего хранилища лимит остаётся, но считается на каждый воркер отдельно
+        print(f"Хранилище лимитов недоступно ({e}), используется память процесса")
+        return MemoryBucketBackend()
+
+
+def client_key(request: Request) -> str:
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def retry_after_header(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+class RateLimiter:
+    """Фабрика зависимостей FastAPI: rate_limiter.limit("orders", rate=5, burst=20)"""
+
+    def __init__(self, backend=None, enabled: bool = RATE_LIMIT_ENABLED):
+        self.backend = backend or create_backend()
+        self.enabled = enabled
+        # Пока общее хранилище недоступно, лимит считается в памяти воркера
+        self.fallback = MemoryBucketBackend()
+        self.backend_errors = 0
+
+    async def take(self, key: str, rate: float, burst: int) -> Tuple[bool, float]:
+        if not self.backend.blocking:
+            return self.backend.take(key, rate, burst)
+        try:
+            return await asyncio.to_thread(self.backend.take, key, rate, burst)
+        except BACKEND_ERRORS as e:
+            self.backend_errors += 1
+            if self.backend_errors == 1 or self.backend_errors % 1000 == 0:
+                print(f"Хранилище лимитов недоступно ({e}), лимит считается в памяти воркера")
+            return self.fallback.take(key, rate, burst)
+
+    def limit(self, route: str, rate: float, burst: int):
+        async def dependency(request: Request):
+            if not self.enabled:
+                return
+            allowed, retry_after = await self.take(f"{route}:{client_key(request)}", rate, burst)
+            if not allowed:
+                raise HTTPException(status_code=429, detail="Слишком много запросов, повторите позже",
+                                    headers=retry_after_header(retry_after))
+        return dependency
+
+
+class ConcurrencyLimiter:
+    """Ограничение числа одновременных запросов к БД в пределах воркера"""
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT_DB_REQUESTS, enabled: bool = RATE_LIMIT_ENABLED):
+        self.max_in_flight = max_in_flight
+        self.enabled = enabled
+        self.in_flight = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    async def admit(self):
+        """Зависимость FastAPI: слот освобождается после отправки ответа"""
+        if not self.enabled:
+            yield
+            return
+        if not self.try_acquire():
+            raise HTTPException(status_code=503, detail="Сервис перегружен, повторите позже",
+                                headers=retry_after_header(SHED_RETRY_AFTER_SECONDS))
+        try:
+            yield
+        finally:
+            self.release()
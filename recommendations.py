@@ -0,0 +1,324 @@
+# recommendations.py
+"""«С этим товаром покупают»: рекомендации по совместным покупкам.
+
+Матрица совместной встречаемости товар × товар строится по order_items:
+при наличии NumPy/SciPy одним разреженным произведением Xᵀ·X (заказы × товары),
+иначе в чистом Python. От матрицы остаются только top-k партнёров каждого
+товара, поэтому выдача — это чтение словаря, а память не растёт с числом пар.
+
+Полную сборку делает один воркер (publish_index) и записывает результат в
+таблицу product_co_purchases; остальные воркеры только загружают её, когда
+версия в rollup_state меняется (load_shared). Заказы новее сборки
+добавляются инкрементально (order.created из outbox, каждый воркер читает
+их сам через OutboxTail).
+"""
+import itertools
+from array import array
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from threading import RLock
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import Order, OrderItem, ProductCoPurchase, RollupState
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None
+
+TOP_K = 20
+BUILD_CHUNK_SIZE = 50000
+# Пары, купленные вместе реже, в рекомендации и наборы не попадают
+MIN_SUPPORT = 2
+# Заказы моложе этого окна ещё могут фиксироваться в параллельных транзакциях
+BUILD_SAFETY_SECONDS = 60
+# Строка rollup_state с версией общего индекса
+STATE_NAME = "recommendations"
+
+
+def iter_order_baskets(db: Session, chunk_size: int = BUILD_CHUNK_SIZE,
+                       up_to_id: Optional[int] = None) -> Iterator[Tuple[int, List[int]]]:
+    """(order_id, товары заказа) в порядке id заказа, чтение потоком"""
+    query = select(OrderItem.order_id, OrderItem.product_id).where(OrderItem.product_id.is_not(None))
+    if up_to_id is not None:
+        query = query.where(OrderItem.order_id <= up_to_id)
+    connection = db.connection().execution_options(stream_results=True, yield_per=chunk_size)
+    result = connection.execute(query.order_by(OrderItem.order_id))
+    for order_id, rows in itertools.groupby(result, key=lambda row: row[0]):
+        yield order_id, [row[1] for row in rows]
+
+
+def _ranked(partners: Dict[int, int]) -> List[Tuple[int, int]]:
+    """Партнёры по убыванию числа совместных заказов, при равенстве — по id"""
+    return sorted(partners.items(), key=lambda item: (-item[1], item[0]))
+
+
+class CoOccurrenceIndex:
+    def __init__(self, top_k: int = TOP_K, min_support: int = MIN_SUPPORT):
+        self.top_k = top_k
+        self.min_support = min_support
+        # товар -> {до top_k других товаров: число заказов, где они куплены вместе}
+        self._top: Dict[int, Dict[int, int]] = {}
+        # товар -> число заказов с ним
+        self._orders: Dict[int, int] = {}
+        # По какой заказ включительно учтена полная сборка
+        self.built_up_to = 0
+        self.last_order_id = 0
+        # Заказы новее сборки, добавленные инкрементально: после смены сборки
+        # добавляются заново, если она их ещё не включает
+        self._recent: Dict[int, FrozenSet[int]] = {}
+        # updated_at загруженной общей сборки (load_shared)
+        self.version = None
+        self._lock = RLock()
+
+    # Построение
+
+    def build(self, baskets: Iterable[Tuple[int, List[int]]],
+              up_to_id: Optional[int] = None) -> "CoOccurrenceIndex":
+        """Полная сборка по истории заказов (не новее up_to_id); индекс заменяется целиком"""
+        if up_to_id is not None:
+            baskets = ((order_id, products) for order_id, products in baskets if order_id <= up_to_id)
+        if np is not None:
+            top, orders, last_order_id = self._count_vectorized(baskets, self.top_k)
+        else:
+            top, orders, last_order_id = self._count_python(baskets, self.top_k)
+        self._replace(top, orders, last_order_id if up_to_id is None else up_to_id)
+        return self
+
+    def _replace(self, top: Dict[int, Dict[int, int]], orders: Dict[int, int], built_up_to: int):
+        with self._lock:
+            self._top, self._orders = top, orders
+            self.built_up_to = built_up_to
+            self.last_order_id = max(self.last_order_id, built_up_to)
+            # Заказы, пришедшие во время сборки, но не попавшие в неё
+            self._recent = {order_id: products for order_id, products in self._recent.items()
+                            if order_id > built_up_to}
+            for products in self._recent.values():
+                self._count_order(products)
+
+    @staticmethod
+    def _count_python(baskets, top_k: int):
+        pairs: Dict[int, Counter] = defaultdict(Counter)
+        orders: Counter = Counter()
+        last_order_id = 0
+        for order_id, product_ids in baskets:
+            products = set(product_ids)
+            orders.update(products)
+            for first, second in itertools.permutations(products, 2):
+                pairs[first][second] += 1
+            last_order_id = max(last_order_id, order_id)
+        top = {product_id: dict(_ranked(partners)[:top_k]) for product_id, partners in pairs.items()}
+        return top, dict(orders), last_order_id
+
+    @staticmethod
+    def _count_vectorized(baskets, top_k: int):
+        # Номера строк и товары — в компактных массивах, а не в списках объектов
+        rows, columns = array("q"), array("q")
+        row_count, last_order_id = 0, 0
+        for order_id, product_ids in baskets:
+            products = set(product_ids)
+            rows.extend([row_count] * len(products))
+            columns.extend(products)
+            row_count += 1
+            last_order_id = max(last_order_id, order_id)
+
+        if not rows:
+            return {}, {}, last_order_id
+
+        # Товары переводятся в плотные номера столбцов
+        product_ids, column_index = np.unique(np.frombuffer(columns, dtype=np.int64), return_inverse=True)
+        baskets_matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (np.frombuffer(rows, dtype=np.int64), column_index)),
+            shape=(row_count, len(product_ids))
+        )
+        del rows, columns, column_index
+        # Результат остаётся разреженным: из каждой строки берутся только top_k
+        co_occurrence = (baskets_matrix.T @ baskets_matrix).tocsr()
+        del baskets_matrix
+
+        orders = dict(zip(product_ids.tolist(), co_occurrence.diagonal().tolist()))
+        top: Dict[int, Dict[int, int]] = {}
+        for row, product_id in enumerate(product_ids.tolist()):
+            start, end = co_occurrence.indptr[row], co_occurrence.indptr[row + 1]
+            partner_columns = co_occurrence.indices[start:end]
+            counts = co_occurrence.data[start:end]
+            off_diagonal = partner_columns != row
+            partners, counts = product_ids[partner_columns[off_diagonal]], counts[off_diagonal]
+            if not len(partners):
+                continue
+            best = np.lexsort((partners, -counts))[:top_k]
+            top[product_id] = dict(zip(partners[best].tolist(), counts[best].tolist()))
+        return top, orders, last_order_id
+
+    def build_from_db(self, db: Session, chunk_size: int = BUILD_CHUNK_SIZE,
+                      up_to_id: Optional[int] = None) -> "CoOccurrenceIndex":
+        return self.build(iter_order_baskets(db, chunk_size, up_to_id), up_to_id)
+
+    # Общая сборка для всех воркеров
+
+    def load_shared(self, db: Session, chunk_size: int = BUILD_CHUNK_SIZE) -> bool:
+        """Загружает сборку из product_co_purchases, если она новее загруженной"""
+        version = db.scalar(select(RollupState.updated_at).where(RollupState.name == STATE_NAME))
+        if version is None or version == self.version:
+            return False
+
+        top: Dict[int, Dict[int, int]] = defaultdict(dict)
+        orders: Dict[int, int] = {}
+        built_up_to = 0
+        connection = db.connection().execution_options(stream_results=True, yield_per=chunk_size)
+        result = connection.execute(
+            select(ProductCoPurchase.product_id, ProductCoPurchase.partner_id, ProductCoPurchase.orders)
+        )
+        for product_id, partner_id, count in result:
+            if product_id == 0 and partner_id == 0:
+                built_up_to = count
+            elif product_id == partner_id:
+                orders[product_id] = count
+            else:
+                top[product_id][partner_id] = count
+        self._replace(dict(top), orders, built_up_to)
+        self.version = version
+        return True
+
+    # Инкрементальные обновления
+
+    def add_order(self, order_id: int, product_ids: Iterable[int]) -> bool:
+        """Учитывает новый заказ; повторная доставка и заказы из сборки игнорируются"""
+        products = frozenset(product_ids)
+        with self._lock:
+            if order_id <= self.built_up_to or order_id in self._recent:
+                return False
+            self._recent[order_id] = products
+            self._count_order(products)
+            self.last_order_id = max(self.last_order_id, order_id)
+        return True
+
+    def _count_order(self, products: FrozenSet[int]):
+        for product_id in products:
+            self._orders[product_id] = self._orders.get(product_id, 0) + 1
+        for first, second in itertools.permutations(products, 2):
+            partners = self._top.setdefault(first, {})
+            partners[second] = partners.get(second, 0) + 1
+            if len(partners) > self.top_k:
+                # Хранится только top_k: вытесняется самый слабый партнёр
+                weakest = min(partners, key=lambda partner: (partners[partner], -partner))
+                del partners[weakest]
+
+    def on_order_created(self, event: dict):
+        """Подписчик outbox на order.created"""
+        payload = event["payload"]
+        self.add_order(payload["order_id"], [item["product_id"] for item in payload["items"]])
+
+    # Выдача
+
+    def _top_partners(self, product_id: int) -> List[Tuple[int, int]]:
+        return [(partner, count) for partner, count in _ranked(self._top.get(product_id, {}))
+                if count >= self.min_support]
+
+    def recommend(self, product_id: int, limit: int = 4,
+                  exclude: Iterable[int] = ()) -> List[Tuple[int, float]]:
+        """[(товар, доля заказов с product_id, где он тоже был)], по убыванию"""
+        excluded = set(exclude)
+        with self._lock:
+            top = self._top_partners(product_id)
+            total = self._orders.get(product_id, 0)
+        result = [(partner, round(count / total, 4)) for partner, count in top if partner not in excluded]
+        return result[:limit]
+
+    def frequent_bundles(self, limit: int = 3, size: int = 3) -> List[Tuple[List[int], int]]:
+        """Наборы из часто покупаемых вместе товаров: ([товары], число совместных заказов пары-ядра).
+
+        Ядро — самые частые пары, к ним добавляются товары, чаще всего
+        покупаемые с каждым из уже выбранных; товары в наборах не повторяются.
+        """
+        with self._lock:
+            core_pairs = []
+            for product_id in self._top:
+                top = self._top_partners(product_id)
+                if top:
+                    core_pairs.append((top[0][1], product_id, top[0][0]))
+            core_pairs = sorted(core_pairs, reverse=True)[:limit * 4]
+            bundles, used = [], set()
+            for support, first, second in core_pairs:
+                if len(bundles) >= limit:
+                    break
+                if first in used or second in used:
+                    continue
+                members = [first, second]
+                while len(members) < size:
+                    candidates = Counter()
+                    for partner, _ in self._top_partners(first):
+                        if partner in used or partner in members:
+                            continue
+                        counts = [self._top.get(member, {}).get(partner, 0) for member in members]
+                        if min(counts) >= self.min_support:
+                            candidates[partner] = min(counts)
+                    if not candidates:
+                        break
+                    members.append(candidates.most_common(1)[0][0])
+                used.update(members)
+                bundles.append((members, support))
+        return bundles
+
+    def __len__(self):
+        return len(self._top)
+
+
+def _database_now(db: Session) -> datetime:
+    value = db.scalar(select(func.now()))
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _lock_state(db: Session) -> Optional[RollupState]:
+    """Строка версии под блокировкой; None, если её уже держит другой воркер"""
+    state = db.query(RollupState).filter(RollupState.name == STATE_NAME).with_for_update(skip_locked=True).first()
+    if state is None:
+        try:
+            with db.begin_nested():
+                state = RollupState(name=STATE_NAME, last_order_id=0)
+                db.add(state)
+        except IntegrityError:
+            # Строка есть, но заблокирована: сборку уже делает другой воркер
+            return None
+    return state
+
+
+def publish_index(db: Session, max_age: float, top_k: int = TOP_K, chunk_size: int = BUILD_CHUNK_SIZE,
+                  safety_seconds: int = BUILD_SAFETY_SECONDS) -> Optional[int]:
+    """Пересобирает общий индекс, если он старше max_age секунд; возвращает число товаров.
+
+    Строка rollup_state берётся с SKIP LOCKED: пока один воркер собирает,
+    остальные сразу пропускают ход и продолжают работать с загруженной версией.
+    """
+    state = _lock_state(db)
+    if state is None or (state.updated_at is not None
+                         and datetime.now() - state.updated_at < timedelta(seconds=max_age)):
+        db.rollback()
+        return None
+
+    cutoff = _database_now(db) - timedelta(seconds=safety_seconds)
+    up_to_id = db.scalar(select(func.max(Order.id)).where(Order.created_at <= cutoff)) or 0
+    index = CoOccurrenceIndex(top_k=top_k).build_from_db(db, chunk_size, up_to_id)
+
+    def rows():
+        yield {"product_id": 0, "partner_id": 0, "orders": up_to_id}
+        for product_id, count in index._orders.items():
+            yield {"product_id": product_id, "partner_id": product_id, "orders": count}
+        for product_id, partners in index._top.items():
+            for partner_id, count in partners.items():
+                yield {"product_id": product_id, "partner_id": partner_id, "orders": count}
+
+    db.execute(delete(ProductCoPurchase))
+    batch = rows()
+    while chunk := list(itertools.islice(batch, chunk_size)):
+        db.execute(insert(ProductCoPurchase), chunk)
+    state.last_order_id = up_to_id
+    # Время с микросекундами: по нему воркеры отличают одну сборку от другой
+    state.updated_at = datetime.now()
+    db.commit()
+    return len(index)
@@ -0,0 +1,210 @@
+# serve.py
+"""Запуск приложения в production: несколько воркеров, uvloop/httptools,
+предзагрузка и плавный перезапуск.
+
+С gunicorn приложение импортируется и прогревается в мастере один раз
+(preload), а воркеры получают его через fork: шаблоны, кэш фрагментов и
+индекс рекомендаций делятся между процессами копированием при записи.
+Без gunicorn работает менеджер процессов uvicorn, каждый воркер
+прогревается сам. В обоих случаях SIGHUP перезапускает воркеры, не
+закрывая слушающий сокет.
+"""
+import argparse
+import gc
+import importlib.util
+import os
+from dataclasses import dataclass, field
+from typing import List
+
+APP = "main:app"
+
+
+def module_available(name: str) -> bool:
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def cpu_count() -> int:
+    """Ядра, доступные процессу (с учётом taskset и ограничений контейнера по cpuset)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+@dataclass
+class ServeConfig:
+    host: str = "127.0.0.1"
+    port: int = 8000
+    workers: int = field(default_factory=cpu_count)
+    # Очередь ещё не принятых соединений (listen backlog)
+    backlog: int = 2048
+    # Сколько секунд держать простаивающее keep-alive соединение
+    keep_alive: int = 5
+    # Сколько секунд воркер дожидается текущих запросов при остановке и перезапуске
+    graceful_timeout: int = 30
+    preload: bool = True
+    server: str = "auto"
+    loop: str = "asyncio"
+    http: str = "h11"
+    worker_class: str = ""
+    warnings: List[str] = field(default_factory=list)
+
+
+def resolve_config(args: argparse.Namespace) -> ServeConfig:
+    """Итоговые настройки с учётом установленных пакетов"""
+    config = ServeConfig(
+        host=args.host, port=args.port, workers=max(1, args.workers), backlog=args.backlog,
+        keep_alive=args.keep_alive, graceful_timeout=args.graceful_timeout, preload=args.preload
+    )
+
+    if config.workers > 1 and not os.getenv("JWT_SECRET"):
+        # Без общего ключа каждый воркер подписывал бы токены своим случайным ключом
+        raise SystemExit("Для нескольких воркеров задайте JWT_SECRET (или --workers 1)")
+
+    gunicorn_available = module_available("gunicorn") and os.name != "nt"
+    if args.server == "gunicorn" and not gunicorn_available:
+        raise SystemExit("gunicorn не установлен: pip install gunicorn или --server uvicorn")
+    config.server = "gunicorn" if args.server in ("auto", "gunicorn") and gunicorn_available else "uvicorn"
+
+    config.loop = "uvloop" if module_available("uvloop") else "asyncio"
+    config.http = "httptools" if module_available("httptools") else "h11"
+    if config.loop == "asyncio":
+        config.warnings.append("uvloop не установлен: используется стандартный цикл asyncio")
+    if config.http == "h11":
+        config.warnings.append("httptools не установлен: используется парсер h11")
+
+    if config.server == "gunicorn":
+        config.worker_class = ("uvicorn_worker.UvicornWorker" if module_available("uvicorn_worker")
+                               else "uvicorn.workers.UvicornWorker")
+    elif config.preload:
+        config.preload = False
+        config.warnings.append("preload доступен только с gunicorn: каждый воркер прогревается сам")
+    return config
+
+
+def self_check(config: ServeConfig) -> List[str]:
+    """Печатает итоговую конфигурацию; возвращает предупреждения"""
+    from database import engine
+
+    cores = cpu_count()
+    pool = engine.pool
+    connections = getattr(pool, "size", lambda: 1)() + max(getattr(pool, "_max_overflow", 0), 0)
+
+    print("Конфигурация сервера:")
+    print(f"  адрес:             http://{config.host}:{config.port}")
+    print(f"  сервер:            {config.server}" + (f" ({config.worker_class})" if config.worker_class else ""))
+    print(f"  воркеры:           {config.workers} (ядер: {cores})")
+    print(f"  цикл событий:      {config.loop}")
+    print(f"  HTTP-парсер:       {config.http}")
+    print(f"  preload:           {'да' if config.preload else 'нет'}")
+    print(f"  keep-alive:        {config.keep_alive} с")
+    print(f"  backlog:           {config.backlog}")
+    print(f"  graceful timeout:  {config.graceful_timeout} с")
+    print(f"  соединений с БД:   до {connections} на воркер, до {connections * config.workers} всего "
+          f"({engine.dialect.name})")
+
+    warnings = list(config.warnings)
+    if config.workers > cores * 2:
+        warnings.append(f"воркеров больше, чем 2 × ядер ({cores}): процессы будут конкурировать за CPU")
+    if config.graceful_timeout < config.keep_alive:
+        warnings.append("graceful timeout меньше keep-alive: простаивающие соединения закроются при перезапуске")
+    for warning in warnings:
+        print(f"  ! {warning}")
+    return warnings
+
+
+def preload_app():
+    """Импорт и прогрев приложения в мастере перед fork воркеров"""
+    import main
+    from database import engine, replica_router
+
+    main.warm_up()
+    # Соединения нельзя делить между процессами: воркеры откроют свои
+    engine.dispose()
+    for reader in replica_router.readers:
+        reader.dispose()
+    # Объекты, созданные при загрузке, не трогает сборщик мусора — их страницы остаются общими
+    gc.collect()
+    gc.freeze()
+    return main.app
+
+
+def run_gunicorn(config: ServeConfig):
+    from gunicorn.app.base import BaseApplication
+
+    class ECommerceApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{config.host}:{config.port}",
+                "workers": config.workers,
+                "worker_class": config.worker_class,
+                "backlog": config.backlog,
+                "keepalive": config.keep_alive,
+                "graceful_timeout": config.graceful_timeout,
+                "preload_app": config.preload,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            if config.preload:
+                return preload_app()
+            from main import app
+            return app
+
+    ECommerceApplication().run()
+
+
+def run_uvicorn(config: ServeConfig):
+    import uvicorn
+
+    uvicorn.run(
+        APP,
+        host=config.host,
+        port=config.port,
+        workers=config.workers,
+        loop=config.loop,
+        http=config.http,
+        backlog=config.backlog,
+        timeout_keep_alive=config.keep_alive,
+        timeout_graceful_shutdown=config.graceful_timeout,
+    )
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    defaults = ServeConfig()
+    parser = argparse.ArgumentParser(description="Запуск E-Commerce приложения")
+    parser.add_argument("--host", default=os.getenv("HOST", defaults.host))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", defaults.port)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", defaults.workers)),
+                        help="число воркеров, по умолчанию — число ядер")
+    parser.add_argument("--backlog", type=int, default=defaults.backlog)
+    parser.add_argument("--keep-alive", type=int, default=defaults.keep_alive)
+    parser.add_argument("--graceful-timeout", type=int, default=defaults.graceful_timeout)
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="не загружать приложение в мастере gunicorn")
+    parser.add_argument("--server", choices=("auto", "gunicorn", "uvicorn"), default="auto")
+    parser.add_argument("--check", action="store_true", help="показать конфигурацию и выйти")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # static/ и templates/ подключаются по относительным путям
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    config = resolve_config(args)
+    self_check(config)
+    if args.check:
+        return config
+
+    if config.server == "gunicorn":
+        run_gunicorn(config)
+    else:
+        run_uvicorn(config)
+    return config
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# singleflight.py
+"""Объединение одинаковых одновременных запросов (single-flight).
+
+Когда кэш остыл, сотни одинаковых запросов каталога приходят разом.
+SingleFlight выполняет вычисление один раз на ключ — нормализованные
+параметры запроса — а остальные запросы ждут тот же результат. Вычисление
+идёт в пуле потоков как отдельная задача: отмена запроса-инициатора
+(клиент закрыл соединение) не обрывает его для остальных.
+
+По желанию результат живёт fresh_seconds, а ещё stale_seconds отдаётся
+устаревшим, пока в фоне считается новый (stale-while-revalidate).
+"""
+import asyncio
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+
+def normalize_key(route: str, params: Dict[str, Any]) -> Tuple:
+    """Ключ, одинаковый для запросов, которые отличаются только порядком параметров"""
+
+    def normalize(value):
+        if isinstance(value, (list, tuple, set)):
+            return tuple(sorted(normalize(item) for item in value))
+        if isinstance(value, str):
+            return value.strip()
+        return value
+
+    return (route,) + tuple(sorted(
+        (name, normalize(value)) for name, value in params.items() if value not in (None, "", [])
+    ))
+
+
+class SingleFlight:
+    def __init__(self, fresh_seconds: float = 0.0, stale_seconds: float = 0.0, max_entries: int = 1024):
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        # ключ -> (результат, время вычисления)
+        self._results: Dict[Hashable, Tuple[Any, float]] = {}
+        # Растёт при каждом сбросе: результат, начатый до сброса, не сохраняется
+        self._generation = 0
+        self.computations = 0
+
+    async def do(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Результат compute() для ключа; compute — синхронная функция, она выполняется в потоке"""
+        if self.fresh_seconds or self.stale_seconds:
+            cached = self._results.get(key)
+            if cached is not None:
+                value, computed_at = cached
+                age = time.monotonic() - computed_at
+                if age < self.fresh_seconds:
+                    return value
+                if age < self.fresh_seconds + self.stale_seconds:
+                    # Обновление в фоне; если оно уже идёт, второе не запускается
+                    self._start(key, compute)
+                    return value
+
+        # shield: отмена одного ожидающего не отменяет общее вычисление
+        return await asyncio.shield(self._start(key, compute))
+
+    def _start(self, key: Hashable, compute: Callable[[], Any]) -> asyncio.Future:
+        task = self._in_flight.get(key)
+        if task is not None:
+            return task
+
+        task = asyncio.ensure_future(self._compute(key, compute))
+        task.add_done_callback(self._report_failure)
+        self._in_flight[key] = task
+        return task
+
+    @staticmethod
+    def _report_failure(task: asyncio.Future):
+        # Фоновое обновление никто не ждёт: без этого ошибка потерялась бы
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Ошибка при вычислении запроса: {task.exception()}")
+
+    async def _compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        self.computations += 1
+        generation = self._generation
+        try:
+            value = await asyncio.to_thread(compute)
+            if (self.fresh_seconds or self.stale_seconds) and generation == self._generation:
+                if len(self._results) >= self.max_entries and key not in self._results:
+                    self._results.pop(next(iter(self._results)))
+                self._results[key] = (value, time.monotonic())
+            return value
+        finally:
+            # После сброса по ключу может идти уже новое вычисление
+            if self._in_flight.get(key) is asyncio.current_task():
+                del self._in_flight[key]
+
+    def invalidate(self, routes: Optional[Iterable[str]] = None):
+        """Забывает результаты всех или указанных маршрутов.
+
+        Вычисления, начатые до сброса, доводятся до конца для тех, кто их
+        ждёт, но новые запросы к ним уже не присоединяются.
+        """
+        self._generation += 1
+        routes = set(routes) if routes is not None else None
+        for storage in (self._results, self._in_flight):
+            if routes is None:
+                storage.clear()
+                continue
+            for key in [key for key in list(storage) if isinstance(key, tuple) and key and key[0] in routes]:
+                storage.pop(key, None)
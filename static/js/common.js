@@ -4,12 +4,16 @@ const API_BASE = 'http://localhost:8000/api';
 async function apiCall(endpoint, options = {}) {
     try {
         console.log(`API Call: ${API_BASE}${endpoint}`);
+        // Токен после /api/auth/login; без него запросы идут от демо-пользователя
+        const token = localStorage.getItem('access_token');
+        // headers после ...options: иначе заголовки вызова заменили бы Authorization
         const response = await fetch(`${API_BASE}${endpoint}`, {
+            ...options,
             headers: {
                 'Content-Type': 'application/json',
+                ...(token ? {'Authorization': `Bearer ${token}`} : {}),
                 ...options.headers
-            },
-            ...options
+            }
         });
 
         if (!response.ok) {
@@ -0,0 +1,185 @@
+# tracking.py
+"""Отслеживание отправлений у служб доставки.
+
+Фоновая задача раз в TRACKING_INTERVAL_SECONDS забирает из shipments
+отправления, которым пора проверить статус (next_check_at <= now), и
+спрашивает службы пачками: номера группируются по службе и делятся на
+запросы по max_tracking_batch номеров, одновременно идёт не больше
+TRACKING_CONCURRENCY запросов. Изменения записываются одним UPDATE на
+пачку, доставленные заказы переводятся в «Доставлен» через order_status,
+поэтому событие order.status_changed попадает в outbox и к подписчикам.
+
+Интервал опроса отправления удваивается после каждой проверки без
+изменений (до TRACKING_MAX_INTERVAL_SECONDS) и сбрасывается, когда статус
+меняется: застрявшие посылки почти не стоят запросов. Завершённые
+отправления (next_check_at = NULL) не опрашиваются вовсе.
+"""
+import asyncio
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from adapters import DELIVERY_ADAPTERS, DeliveryService
+from database import Order, Shipment
+from order_status import TRACKING_FINAL_STATES, can_transition, status_after_tracking, transition
+
+TRACKING_INTERVAL_SECONDS = float(os.getenv("TRACKING_INTERVAL_SECONDS", "60"))
+TRACKING_MAX_INTERVAL_SECONDS = float(os.getenv("TRACKING_MAX_INTERVAL_SECONDS", str(6 * 3600)))
+TRACKING_CONCURRENCY = int(os.getenv("TRACKING_CONCURRENCY", "8"))
+# Сколько отправлений забирается за один проход
+TRACKING_CLAIM_SIZE = int(os.getenv("TRACKING_CLAIM_SIZE", "5000"))
+# На это время забранные отправления скрыты от других воркеров
+TRACKING_LEASE_SECONDS = 300
+
+
+def next_check_delay(unchanged_checks: int, interval: float = TRACKING_INTERVAL_SECONDS,
+                     max_interval: float = TRACKING_MAX_INTERVAL_SECONDS) -> float:
+    return min(interval * 2 ** min(unchanged_checks, 30), max_interval)
+
+
+def record_shipment(db: Session, order: Order, provider: str, tracking_id: str,
+                    interval: float = TRACKING_INTERVAL_SECONDS) -> Shipment:
+    """Новое отправление заказа; фиксация транзакции остаётся за вызывающим кодом"""
+    shipment = Shipment(
+        order_id=order.id,
+        provider=provider,
+        tracking_id=tracking_id,
+        carrier_status="registered",
+        next_check_at=datetime.now() + timedelta(seconds=interval),
+    )
+    db.add(shipment)
+    return shipment
+
+
+class ShipmentTracker:
+    def __init__(self, session_factory, adapters: Optional[Dict[str, DeliveryService]] = None,
+                 concurrency: int = TRACKING_CONCURRENCY, claim_size: int = TRACKING_CLAIM_SIZE,
+                 interval: float = TRACKING_INTERVAL_SECONDS,
+                 max_interval: float = TRACKING_MAX_INTERVAL_SECONDS):
+        self.session_factory = session_factory
+        self.adapters = adapters if adapters is not None else {
+            code: adapter_class() for code, adapter_class in DELIVERY_ADAPTERS.items()
+        }
+        self.concurrency = concurrency
+        self.claim_size = claim_size
+        self.interval = interval
+        self.max_interval = max_interval
+        self.requests = 0
+
+    def claim_due(self) -> list:
+        """Отправления, которым пора проверить статус; остальные воркеры их пропускают"""
+        now = datetime.now()
+        db = self.session_factory()
+        try:
+            shipments = db.execute(
+                select(Shipment.id, Shipment.order_id, Shipment.provider, Shipment.tracking_id,
+                       Shipment.carrier_status, Shipment.unchanged_checks)
+                .where(Shipment.next_check_at <= now)
+                .order_by(Shipment.next_check_at)
+                .limit(self.claim_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if shipments:
+                # Если воркер упадёт посреди опроса, отправления вернутся в очередь после аренды
+                db.execute(
+                    update(Shipment)
+                    .where(Shipment.id.in_([shipment.id for shipment in shipments]))
+                    .values(next_check_at=now + timedelta(seconds=TRACKING_LEASE_SECONDS))
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+            return shipments
+        finally:
+            db.close()
+
+    async def fetch_statuses(self, shipments: list) -> Dict[Tuple[str, str], str]:
+        """Статусы от служб: (служба, номер) -> статус; номера без ответа пропускаются"""
+        numbers = defaultdict(dict)
+        for shipment in shipments:
+            numbers[shipment.provider][shipment.tracking_id] = None
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(provider: str, adapter: DeliveryService, batch: List[str]) -> list:
+            async with semaphore:
+                self.requests += 1
+                try:
+                    statuses = await adapter.track_shipments(batch)
+                except Exception as e:
+                    # Пачка просто проверится позже, как отправления без изменений
+                    print(f"Ошибка запроса статусов {provider}: {e}")
+                    return []
+            return [((provider, tracking_id), status) for tracking_id, status in statuses.items()]
+
+        requests = []
+        for provider, tracking_ids in numbers.items():
+            adapter = self.adapters.get(provider)
+            if adapter is None:
+                print(f"Нет адаптера службы доставки {provider}")
+                continue
+            tracking_ids = list(tracking_ids)
+            for start in range(0, len(tracking_ids), adapter.max_tracking_batch):
+                requests.append(fetch(provider, adapter, tracking_ids[start:start + adapter.max_tracking_batch]))
+
+        statuses = {}
+        for answered in await asyncio.gather(*requests):
+            statuses.update(answered)
+        return statuses
+
+    def apply(self, shipments: list, statuses: Dict[Tuple[str, str], str]) -> int:
+        """Записывает результаты опроса; возвращает число изменившихся отправлений"""
+        now = datetime.now()
+        rows = []
+        order_statuses = {}
+        for shipment in shipments:
+            status = statuses.get((shipment.provider, shipment.tracking_id), shipment.carrier_status)
+            unchanged_checks = shipment.unchanged_checks + 1 if status == shipment.carrier_status else 0
+            final = status in TRACKING_FINAL_STATES
+            rows.append({
+                "id": shipment.id,
+                "carrier_status": status,
+                "checked_at": now,
+                "unchanged_checks": min(unchanged_checks, 100),
+                "next_check_at": None if final else now + timedelta(
+                    seconds=next_check_delay(unchanged_checks, self.interval, self.max_interval)
+                ),
+            })
+            if status_after_tracking(status):
+                order_statuses[shipment.order_id] = status_after_tracking(status)
+
+        db = self.session_factory()
+        try:
+            # Одна пачка UPDATE по первичному ключу на все отправления
+            db.execute(update(Shipment), rows)
+            if order_statuses:
+                orders = db.scalars(
+                    select(Order).where(Order.id.in_(list(order_statuses))).with_for_update()
+                ).all()
+                for order in orders:
+                    # Отменённый или уже доставленный заказ не трогаем
+                    if can_transition(order.status, order_statuses[order.id]):
+                        transition(order, order_statuses[order.id])
+            db.commit()
+        finally:
+            db.close()
+        return sum(1 for row in rows if row["unchanged_checks"] == 0)
+
+    def track_once(self) -> int:
+        shipments = self.claim_due()
+        if not shipments:
+            return 0
+        statuses = asyncio.run(self.fetch_statuses(shipments))
+        self.apply(shipments, statuses)
+        return len(shipments)
+
+    def track_due(self) -> int:
+        """Проверяет все отправления, которым пора; возвращает их число"""
+        checked = 0
+        while True:
+            count = self.track_once()
+            checked += count
+            if count < self.claim_size:
+                return checked